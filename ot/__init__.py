@@ -18,11 +18,13 @@ from . import utils
 from . import datasets
 from . import da
 from . import gromov
+from . import unbalanced
 
 # OT functions
 from .lp import emd, emd2
 from .bregman import sinkhorn, sinkhorn2, barycenter
 from .da import sinkhorn_lpl1_mm
+from .unbalanced import sinkhorn_unbalanced
 
 # utils functions
 from .utils import dist, unif, tic, toc, toq
@@ -31,4 +33,5 @@ __version__ = "0.4.0"
 
 __all__ = ["emd", "emd2", "sinkhorn", "sinkhorn2", "utils", 'datasets',
            'bregman', 'lp', 'tic', 'toc', 'toq', 'gromov',
-           'dist', 'unif', 'barycenter', 'sinkhorn_lpl1_mm', 'da', 'optim']
+           'dist', 'unif', 'barycenter', 'sinkhorn_lpl1_mm', 'da', 'optim',
+           'unbalanced', 'sinkhorn_unbalanced']
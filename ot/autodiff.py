@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Differentiable OT losses (autograd primitives)
+"""
+
+# License: MIT License
+
+from autograd.extend import primitive, defvjp
+from autograd.tracer import getval
+
+from .lp import emd2 as emd2_np
+from .bregman import sinkhorn2 as sinkhorn2_np
+
+
+@primitive
+def ot_loss(a, b, M, W, grad_a, grad_b, grad_M):
+    """Return the OT loss W with known gradients wrt a, b and M (autograd)
+    """
+    return W
+
+
+defvjp(ot_loss,
+       lambda ans, a, b, M, W, grad_a, grad_b, grad_M: lambda g: g * grad_a,
+       lambda ans, a, b, M, W, grad_a, grad_b, grad_M: lambda g: g * grad_b,
+       lambda ans, a, b, M, W, grad_a, grad_b, grad_M: lambda g: g * grad_M)
+
+
+def emd2(a, b, M, numItermax=100000):
+    """Earth Movers distance differentiable with autograd
+
+    The loss is computed with ot.emd2 and its gradients with respect to a,
+    b and M are given by the solution of the problem (centered dual
+    potentials and OT matrix, see the grad parameter of ot.emd2), so that
+    the gradient costs a single solve. Gradients with respect to the
+    positions of the samples are obtained by computing M with autograd.numpy
+    (for instance with ot.dr.dist).
+
+    Parameters
+    ----------
+    a : (ns,) ndarray, float64
+        Source histogram (uniform weigth if empty list)
+    b : (nt,) ndarray, float64
+        Target histogram (uniform weigth if empty list)
+    M : (ns,nt) ndarray, float64
+        loss matrix
+    numItermax : int, optional (default=100000)
+        The maximum number of iterations before stopping the optimization
+        algorithm if it has not converged.
+
+    Returns
+    -------
+    W : float
+        Optimal transportation loss
+
+    See Also
+    --------
+    ot.lp.emd2 : Earth Movers distance
+
+    """
+
+    W, log = emd2_np(getval(a), getval(b), getval(M), numItermax=numItermax,
+                     grad=True)
+    return ot_loss(a, b, M, W, log['grad_a'], log['grad_b'], log['grad_M'])
+
+
+def sinkhorn2(a, b, M, reg, method='sinkhorn', numItermax=1000, stopThr=1e-9,
+              **kwargs):
+    """Entropic regularized OT loss differentiable with autograd
+
+    The function returns the regularized loss
+
+    .. math::
+        W = \min_\gamma <\gamma,M>_F + reg\cdot\Omega(\gamma)
+
+    of the OT matrix computed by ot.sinkhorn. Its gradients with respect to
+    a, b and M are given by the solution of the problem (centered dual
+    potentials and OT matrix, see the grad parameter of ot.sinkhorn2), so
+    that the gradient costs a single solve instead of differentiating
+    through the Sinkhorn iterations as in ot.dr.sinkhorn.
+
+    Parameters
+    ----------
+    a : np.ndarray (ns,)
+        samples weights in the source domain
+    b : np.ndarray (nt,)
+        samples weights in the target domain
+    M : np.ndarray (ns,nt)
+        loss matrix
+    reg : float
+        Regularization term >0
+    method : str
+        method used for the solver (see ot.sinkhorn2)
+    numItermax : int, optional
+        Max number of iterations
+    stopThr : float, optional
+        Stop threshol on error (>0)
+
+    Returns
+    -------
+    W : float
+        Entropic regularized optimal transportation loss
+
+    See Also
+    --------
+    ot.bregman.sinkhorn2 : Entropic regularized OT loss
+
+    """
+
+    # with grad=True the regularized loss and its gradients are in the log
+    _, log = sinkhorn2_np(getval(a), getval(b), getval(M), reg, method=method,
+                          numItermax=numItermax, stopThr=stopThr, grad=True,
+                          **kwargs)
+    return ot_loss(a, b, M, log['reg_loss'][0], log['grad_a'], log['grad_b'],
+                   log['grad_M'])
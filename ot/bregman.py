@@ -8,7 +8,14 @@ Bregman projections for regularized OT
 #
 # License: MIT License
 
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
 import numpy as np
+import scipy.optimize
+import scipy.sparse as sp
+from scipy.special import logsumexp
+from .utils import dist, check_random_state
 
 
 def sinkhorn(a, b, M, reg, method='sinkhorn', numItermax=1000,
@@ -42,13 +49,22 @@ def sinkhorn(a, b, M, reg, method='sinkhorn', numItermax=1000,
     b : np.ndarray (nt,) or np.ndarray (nt,nbb)
         samples in the target domain, compute sinkhorn with multiple targets
         and fixed M if b is a matrix (return OT loss + dual variables in log)
-    M : np.ndarray (ns,nt)
-        loss matrix
+    M : np.ndarray (ns,nt) or np.ndarray (nbatch,ns,nt)
+        loss matrix, a stack of loss matrices is solved as independent
+        problems with ot.bregman.sinkhorn_batch, a np.memmap or the path of a
+        .npy file is read by blocks with ot.bregman.sinkhorn_memmap
     reg : float
         Regularization term >0
     method : str
-        method used for the solver either 'sinkhorn',  'sinkhorn_stabilized' or
-        'sinkhorn_epsilon_scaling', see those function for specific parameters
+        method used for the solver either 'sinkhorn', 'sinkhorn_stabilized',
+        'sinkhorn_epsilon_scaling', 'sinkhorn_parallel', 'sinkhorn_newton',
+        'lbfgs_dual', 'lbfgs_semidual' or 'greenkhorn', see those function
+        for specific parameters. A 'greenkhorn' iteration updates a single
+        row or column, so its budget is scaled to numItermax*(ns+nt)
+        iterations (numItermax sweeps over all the rows and columns). The
+        solvers between samples ot.bregman.sinkhorn_nystrom and
+        ot.bregman.sinkhorn_lazy are not available here since they take the
+        samples Xs, Xt instead of M
     numItermax : int, optional
         Max number of iterations
     stopThr : float, optional
@@ -66,6 +82,16 @@ def sinkhorn(a, b, M, reg, method='sinkhorn', numItermax=1000,
     log : dict
         log dictionary return only if log==True in parameters
 
+    Notes
+    -----
+    The bins with zero mass in a and b (in all the targets) are removed
+    before solving the problem (for a loss matrix in memory) and the OT
+    matrix and the scalings are filled back with zeros (the dual potentials
+    with -inf), which saves the computations on empty bins of sparse
+    histograms and avoids the divisions by zero. The solvers
+    ot.bregman.sinkhorn_knopp, ot.bregman.sinkhorn_stabilized and
+    ot.bregman.greenkhorn do the same when they are called directly.
+
     Examples
     --------
 
@@ -87,6 +113,8 @@ def sinkhorn(a, b, M, reg, method='sinkhorn', numItermax=1000,
 
     .. [10] Chizat, L., Peyré, G., Schmitzer, B., & Vialard, F. X. (2016). Scaling algorithms for unbalanced transport problems. arXiv preprint arXiv:1607.05816.
 
+    .. [16] J. Altschuler, J. Weed, P. Rigollet, (2017) Near-linear time approximation algorithms for optimal transport via Sinkhorn iteration, Advances in Neural Information Processing Systems (NIPS) 31
+
 
 
     See Also
@@ -96,33 +124,36 @@ def sinkhorn(a, b, M, reg, method='sinkhorn', numItermax=1000,
     ot.bregman.sinkhorn_knopp : Classic Sinkhorn [2]
     ot.bregman.sinkhorn_stabilized: Stabilized sinkhorn [9][10]
     ot.bregman.sinkhorn_epsilon_scaling: Sinkhorn with epslilon scaling [9][10]
+    ot.bregman.sinkhorn_parallel : Compiled parallel Sinkhorn [2]
+    ot.bregman.sinkhorn_newton : Sinkhorn-Newton [21]
+    ot.bregman.sinkhorn_lbfgs : L-BFGS on the dual or semi-dual [22]
+    ot.bregman.greenkhorn : Greedy coordinate Sinkhorn [16]
+    ot.bregman.sinkhorn_batch : Sinkhorn on a stack of problems
+    ot.bregman.sinkhorn_nystrom : Sinkhorn between samples with a low rank kernel [18]
+    ot.bregman.sinkhorn_lazy : Sinkhorn between samples without storing M
+    ot.bregman.sinkhorn_memmap : Sinkhorn with M stored on disk
 
     """
 
-    if method.lower() == 'sinkhorn':
-        def sink():
-            return sinkhorn_knopp(a, b, M, reg, numItermax=numItermax,
-                                  stopThr=stopThr, verbose=verbose, log=log, **kwargs)
-    elif method.lower() == 'sinkhorn_stabilized':
-        def sink():
-            return sinkhorn_stabilized(a, b, M, reg, numItermax=numItermax,
-                                       stopThr=stopThr, verbose=verbose, log=log, **kwargs)
-    elif method.lower() == 'sinkhorn_epsilon_scaling':
-        def sink():
-            return sinkhorn_epsilon_scaling(
-                a, b, M, reg, numItermax=numItermax,
-                stopThr=stopThr, verbose=verbose, log=log, **kwargs)
-    else:
-        print('Warning : unknown method using classic Sinkhorn Knopp')
+    if np.ndim(M) == 3:
+        # stack of independent problems
+        return sinkhorn_batch(a, b, M, reg, numItermax=numItermax,
+                              stopThr=stopThr, verbose=verbose, log=log, **kwargs)
 
-        def sink():
-            return sinkhorn_knopp(a, b, M, reg, **kwargs)
+    red = reduce_support(a, b, M, kwargs)
+    if red is None:
+        return _dispatch(method, a, b, M, reg, numItermax, stopThr, verbose,
+                         log, **kwargs)
 
-    return sink()
+    # solve on the support of the weights
+    ar, br, Mr, ia, ib = red
+    return expand_support(_dispatch(method, ar, br, Mr, reg, numItermax,
+                                    stopThr, verbose, log, **kwargs),
+                          ia, ib, log)
 
 
 def sinkhorn2(a, b, M, reg, method='sinkhorn', numItermax=1000,
-              stopThr=1e-9, verbose=False, log=False, **kwargs):
+              stopThr=1e-9, verbose=False, log=False, grad=False, **kwargs):
     u"""
     Solve the entropic regularization optimal transport problem and return the loss
 
@@ -152,13 +183,22 @@ def sinkhorn2(a, b, M, reg, method='sinkhorn', numItermax=1000,
     b : np.ndarray (nt,) or np.ndarray (nt,nbb)
         samples in the target domain, compute sinkhorn with multiple targets
         and fixed M if b is a matrix (return OT loss + dual variables in log)
-    M : np.ndarray (ns,nt)
-        loss matrix
+    M : np.ndarray (ns,nt) or np.ndarray (nbatch,ns,nt)
+        loss matrix, a stack of loss matrices is solved as independent
+        problems with ot.bregman.sinkhorn_batch, a np.memmap or the path of a
+        .npy file is read by blocks with ot.bregman.sinkhorn_memmap
     reg : float
         Regularization term >0
     method : str
-        method used for the solver either 'sinkhorn',  'sinkhorn_stabilized' or
-        'sinkhorn_epsilon_scaling', see those function for specific parameters
+        method used for the solver either 'sinkhorn', 'sinkhorn_stabilized',
+        'sinkhorn_epsilon_scaling', 'sinkhorn_parallel', 'sinkhorn_newton',
+        'lbfgs_dual', 'lbfgs_semidual' or 'greenkhorn', see those function
+        for specific parameters. A 'greenkhorn' iteration updates a single
+        row or column, so its budget is scaled to numItermax*(ns+nt)
+        iterations (numItermax sweeps over all the rows and columns). The
+        solvers between samples ot.bregman.sinkhorn_nystrom and
+        ot.bregman.sinkhorn_lazy are not available here since they take the
+        samples Xs, Xt instead of M
     numItermax : int, optional
         Max number of iterations
     stopThr : float, optional
@@ -167,14 +207,28 @@ def sinkhorn2(a, b, M, reg, method='sinkhorn', numItermax=1000,
         Print information along iterations
     log : bool, optional
         record log if True
+    grad : bool, optional
+        If True, returns in the log the regularized loss
+        :math:`<\gamma,M>_F + reg\cdot\Omega(\gamma)` (key 'reg_loss')
+        and its gradients with respect to a, b and M (keys 'grad_a', 'grad_b'
+        and 'grad_M', with one gradient per target or per problem). They are given by the
+        solution of the problem (envelope theorem): the dual potentials
+        :math:`\\alpha=reg\log(u)` and :math:`\\beta=reg\log(v)` centered
+        (gradients on the simplex) and the OT matrix, so no additional
+        iteration is needed. For the bins without mass, where the entropy
+        makes the derivative infinite, the potentials are extended by their
+        c-transform. Not available for a loss matrix stored on disk.
 
 
     Returns
     -------
     W : (nt) ndarray or float
-        Optimal transportation matrix for the given parameters
+        Optimal transportation loss :math:`<\gamma,M>_F` for the given
+        parameters (one per problem if M is a stack of loss matrices)
     log : dict
-        log dictionary return only if log==True in parameters
+        log dictionary return only if log==True or grad==True in parameters,
+        with the regularized loss (key 'reg_loss') and its gradients if
+        grad==True
 
     Examples
     --------
@@ -197,6 +251,8 @@ def sinkhorn2(a, b, M, reg, method='sinkhorn', numItermax=1000,
 
     .. [10] Chizat, L., Peyré, G., Schmitzer, B., & Vialard, F. X. (2016). Scaling algorithms for unbalanced transport problems. arXiv preprint arXiv:1607.05816.
 
+    .. [16] J. Altschuler, J. Weed, P. Rigollet, (2017) Near-linear time approximation algorithms for optimal transport via Sinkhorn iteration, Advances in Neural Information Processing Systems (NIPS) 31
+
 
 
     See Also
@@ -206,37 +262,203 @@ def sinkhorn2(a, b, M, reg, method='sinkhorn', numItermax=1000,
     ot.bregman.sinkhorn_knopp : Classic Sinkhorn [2]
     ot.bregman.sinkhorn_stabilized: Stabilized sinkhorn [9][10]
     ot.bregman.sinkhorn_epsilon_scaling: Sinkhorn with epslilon scaling [9][10]
+    ot.bregman.sinkhorn_parallel : Compiled parallel Sinkhorn [2]
+    ot.bregman.sinkhorn_newton : Sinkhorn-Newton [21]
+    ot.bregman.sinkhorn_lbfgs : L-BFGS on the dual or semi-dual [22]
+    ot.bregman.greenkhorn : Greedy coordinate Sinkhorn [16]
+    ot.bregman.sinkhorn_batch : Sinkhorn on a stack of problems
+    ot.bregman.sinkhorn_nystrom : Sinkhorn between samples with a low rank kernel [18]
+    ot.bregman.sinkhorn_lazy : Sinkhorn between samples without storing M
+    ot.bregman.sinkhorn_memmap : Sinkhorn with M stored on disk
 
     """
 
-    if method.lower() == 'sinkhorn':
-        def sink():
-            return sinkhorn_knopp(a, b, M, reg, numItermax=numItermax,
-                                  stopThr=stopThr, verbose=verbose, log=log, **kwargs)
-    elif method.lower() == 'sinkhorn_stabilized':
-        def sink():
-            return sinkhorn_stabilized(a, b, M, reg, numItermax=numItermax,
-                                       stopThr=stopThr, verbose=verbose, log=log, **kwargs)
-    elif method.lower() == 'sinkhorn_epsilon_scaling':
-        def sink():
-            return sinkhorn_epsilon_scaling(
-                a, b, M, reg, numItermax=numItermax,
-                stopThr=stopThr, verbose=verbose, log=log, **kwargs)
+    if grad and isinstance(M, (str, np.memmap)):
+        print('Warning: gradients are not computed for a loss matrix on disk')
+        grad = False
+
+    # the gradients are computed from the dual potentials in the log
+    log = log or grad
+
+    if np.ndim(M) == 3:
+        # stack of independent problems, return one loss per problem
+        M = np.asarray(M, dtype=np.float64)
+        res = sinkhorn_batch(a, b, M, reg, numItermax=numItermax,
+                             stopThr=stopThr, verbose=verbose, log=log, **kwargs)
+        if log:
+            if grad:
+                alpha, beta = res[1]['warmstart']
+                res[1]['grad_a'] = alpha - np.mean(alpha, 1, keepdims=True)
+                res[1]['grad_b'] = beta - np.mean(beta, 1, keepdims=True)
+                res[1]['grad_M'] = res[0]
+                res[1]['reg_loss'] = _regularized_loss(res[0], M, reg)
+            return np.einsum('kij,kij->k', res[0], M), res[1]
+        else:
+            return np.einsum('kij,kij->k', res, M)
+
+    b = np.asarray(b, dtype=np.float64)
+    b1d = len(b.shape) < 2
+    if b1d:
+        b = b.reshape((-1, 1))
+
+    red = reduce_support(a, b, M, kwargs)
+    if red is None:
+        res = _dispatch(method, a, b, M, reg, numItermax, stopThr, verbose,
+                        log, **kwargs)
     else:
+        # solve on the support of the weights
+        ar, br, Mr, ia, ib = red
+        res = expand_support(_dispatch(method, ar, br, Mr, reg, numItermax,
+                                       stopThr, verbose, log, **kwargs),
+                             ia, ib, log)
+
+    if not grad:
+        return res
+
+    log = res[1]
+
+    # gradients of the regularized loss from the dual potentials
+    M = np.asarray(M, dtype=np.float64)
+    alpha, beta = log['warmstart']
+    alpha = np.asarray(alpha, dtype=np.float64).reshape((M.shape[0], -1))
+    beta = np.asarray(beta, dtype=np.float64).reshape((M.shape[1], -1))
+    log['grad_M'] = np.exp((alpha.T[:, :, None] + beta.T[:, None, :] -
+                            M[None, :, :]) / reg)
+
+    # the potentials of the bins without mass are given by the c-transform
+    alpha2, beta2 = alpha.copy(), beta.copy()
+    for k in range(alpha.shape[1]):
+        ia = ~np.isfinite(alpha[:, k])
+        if np.any(ia):
+            alpha2[ia, k] = -reg * logsumexp((beta[None, :, k] - M[ia]) / reg, 1)
+        ib = ~np.isfinite(beta[:, k])
+        if np.any(ib):
+            beta2[ib, k] = -reg * logsumexp((alpha[:, k, None] - M[:, ib]) / reg, 0)
+
+    log['grad_a'] = alpha2 - np.mean(alpha2, 0)
+    log['grad_b'] = beta2 - np.mean(beta2, 0)
+
+    # the loss whose gradients are returned
+    log['reg_loss'] = _regularized_loss(log['grad_M'], M, reg)
+
+    if b1d:
+        log['grad_a'] = log['grad_a'][:, 0]
+        log['grad_b'] = log['grad_b'][:, 0]
+        log['grad_M'] = log['grad_M'][0]
+
+    return res[0], log
+
+
+def _dispatch(method, a, b, M, reg, numItermax, stopThr, verbose, log,
+              **kwargs):
+    """Solve the problem (a, b, M) with the solver of sinkhorn and sinkhorn2
+    selected by method"""
+    if isinstance(M, (str, np.memmap)):
+        # cost matrix on disk, read by blocks
+        return sinkhorn_memmap(a, b, M, reg, numItermax=numItermax,
+                               stopThr=stopThr, verbose=verbose, log=log,
+                               **kwargs)
+
+    method = method.lower()
+    if method in ['lbfgs_dual', 'lbfgs_semidual']:
+        return sinkhorn_lbfgs(a, b, M, reg, semi_dual=method == 'lbfgs_semidual',
+                              numItermax=numItermax, stopThr=stopThr,
+                              verbose=verbose, log=log, **kwargs)
+    if method == 'greenkhorn':
+        # greenkhorn iterations update a single row or column
+        numItermax = numItermax * sum(np.shape(M))
+
+    solvers = {'sinkhorn': sinkhorn_knopp,
+               'sinkhorn_stabilized': sinkhorn_stabilized,
+               'sinkhorn_epsilon_scaling': sinkhorn_epsilon_scaling,
+               'sinkhorn_parallel': sinkhorn_parallel,
+               'sinkhorn_newton': sinkhorn_newton,
+               'greenkhorn': greenkhorn}
+    if method not in solvers:
         print('Warning : unknown method using classic Sinkhorn Knopp')
+    solver = solvers.get(method, sinkhorn_knopp)
+
+    return solver(a, b, M, reg, numItermax=numItermax, stopThr=stopThr,
+                  verbose=verbose, log=log, **kwargs)
+
+
+def _regularized_loss(G, M, reg):
+    """return the entropic regularized losses <G,M>+reg*sum(G*log(G)) of a
+    stack of OT matrices G (nbb,ns,nt)"""
+    return np.sum(G * M, (1, 2)) + \
+        reg * np.sum(G * np.log(np.maximum(G, 1e-300)), (1, 2))
+
 
-        def sink():
-            return sinkhorn_knopp(a, b, M, reg, **kwargs)
+def reduce_support(a, b, M, kwargs):
+    """Remove the bins with zero mass from an OT problem
 
+    Return None if there is nothing to remove (or M is not an array in
+    memory), else the reduced problem a, b, M and the boolean masks of the
+    support. The warmstart in kwargs is reduced in place.
+    """
+    if np.ndim(M) != 2 or isinstance(M, (str, np.memmap)):
+        return None
+
+    a = np.asarray(a, dtype=np.float64)
     b = np.asarray(b, dtype=np.float64)
-    if len(b.shape) < 2:
-        b = b.reshape((-1, 1))
+    if len(a) == 0 or len(b) == 0:
+        return None
+
+    ia = a > 0
+    ib = b > 0 if b.ndim == 1 else np.any(b > 0, 1)
+    if np.all(ia) and np.all(ib):
+        return None
+
+    M = np.asarray(M, dtype=np.float64)[ia, :][:, ib]
+    if kwargs.get('warmstart') is not None:
+        alpha, beta = kwargs['warmstart']
+        kwargs['warmstart'] = (np.asarray(alpha)[ia], np.asarray(beta)[ib])
+
+    return a[ia], b[ib], M, ia, ib
+
 
-    return sink()
+def expand_support(res, ia, ib, log):
+    """Fill back with zeros the solution of a problem reduced with reduce_support
+    """
+    def expand(x, mask, fill):
+        x = np.asarray(x)
+        xf = np.full((len(mask),) + x.shape[1:], fill)
+        xf[mask] = x
+        return xf
+
+    if log:
+        res, log = res
+        for key, mask, fill in [('u', ia, 0), ('v', ib, 0),
+                                ('alpha', ia, -np.inf), ('beta', ib, -np.inf),
+                                ('logu', ia, -np.inf), ('logv', ib, -np.inf)]:
+            if key in log:
+                log[key] = expand(log[key], mask, fill)
+        if 'warmstart' in log:
+            log['warmstart'] = (expand(log['warmstart'][0], ia, -np.inf),
+                                expand(log['warmstart'][1], ib, -np.inf))
+
+    if sp.issparse(res):
+        # sparse OT matrix (sparse_thr), indices mapped to the full problem
+        res = res.tocoo()
+        res = sp.csr_matrix((res.data, (np.flatnonzero(ia)[res.row],
+                                        np.flatnonzero(ib)[res.col])),
+                            shape=(len(ia), len(ib)))
+    elif np.ndim(res) == 2:
+        # OT matrix
+        G = np.zeros((len(ia), len(ib)))
+        G[np.ix_(ia, ib)] = res
+        res = G
+
+    if log:
+        return res, log
+    else:
+        return res
 
 
-def sinkhorn_knopp(a, b, M, reg, numItermax=1000,
-                   stopThr=1e-9, verbose=False, log=False, **kwargs):
+def sinkhorn_knopp(a, b, M, reg, numItermax=1000, stopThr=1e-9,
+                   acceleration=None, warmup=20, depth=5, warmstart=None,
+                   stopping=None, print_period=10, verbose=False,
+                   log=False, **kwargs):
     """
     Solve the entropic regularization optimal transport problem and return the OT matrix
 
@@ -258,6 +480,32 @@ def sinkhorn_knopp(a, b, M, reg, numItermax=1000,
 
     The algorithm used for solving the problem is the Sinkhorn-Knopp matrix scaling algorithm as proposed in [2]_
 
+    The iterations can be accelerated for small regularization with
+    acceleration='overrelaxation', where the scalings are over-relaxed as
+    :math:`u\leftarrow u^{1-\omega}(a/Kv)^\omega` with the parameter
+    :math:`\omega=2/(1+\sqrt{1-\rho})` estimated from the convergence rate
+    :math:`\rho` of the warmup first iterations [19]_, or with
+    acceleration='anderson', where the fixed point iterations on
+    :math:`\log(u)` are extrapolated from the last depth iterates [20]_
+    (with mixing weights computed separately for each target). In both cases the accelerated steps fall back to the plain Sinkhorn
+    iterations when the error increases.
+
+    The error used for stopping is computed every print_period iterations
+    and is chosen with stopping (default is 'marginal' for one target and
+    'potentials' for multiple targets):
+
+    - 'marginal' : squared norm of the violation of the target marginal
+      :math:`\|v\odot K^Tu-b\|^2`
+    - 'potentials' : relative change of the scalings
+      :math:`u=\exp(\alpha/reg)` and :math:`v=\exp(\beta/reg)` during the
+      last iteration
+    - 'gap' : duality gap :math:`|<\beta,v\odot K^Tu-b>|` between the
+      primal and dual objectives of the current potentials
+
+    The marginal and the gap are evaluated on the iterate before the last
+    update with the product :math:`K^Tu` of the update, so that no
+    additional pass on K is needed.
+
 
     Parameters
     ----------
@@ -274,6 +522,22 @@ def sinkhorn_knopp(a, b, M, reg, numItermax=1000,
         Max number of iterations
     stopThr : float, optional
         Stop threshol on error (>0)
+    acceleration : str, optional
+        None (default), 'overrelaxation' or 'anderson'
+    warmup : int, optional
+        Number of plain iterations used to estimate the over-relaxation
+        parameter (>=2)
+    depth : int, optional
+        Number of previous iterates used in the Anderson acceleration
+    warmstart : tuple of vectors, optional
+        if given then starting values (alpha, beta) for the dual potentials,
+        the scalings are initialized to :math:`u=\exp(\\alpha/reg)` and
+        :math:`v=\exp(\\beta/reg)` (see log['warmstart'])
+    stopping : str, optional
+        Stopping criterion either 'marginal', 'potentials' or 'gap' (see
+        above)
+    print_period : int, optional
+        Number of iterations between two evaluations of the error
     verbose : bool, optional
         Print information along iterations
     log : bool, optional
@@ -304,6 +568,10 @@ def sinkhorn_knopp(a, b, M, reg, numItermax=1000,
 
     .. [2] M. Cuturi, Sinkhorn Distances : Lightspeed Computation of Optimal Transport, Advances in Neural Information Processing Systems (NIPS) 26, 2013
 
+    .. [19] Thibault, A., Chizat, L., Dossal, C., & Papadakis, N. (2017). Overrelaxed Sinkhorn-Knopp algorithm for regularized optimal transport. arXiv preprint arXiv:1711.01851.
+
+    .. [20] Walker, H. F., & Ni, P. (2011). Anderson acceleration for fixed-point iterations. SIAM Journal on Numerical Analysis, 49(4), 1715-1735.
+
 
     See Also
     --------
@@ -321,6 +589,18 @@ def sinkhorn_knopp(a, b, M, reg, numItermax=1000,
     if len(b) == 0:
         b = np.ones((M.shape[1],), dtype=np.float64) / M.shape[1]
 
+    ws = {'warmstart': warmstart}
+    red = reduce_support(a, b, M, ws)
+    if red is not None:
+        # solve on the support of the weights (1/a is infinite on the bins
+        # without mass)
+        ar, br, Mr, ia, ib = red
+        return expand_support(sinkhorn_knopp(
+            ar, br, Mr, reg, numItermax=numItermax, stopThr=stopThr,
+            acceleration=acceleration, warmup=warmup, depth=depth,
+            warmstart=ws['warmstart'], stopping=stopping,
+            print_period=print_period, verbose=verbose, log=log), ia, ib, log)
+
     # init data
     Nini = len(a)
     Nfin = len(b)
@@ -330,12 +610,24 @@ def sinkhorn_knopp(a, b, M, reg, numItermax=1000,
     else:
         nbb = 0
 
+    if stopping is None:
+        stopping = 'potentials' if nbb else 'marginal'
+    elif stopping not in ['marginal', 'potentials', 'gap']:
+        print('Warning : unknown stopping criterion using marginal')
+        stopping = 'marginal'
+
     if log:
-        log = {'err': []}
+        log = {'err': [], 'stopping': stopping}
 
     # we assume that no distances are null except those of the diagonal of
     # distances
-    if nbb:
+    if warmstart is not None:
+        u = np.exp(np.asarray(warmstart[0], dtype=np.float64) / reg)
+        v = np.exp(np.asarray(warmstart[1], dtype=np.float64) / reg)
+        if nbb:
+            u = u.reshape((Nini, -1)) * np.ones((1, nbb))
+            v = v.reshape((Nfin, -1)) * np.ones((1, nbb))
+    elif nbb:
         u = np.ones((Nini, nbb)) / Nini
         v = np.ones((Nfin, nbb)) / Nfin
     else:
@@ -348,38 +640,106 @@ def sinkhorn_knopp(a, b, M, reg, numItermax=1000,
     # print(np.min(K))
 
     Kp = (1 / a).reshape(-1, 1) * K
+
+    if acceleration not in [None, 'overrelaxation', 'anderson']:
+        print('Warning : unknown acceleration using classic Sinkhorn Knopp')
+        acceleration = None
+
+    # over-relaxation parameter, estimated after the warm-up iterations
+    omega = 1.
+    # Anderson history of the images and residuals of the fixed point on log(u)
+    G_hist = []
+    F_hist = []
+    naccel = 0
+    nfallback = 0
+
     cpt = 0
     err = 1
+    errprev = np.inf
     while (err > stopThr and cpt < numItermax):
         uprev = u
         vprev = v
         KtransposeU = np.dot(K.T, u)
-        v = np.divide(b, KtransposeU)
-        u = 1. / np.dot(Kp, v)
-
-        if (np.any(KtransposeU == 0) or
-                np.any(np.isnan(u)) or np.any(np.isnan(v)) or
-                np.any(np.isinf(u)) or np.any(np.isinf(v))):
+        # K^Tu can underflow to zero for small reg, the resulting infinite
+        # values are caught below
+        with np.errstate(divide='ignore', invalid='ignore'):
+            v = np.divide(b, KtransposeU)
+            if omega > 1:
+                v = vprev**(1 - omega) * v**omega
+            u = 1. / np.dot(Kp, v)
+        if omega > 1:
+            u = uprev**(1 - omega) * u**omega
+            naccel += 1
+
+        if acceleration == 'overrelaxation' and cpt < warmup:
+            # rate of the plain iterations on the log potentials
+            delta = np.linalg.norm(np.log(u) - np.log(uprev))
+            if cpt == max(warmup - 10, 0):
+                cpt0, delta0 = cpt, delta
+            elif cpt == warmup - 1 and delta0 > 0:
+                rho = (delta / delta0)**(1. / (cpt - cpt0))
+                omega = 2. / (1 + np.sqrt(1 - min(rho, 1 - 1e-6)))
+
+        elif acceleration == 'anderson' and np.all(u > 0):
+            # one fixed point per target (column), each with its own
+            # mixing weights
+            x = np.log(uprev).reshape((Nini, -1))
+            g = np.log(u).reshape((Nini, -1))
+            f = g - x
+            fnorm = np.linalg.norm(f, axis=0)
+            if F_hist and not np.all(fnorm <= np.linalg.norm(F_hist[-1],
+                                                             axis=0)):
+                # safeguard: the residual increased, keep the plain step
+                # computed from the current v and restart the history
+                G_hist = []
+                F_hist = []
+                nfallback += 1
+            else:
+                G_hist = (G_hist + [g])[-depth - 1:]
+                F_hist = (F_hist + [f])[-depth - 1:]
+                if len(F_hist) > 1:
+                    dG = np.diff(np.array(G_hist), axis=0)
+                    dF = np.diff(np.array(F_hist), axis=0)
+                    for j in range(g.shape[1]):
+                        gamma = np.linalg.lstsq(dF[:, :, j].T, f[:, j],
+                                                rcond=None)[0]
+                        x[:, j] = g[:, j] - dG[:, :, j].T.dot(gamma)
+                    if np.all(np.isfinite(x)):
+                        u = np.exp(x).reshape(u.shape)
+                        naccel += 1
+
+        # a zero in K^Tu gives an infinite or nan value in v
+        if not np.isfinite(np.sum(u) + np.sum(v)):
             # we have reached the machine precision
             # come back to previous solution and quit loop
             print('Warning: numerical errors at iteration', cpt)
             u = uprev
             v = vprev
             break
-        if cpt % 10 == 0:
+        if cpt % print_period == 0:
             # we can speed up the process by checking for the error only all
-            # the 10th iterations
-            if nbb:
+            # the print_period iterations
+            if stopping == 'potentials':
                 err = np.sum((u - uprev)**2) / np.sum((u)**2) + \
                     np.sum((v - vprev)**2) / np.sum((v)**2)
+            elif stopping == 'gap':
+                # target marginal of the previous iterate (row marginal is a)
+                viol = vprev * KtransposeU - b
+                err = np.abs(np.sum(reg * np.log(np.maximum(vprev, 1e-300)) *
+                                    viol))
             else:
-                transp = u.reshape(-1, 1) * (K * v)
-                err = np.linalg.norm((np.sum(transp, axis=0) - b))**2
+                viol = vprev * KtransposeU - b
+                err = np.sum(viol**2)
+            if omega > 1 and err > errprev:
+                # fallback to the plain iterations
+                omega = 1.
+                nfallback += 1
+            errprev = err
             if log:
                 log['err'].append(err)
 
             if verbose:
-                if cpt % 200 == 0:
+                if cpt % (print_period * 20) == 0:
                     print(
                         '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
                 print('{:5d}|{:8e}|'.format(cpt, err))
@@ -387,12 +747,18 @@ def sinkhorn_knopp(a, b, M, reg, numItermax=1000,
     if log:
         log['u'] = u
         log['v'] = v
+        with np.errstate(divide='ignore'):
+            log['warmstart'] = (reg * np.log(u), reg * np.log(v))
+        log['niter'] = cpt
+        if acceleration is not None:
+            log['naccel'] = naccel
+            log['nfallback'] = nfallback
+        if acceleration == 'overrelaxation':
+            log['omega'] = omega
 
     if nbb:  # return only loss
-        res = np.zeros((nbb))
-        for i in range(nbb):
-            res[i] = np.sum(
-                u[:, i].reshape((-1, 1)) * K * v[:, i].reshape((1, -1)) * M)
+        # all the losses at once without computing the OT matrices
+        res = np.sum(u * np.dot(K * M, v), 0)
         if log:
             return res, log
         else:
@@ -406,10 +772,11 @@ def sinkhorn_knopp(a, b, M, reg, numItermax=1000,
             return u.reshape((-1, 1)) * K * v.reshape((1, -1))
 
 
-def sinkhorn_stabilized(a, b, M, reg, numItermax=1000, tau=1e3, stopThr=1e-9,
-                        warmstart=None, verbose=False, print_period=20, log=False, **kwargs):
+def sinkhorn_parallel(a, b, M, reg, numItermax=1000, stopThr=1e-9,
+                      n_threads=None, warmstart=None, verbose=False,
+                      log=False, **kwargs):
     """
-    Solve the entropic regularization OT problem with log stabilization
+    Solve the entropic regularization optimal transport problem with fused and parallel Sinkhorn iterations
 
     The function solves the following optimization problem:
 
@@ -428,28 +795,36 @@ def sinkhorn_stabilized(a, b, M, reg, numItermax=1000, tau=1e3, stopThr=1e-9,
     - a and b are source and target weights (sum to 1)
 
     The algorithm used for solving the problem is the Sinkhorn-Knopp matrix
-    scaling algorithm as proposed in [2]_ but with the log stabilization
-    proposed in [10]_ an defined in [9]_ (Algo 3.1) .
+    scaling algorithm as proposed in [2]_ with compiled kernels (see
+    ot/bregman_wrap.pyx) run on blocks of rows by a pool of n_threads threads.
+    The kernel is built in place by blocks, and each iteration is a single
+    pass over the kernel that updates u, accumulates :math:`K^Tu` and checks
+    for numerical errors. The marginal error is obtained from :math:`K^Tu`
+    at no cost and the OT matrix is computed in place in the kernel, so that
+    the kernel is the only (ns,nt) array allocated.
 
 
     Parameters
     ----------
     a : np.ndarray (ns,)
         samples weights in the source domain
-    b : np.ndarray (nt,)
-        samples in the target domain
+    b : np.ndarray (nt,) or np.ndarray (nt,nbb)
+        samples in the target domain, compute sinkhorn with multiple targets
+        and fixed M if b is a matrix (return OT loss + dual variables in log)
     M : np.ndarray (ns,nt)
         loss matrix
     reg : float
         Regularization term >0
-    tau : float
-        thershold for max value in u or v for log scaling
-    warmstart : tible of vectors
-        if given then sarting values for alpha an beta log scalings
     numItermax : int, optional
         Max number of iterations
     stopThr : float, optional
         Stop threshol on error (>0)
+    n_threads : int, optional
+        Number of threads (default is the number of cpu)
+    warmstart : tuple of vectors, optional
+        if given then starting values (alpha, beta) for the dual potentials,
+        the scalings are initialized to :math:`u=\exp(\\alpha/reg)` and
+        :math:`v=\exp(\\beta/reg)` (see log['warmstart'])
     verbose : bool, optional
         Print information along iterations
     log : bool, optional
@@ -470,7 +845,7 @@ def sinkhorn_stabilized(a, b, M, reg, numItermax=1000, tau=1e3, stopThr=1e-9,
     >>> a=[.5,.5]
     >>> b=[.5,.5]
     >>> M=[[0.,1.],[1.,0.]]
-    >>> ot.bregman.sinkhorn_stabilized(a,b,M,1)
+    >>> ot.bregman.sinkhorn_parallel(a,b,M,1)
     array([[ 0.36552929,  0.13447071],
            [ 0.13447071,  0.36552929]])
 
@@ -480,157 +855,177 @@ def sinkhorn_stabilized(a, b, M, reg, numItermax=1000, tau=1e3, stopThr=1e-9,
 
     .. [2] M. Cuturi, Sinkhorn Distances : Lightspeed Computation of Optimal Transport, Advances in Neural Information Processing Systems (NIPS) 26, 2013
 
-    .. [9] Schmitzer, B. (2016). Stabilized Sparse Scaling Algorithms for Entropy Regularized Transport Problems. arXiv preprint arXiv:1610.06519.
-
-    .. [10] Chizat, L., Peyré, G., Schmitzer, B., & Vialard, F. X. (2016). Scaling algorithms for unbalanced transport problems. arXiv preprint arXiv:1607.05816.
-
 
     See Also
     --------
     ot.lp.emd : Unregularized OT
-    ot.optim.cg : General regularized OT
+    ot.bregman.sinkhorn_knopp : Classic Sinkhorn [2]
 
     """
 
-    a = np.asarray(a, dtype=np.float64)
+    # compiled kernels, only needed (and built) for this solver
+    from . import bregman_wrap
+
+    a = np.ascontiguousarray(a, dtype=np.float64)
     b = np.asarray(b, dtype=np.float64)
-    M = np.asarray(M, dtype=np.float64)
+    M = np.ascontiguousarray(M, dtype=np.float64)
 
     if len(a) == 0:
         a = np.ones((M.shape[0],), dtype=np.float64) / M.shape[0]
     if len(b) == 0:
         b = np.ones((M.shape[1],), dtype=np.float64) / M.shape[1]
 
-    # test if multiple target
+    # init data
+    Nini = len(a)
+    Nfin = len(b)
+
     if len(b.shape) > 1:
         nbb = b.shape[1]
-        a = a[:, np.newaxis]
     else:
         nbb = 0
 
-    # init data
-    na = len(a)
-    nb = len(b)
-
-    cpt = 0
-    if log:
-        log = {'err': []}
-
-    # we assume that no distances are null except those of the diagonal of
-    # distances
-    if warmstart is None:
-        alpha, beta = np.zeros(na), np.zeros(nb)
-    else:
-        alpha, beta = warmstart
-
-    if nbb:
-        u, v = np.ones((na, nbb)) / na, np.ones((nb, nbb)) / nb
-    else:
-        u, v = np.ones(na) / na, np.ones(nb) / nb
-
-    def get_K(alpha, beta):
-        """log space computation"""
-        return np.exp(-(M - alpha.reshape((na, 1)) -
-                        beta.reshape((1, nb))) / reg)
-
-    def get_Gamma(alpha, beta, u, v):
-        """log space gamma computation"""
-        return np.exp(-(M - alpha.reshape((na, 1)) - beta.reshape((1, nb))) /
-                      reg + np.log(u.reshape((na, 1))) + np.log(v.reshape((1, nb))))
-
-    # print(np.min(K))
+    if n_threads is None:
+        n_threads = multiprocessing.cpu_count()
 
-    K = get_K(alpha, beta)
-    transp = K
-    loop = 1
-    cpt = 0
-    err = 1
-    while loop:
+    # a few blocks per thread for load balancing
+    nrows = int(max(1, np.ceil(Nini / (4. * n_threads))))
+    blocks = [(i, min(i + nrows, Nini)) for i in range(0, Nini, nrows)]
 
-        uprev = u
-        vprev = v
+    pool = ThreadPool(n_threads)
+    try:
+        K = np.empty((Nini, Nfin))
+        pool.map(lambda blk: bregman_wrap.gibbs_kernel(M, K, reg, *blk), blocks)
 
-        # sinkhorn update
-        v = b / (np.dot(K.T, u) + 1e-16)
-        u = a / (np.dot(K, v) + 1e-16)
+        # one partial K^Tu per block
+        KtransposeUs = np.zeros((len(blocks), Nfin))
 
-        # remove numerical problems and store them in K
-        if np.abs(u).max() > tau or np.abs(v).max() > tau:
-            if nbb:
-                alpha, beta = alpha + reg * \
-                    np.max(np.log(u), 1), beta + reg * np.max(np.log(v))
-            else:
-                alpha, beta = alpha + reg * np.log(u), beta + reg * np.log(v)
-                if nbb:
-                    u, v = np.ones((na, nbb)) / na, np.ones((nb, nbb)) / nb
-                else:
-                    u, v = np.ones(na) / na, np.ones(nb) / nb
-            K = get_K(alpha, beta)
+        if warmstart is None:
+            u0 = np.ones((Nini, max(nbb, 1))) / Nini
+            v0 = np.ones((Nfin, max(nbb, 1))) / Nfin
+        else:
+            u0 = np.exp(np.asarray(warmstart[0], dtype=np.float64).reshape(
+                (Nini, -1)) / reg) * np.ones((1, max(nbb, 1)))
+            v0 = np.exp(np.asarray(warmstart[1], dtype=np.float64).reshape(
+                (Nfin, -1)) / reg) * np.ones((1, max(nbb, 1)))
+
+        def solve(b, u, v):
+            u = np.ascontiguousarray(u)
+            v = np.ascontiguousarray(v)
+
+            def update(k):
+                KtransposeUs[k] = 0
+                return bregman_wrap.sinkhorn_pass(K, a, u, v, KtransposeUs[k],
+                                                  *blocks[k])
+
+            errs = []
+            cpt = 0
+            err = 1
+            while (err > stopThr and cpt < numItermax):
+                uprev = u.copy()
+                vprev = v
+
+                bad = sum(pool.map(update, range(len(blocks))))
+                KtransposeU = KtransposeUs.sum(0)
+
+                # the marginal of the OT matrix before the update of v is free
+                err = np.linalg.norm(v * KtransposeU - b)**2
+                v = np.divide(b, KtransposeU)
+
+                if bad or np.any(KtransposeU == 0) or not np.all(np.isfinite(v)):
+                    # we have reached the machine precision
+                    # come back to previous solution and quit loop
+                    print('Warning: numerical errors at iteration', cpt)
+                    u = uprev
+                    v = vprev
+                    break
+                if cpt % 10 == 0:
+                    errs.append(err)
+
+                    if verbose:
+                        if cpt % 200 == 0:
+                            print(
+                                '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
+                        print('{:5d}|{:8e}|'.format(cpt, err))
+                cpt = cpt + 1
+            return u, v, errs, cpt
+
+        if nbb:  # return only loss
+            res = np.zeros((nbb))
+            us, vs, errs, niters = [], [], [], []
+            for i in range(nbb):
+                u, v, err, niter = solve(np.ascontiguousarray(b[:, i]), u0[:, i],
+                                         v0[:, i])
+                res[i] = sum(pool.map(
+                    lambda blk: bregman_wrap.sinkhorn_loss(K, M, u, v, *blk),
+                    blocks))
+                us.append(u)
+                vs.append(v)
+                errs.append(err)
+                niters.append(niter)
 
-        if cpt % print_period == 0:
-            # we can speed up the process by checking for the error only all
-            # the 10th iterations
-            if nbb:
-                err = np.sum((u - uprev)**2) / np.sum((u)**2) + \
-                    np.sum((v - vprev)**2) / np.sum((v)**2)
-            else:
-                transp = get_Gamma(alpha, beta, u, v)
-                err = np.linalg.norm((np.sum(transp, axis=0) - b))**2
             if log:
-                log['err'].append(err)
-
-            if verbose:
-                if cpt % (print_period * 20) == 0:
-                    print(
-                        '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
-                print('{:5d}|{:8e}|'.format(cpt, err))
-
-        if err <= stopThr:
-            loop = False
-
-        if cpt >= numItermax:
-            loop = False
+                log = {'err': errs, 'u': np.stack(us, axis=1),
+                       'v': np.stack(vs, axis=1), 'niter': niters}
+                log['warmstart'] = (reg * np.log(log['u']),
+                                    reg * np.log(log['v']))
+                return res, log
+            else:
+                return res
 
-        if np.any(np.isnan(u)) or np.any(np.isnan(v)):
-            # we have reached the machine precision
-            # come back to previous solution and quit loop
-            print('Warning: numerical errors at iteration', cpt)
-            u = uprev
-            v = vprev
-            break
+        else:  # return OT matrix computed in place in K
+            u, v, err, niter = solve(b, u0[:, 0], v0[:, 0])
+            pool.map(lambda blk: bregman_wrap.scale_kernel(K, u, v, *blk), blocks)
 
-        cpt = cpt + 1
+            if log:
+                log = {'err': err, 'u': u, 'v': v, 'niter': niter,
+                       'warmstart': (reg * np.log(u), reg * np.log(v))}
+                return K, log
+            else:
+                return K
+
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _per_target(solver, a, b, M, reg, warmstart=None, log=False, **kwargs):
+    """solve in turn with solver the OT problems between a and each column of
+    b, return the losses (and the logs of the targets stacked as the log of
+    the solvers with multiple targets)"""
+    nbb = b.shape[1]
+    warmstarts = [None] * nbb
+    if warmstart is not None:
+        alpha = np.asarray(warmstart[0], dtype=np.float64).reshape(
+            (len(a), -1)) * np.ones((1, nbb))
+        beta = np.asarray(warmstart[1], dtype=np.float64).reshape(
+            (len(b), -1)) * np.ones((1, nbb))
+        warmstarts = list(zip(alpha.T, beta.T))
+
+    res = np.zeros((nbb))
+    logs = []
+    for i in range(nbb):
+        G, logi = solver(a, b[:, i], M, reg, warmstart=warmstarts[i],
+                         log=True, **kwargs)
+        res[i] = np.sum(G * M)
+        logs.append(logi)
 
-    # print('err=',err,' cpt=',cpt)
     if log:
-        log['logu'] = alpha / reg + np.log(u)
-        log['logv'] = beta / reg + np.log(v)
-        log['alpha'] = alpha + reg * np.log(u)
-        log['beta'] = beta + reg * np.log(v)
-        log['warmstart'] = (log['alpha'], log['beta'])
-        if nbb:
-            res = np.zeros((nbb))
-            for i in range(nbb):
-                res[i] = np.sum(get_Gamma(alpha, beta, u[:, i], v[:, i]) * M)
-            return res, log
-
-        else:
-            return get_Gamma(alpha, beta, u, v), log
+        log = {'err': [logi['err'] for logi in logs],
+               'u': np.stack([logi['u'] for logi in logs], axis=1),
+               'v': np.stack([logi['v'] for logi in logs], axis=1),
+               'niter': [logi['niter'] for logi in logs]}
+        log['warmstart'] = tuple(np.stack([logi['warmstart'][i]
+                                           for logi in logs], axis=1)
+                                 for i in range(2))
+        return res, log
     else:
-        if nbb:
-            res = np.zeros((nbb))
-            for i in range(nbb):
-                res[i] = np.sum(get_Gamma(alpha, beta, u[:, i], v[:, i]) * M)
-            return res
-        else:
-            return get_Gamma(alpha, beta, u, v)
+        return res
 
 
-def sinkhorn_epsilon_scaling(a, b, M, reg, numItermax=100, epsilon0=1e4, numInnerItermax=100,
-                             tau=1e3, stopThr=1e-9, warmstart=None, verbose=False, print_period=10, log=False, **kwargs):
+def greenkhorn(a, b, M, reg, numItermax=10000, stopThr=1e-9, warmstart=None,
+               verbose=False, log=False, **kwargs):
     """
-    Solve the entropic regularization optimal transport problem with log
-    stabilization and epsilon scaling.
+    Solve the entropic regularization optimal transport problem and return the OT matrix
 
     The function solves the following optimization problem:
 
@@ -648,35 +1043,32 @@ def sinkhorn_epsilon_scaling(a, b, M, reg, numItermax=100, epsilon0=1e4, numInne
     - :math:`\Omega` is the entropic regularization term :math:`\Omega(\gamma)=\sum_{i,j} \gamma_{i,j}\log(\gamma_{i,j})`
     - a and b are source and target weights (sum to 1)
 
-    The algorithm used for solving the problem is the Sinkhorn-Knopp matrix
-    scaling algorithm as proposed in [2]_ but with the log stabilization
-    proposed in [10]_ and the log scaling proposed in [9]_ algorithm 3.2
+    The algorithm used is the Greenkhorn algorithm proposed in [16]_, a
+    greedy coordinate version of the Sinkhorn-Knopp algorithm [2]_ that
+    rescales at each iteration only the row or column with the largest
+    marginal violation. The violations are updated incrementally so that one
+    iteration costs O(ns+nt) operations.
 
 
     Parameters
     ----------
     a : np.ndarray (ns,)
         samples weights in the source domain
-    b : np.ndarray (nt,)
-        samples in the target domain
+    b : np.ndarray (nt,) or np.ndarray (nt,nbb)
+        samples in the target domain, compute greenkhorn for each target
+        and fixed M if b is a matrix (return OT loss + dual variables in log)
     M : np.ndarray (ns,nt)
         loss matrix
     reg : float
         Regularization term >0
-    tau : float
-        thershold for max value in u or v for log scaling
-    tau : float
-        thershold for max value in u or v for log scaling
-    warmstart : tible of vectors
-        if given then sarting values for alpha an beta log scalings
     numItermax : int, optional
-        Max number of iterations
-    numInnerItermax : int, optional
-        Max number of iterationsin the inner slog stabilized sinkhorn
-    epsilon0 : int, optional
-        first epsilon regularization value (then exponential decrease to reg)
+        Max number of iterations (one row or column update per iteration)
     stopThr : float, optional
         Stop threshol on error (>0)
+    warmstart : tuple of vectors, optional
+        if given then starting values (alpha, beta) for the dual potentials,
+        the scalings are initialized to :math:`u=\exp(\\alpha/reg)` and
+        :math:`v=\exp(\\beta/reg)` (see log['warmstart'])
     verbose : bool, optional
         Print information along iterations
     log : bool, optional
@@ -697,7 +1089,7 @@ def sinkhorn_epsilon_scaling(a, b, M, reg, numItermax=100, epsilon0=1e4, numInne
     >>> a=[.5,.5]
     >>> b=[.5,.5]
     >>> M=[[0.,1.],[1.,0.]]
-    >>> ot.bregman.sinkhorn_epsilon_scaling(a,b,M,1)
+    >>> ot.bregman.greenkhorn(a,b,M,1)
     array([[ 0.36552929,  0.13447071],
            [ 0.13447071,  0.36552929]])
 
@@ -707,12 +1099,13 @@ def sinkhorn_epsilon_scaling(a, b, M, reg, numItermax=100, epsilon0=1e4, numInne
 
     .. [2] M. Cuturi, Sinkhorn Distances : Lightspeed Computation of Optimal Transport, Advances in Neural Information Processing Systems (NIPS) 26, 2013
 
-    .. [9] Schmitzer, B. (2016). Stabilized Sparse Scaling Algorithms for Entropy Regularized Transport Problems. arXiv preprint arXiv:1610.06519.
+    .. [16] J. Altschuler, J. Weed, P. Rigollet, (2017) Near-linear time approximation algorithms for optimal transport via Sinkhorn iteration, Advances in Neural Information Processing Systems (NIPS) 31
+
 
     See Also
     --------
     ot.lp.emd : Unregularized OT
-    ot.optim.cg : General regularized OT
+    ot.bregman.sinkhorn_knopp : Classic Sinkhorn [2]
 
     """
 
@@ -725,103 +1118,2724 @@ def sinkhorn_epsilon_scaling(a, b, M, reg, numItermax=100, epsilon0=1e4, numInne
     if len(b) == 0:
         b = np.ones((M.shape[1],), dtype=np.float64) / M.shape[1]
 
-    # init data
-    na = len(a)
-    nb = len(b)
+    if len(b.shape) > 1:
+        # greedy updates are specific to each target, solve them in turn
+        return _per_target(greenkhorn, a, b, M, reg, warmstart=warmstart,
+                           log=log, numItermax=numItermax, stopThr=stopThr,
+                           verbose=verbose)
+
+    ws = {'warmstart': warmstart}
+    red = reduce_support(a, b, M, ws)
+    if red is not None:
+        # solve on the support of the weights
+        ar, br, Mr, ia, ib = red
+        return expand_support(greenkhorn(
+            ar, br, Mr, reg, numItermax=numItermax, stopThr=stopThr,
+            warmstart=ws['warmstart'], verbose=verbose, log=log), ia, ib, log)
 
-    # nrelative umerical precision with 64 bits
-    numItermin = 35
-    numItermax = max(numItermin, numItermax)  # ensure that last velue is exact
+    # init data
+    Nini = len(a)
+    Nfin = len(b)
 
-    cpt = 0
     if log:
         log = {'err': []}
 
-    # we assume that no distances are null except those of the diagonal of
-    # distances
+    K = np.exp(-M / reg)
+
     if warmstart is None:
-        alpha, beta = np.zeros(na), np.zeros(nb)
+        u = np.ones(Nini) / Nini
+        v = np.ones(Nfin) / Nfin
     else:
-        alpha, beta = warmstart
+        u = np.exp(np.asarray(warmstart[0], dtype=np.float64) / reg)
+        v = np.exp(np.asarray(warmstart[1], dtype=np.float64) / reg)
 
-    def get_K(alpha, beta):
-        """log space computation"""
-        return np.exp(-(M - alpha.reshape((na, 1)) -
-                        beta.reshape((1, nb))) / reg)
-
-    # print(np.min(K))
-    def get_reg(n):  # exponential decreasing
-        return (epsilon0 - reg) * np.exp(-n) + reg
+    # marginal violations of the current coupling, updated incrementally
+    viol = u * np.dot(K, v) - a
+    viol_2 = v * np.dot(K.T, u) - b
 
-    loop = 1
     cpt = 0
     err = 1
-    while loop:
-
-        regi = get_reg(cpt)
+    while cpt < numItermax:
 
-        G, logi = sinkhorn_stabilized(a, b, M, regi, numItermax=numInnerItermax, stopThr=1e-9, warmstart=(
-            alpha, beta), verbose=False, print_period=20, tau=tau, log=True)
+        if cpt % 10 == 0:
+            err = np.sum(viol**2) + np.sum(viol_2**2)
+            if log:
+                log['err'].append(err)
+
+            if verbose:
+                if cpt % 200 == 0:
+                    print(
+                        '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
+                print('{:5d}|{:8e}|'.format(cpt, err))
+
+            if err <= stopThr:
+                break
+
+        i_1 = np.argmax(np.abs(viol))
+        i_2 = np.argmax(np.abs(viol_2))
+
+        if np.abs(viol[i_1]) > np.abs(viol_2[i_2]):
+            # rescale row i_1 and propagate to the column violations
+            old_u = u[i_1]
+            u[i_1] = a[i_1] / np.dot(K[i_1, :], v)
+            if not np.isfinite(u[i_1]):
+                print('Warning: numerical errors at iteration', cpt)
+                u[i_1] = old_u
+                break
+            viol[i_1] = 0
+            viol_2 += (u[i_1] - old_u) * K[i_1, :] * v
+        else:
+            # rescale column i_2 and propagate to the row violations
+            old_v = v[i_2]
+            v[i_2] = b[i_2] / np.dot(K[:, i_2], u)
+            if not np.isfinite(v[i_2]):
+                print('Warning: numerical errors at iteration', cpt)
+                v[i_2] = old_v
+                break
+            viol_2[i_2] = 0
+            viol += (v[i_2] - old_v) * K[:, i_2] * u
+
+        cpt = cpt + 1
+
+    if cpt == numItermax:
+        err = np.sum(viol**2) + np.sum(viol_2**2)
+        if err > stopThr:
+            print('Warning: greenkhorn did not converge after', cpt,
+                  'iterations (err={:e})'.format(err))
+
+    if log:
+        log['niter'] = cpt
+        log['u'] = u
+        log['v'] = v
+        log['warmstart'] = (reg * np.log(u), reg * np.log(v))
+        return u.reshape((-1, 1)) * K * v.reshape((1, -1)), log
+    else:
+        return u.reshape((-1, 1)) * K * v.reshape((1, -1))
+
+
+def sinkhorn_newton(a, b, M, reg, numItermax=100, numInnerItermax=100,
+                    stopThr=1e-9, warmup=20, warmstart=None, verbose=False,
+                    log=False, **kwargs):
+    """
+    Solve the entropic regularization optimal transport problem with Newton iterations
+
+    The function solves the following optimization problem:
+
+    .. math::
+        \gamma = arg\min_\gamma <\gamma,M>_F + reg\cdot\Omega(\gamma)
+
+        s.t. \gamma 1 = a
+
+             \gamma^T 1= b
+
+             \gamma\geq 0
+    where :
+
+    - M is the (ns,nt) metric cost matrix
+    - :math:`\Omega` is the entropic regularization term :math:`\Omega(\gamma)=\sum_{i,j} \gamma_{i,j}\log(\gamma_{i,j})`
+    - a and b are source and target weights (sum to 1)
+
+    The algorithm used is the Sinkhorn-Newton method proposed in [21]_: after
+    warmup Sinkhorn-Knopp iterations [2]_, Newton steps are taken on the
+    logarithm of the scalings u and v to solve the marginal equations
+    :math:`u\odot Kv=a,\ v\odot K^Tu=b`. The Newton system is solved with
+    a diagonally preconditioned conjugate gradient that only uses products
+    with K and K^T, and the step is chosen by a backtracking line search on
+    the dual objective. The local convergence is quadratic.
+
+
+    Parameters
+    ----------
+    a : np.ndarray (ns,)
+        samples weights in the source domain
+    b : np.ndarray (nt,) or np.ndarray (nt,nbb)
+        samples in the target domain, compute sinkhorn with multiple targets
+        and fixed M if b is a matrix (return OT loss + dual variables in log)
+    M : np.ndarray (ns,nt)
+        loss matrix
+    reg : float
+        Regularization term >0
+    numItermax : int, optional
+        Max number of Newton iterations
+    numInnerItermax : int, optional
+        Max number of conjugate gradient iterations per Newton iteration
+    stopThr : float, optional
+        Stop threshol on error (>0)
+    warmup : int, optional
+        Number of Sinkhorn-Knopp iterations before the Newton iterations
+    warmstart : tuple of vectors, optional
+        if given then starting values (alpha, beta) for the dual potentials,
+        the scalings are initialized to :math:`u=\exp(\\alpha/reg)` and
+        :math:`v=\exp(\\beta/reg)` (see log['warmstart'])
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+
+
+    Returns
+    -------
+    gamma : (ns x nt) ndarray
+        Optimal transportation matrix for the given parameters
+    log : dict
+        log dictionary return only if log==True in parameters
+
+    Examples
+    --------
+
+    >>> import ot
+    >>> a=[.5,.5]
+    >>> b=[.5,.5]
+    >>> M=[[0.,1.],[1.,0.]]
+    >>> ot.bregman.sinkhorn_newton(a,b,M,1)
+    array([[ 0.36552929,  0.13447071],
+           [ 0.13447071,  0.36552929]])
+
+
+    References
+    ----------
+
+    .. [2] M. Cuturi, Sinkhorn Distances : Lightspeed Computation of Optimal Transport, Advances in Neural Information Processing Systems (NIPS) 26, 2013
+
+    .. [21] Brauer, C., Clason, C., Lorenz, D., & Wirth, B. (2017). A Sinkhorn-Newton method for entropic optimal transport. arXiv preprint arXiv:1710.06635.
+
+
+    See Also
+    --------
+    ot.lp.emd : Unregularized OT
+    ot.bregman.sinkhorn_knopp : Classic Sinkhorn [2]
+
+    """
+
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    M = np.asarray(M, dtype=np.float64)
+
+    if len(a) == 0:
+        a = np.ones((M.shape[0],), dtype=np.float64) / M.shape[0]
+    if len(b) == 0:
+        b = np.ones((M.shape[1],), dtype=np.float64) / M.shape[1]
+
+    if len(b.shape) > 1:
+        # Newton systems are specific to each target, solve them in turn
+        return _per_target(sinkhorn_newton, a, b, M, reg, warmstart=warmstart,
+                           log=log, numItermax=numItermax,
+                           numInnerItermax=numInnerItermax, stopThr=stopThr,
+                           warmup=warmup, verbose=verbose)
+
+    # init data
+    Nini = len(a)
+    Nfin = len(b)
+
+    if log:
+        log = {'err': [], 'ncg': 0}
+
+    K = np.exp(-M / reg)
+
+    if warmstart is None:
+        u = np.ones(Nini) / Nini
+        v = np.ones(Nfin) / Nfin
+    else:
+        u = np.exp(np.asarray(warmstart[0], dtype=np.float64) / reg)
+        v = np.exp(np.asarray(warmstart[1], dtype=np.float64) / reg)
+
+    # warm-up Sinkhorn iterations
+    for i in range(warmup):
+        v = b / np.dot(K.T, u)
+        u = a / np.dot(K, v)
+
+    def dual(x, y):
+        # dual objective (up to reg) for the log scalings x and y
+        return np.dot(a, x) + np.dot(b, y) - np.dot(np.exp(x), np.dot(K, np.exp(y)))
+
+    def solve_cg(r, c, F):
+        # solve J d = -F with J = [[diag(r), P], [P^T, diag(c)]] where
+        # P = diag(u) K diag(v), by preconditioned conjugate gradient
+        def J(d):
+            dx, dy = d[:Nini], d[Nini:]
+            return np.concatenate((r * dx + u * np.dot(K, v * dy),
+                                   v * np.dot(K.T, u * dx) + c * dy))
+        prec = 1. / np.concatenate((r, c))
+        tol = min(0.5, np.sqrt(np.linalg.norm(F))) * np.linalg.norm(F)
+        d = np.zeros(Nini + Nfin)
+        res = -F
+        z = prec * res
+        p = z
+        rz = np.dot(res, z)
+        for k in range(numInnerItermax):
+            Jp = J(p)
+            alpha = rz / np.dot(p, Jp)
+            d += alpha * p
+            res -= alpha * Jp
+            if np.linalg.norm(res) <= tol:
+                break
+            z = prec * res
+            rz, rzprev = np.dot(res, z), rz
+            p = z + rz / rzprev * p
+        return d, k + 1
+
+    x = np.log(u)
+    y = np.log(v)
+    cpt = 0
+    err = 1
+    while True:
+        Kv = np.dot(K, v)
+        KtransposeU = np.dot(K.T, u)
+        r = u * Kv
+        c = v * KtransposeU
+        F = np.concatenate((r - a, c - b))
+
+        err = np.linalg.norm(F)**2
+        if log:
+            log['err'].append(err)
+
+        if verbose:
+            if cpt % 200 == 0:
+                print(
+                    '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
+            print('{:5d}|{:8e}|'.format(cpt, err))
+
+        if err <= stopThr or cpt >= numItermax:
+            break
+
+        d, ncg = solve_cg(r, c, F)
+        if log:
+            log['ncg'] += ncg
+
+        # backtracking line search on the dual objective
+        f0 = dual(x, y)
+        slope = -np.dot(F, d)
+        t = 1.
+        while t > 1e-10:
+            xt = x + t * d[:Nini]
+            yt = y + t * d[Nini:]
+            if dual(xt, yt) >= f0 + 1e-4 * t * slope:
+                break
+            t /= 2
+
+        if not (np.all(np.isfinite(xt)) and np.all(np.isfinite(yt))):
+            print('Warning: numerical errors at iteration', cpt)
+            break
+
+        x, y = xt, yt
+        u, v = np.exp(x), np.exp(y)
+        cpt = cpt + 1
+
+    if log:
+        log['u'] = u
+        log['v'] = v
+        log['warmstart'] = (reg * np.log(u), reg * np.log(v))
+        log['niter'] = cpt
+        return u.reshape((-1, 1)) * K * v.reshape((1, -1)), log
+    else:
+        return u.reshape((-1, 1)) * K * v.reshape((1, -1))
+
+
+def sinkhorn_lbfgs(a, b, M, reg, semi_dual=False, numItermax=1000,
+                   stopThr=1e-9, warmstart=None, verbose=False, log=False,
+                   **kwargs):
+    """
+    Solve the entropic regularization optimal transport problem with L-BFGS on the dual
+
+    The function solves the following optimization problem:
+
+    .. math::
+        \gamma = arg\min_\gamma <\gamma,M>_F + reg\cdot\Omega(\gamma)
+
+        s.t. \gamma 1 = a
+
+             \gamma^T 1= b
+
+             \gamma\geq 0
+    where :
+
+    - M is the (ns,nt) metric cost matrix
+    - :math:`\Omega` is the entropic regularization term :math:`\Omega(\gamma)=\sum_{i,j} \gamma_{i,j}\log(\gamma_{i,j})`
+    - a and b are source and target weights (sum to 1)
+
+    The problem is solved by maximizing with the L-BFGS-B solver of scipy
+    the smooth dual
+
+    .. math::
+        \max_{\\alpha,\\beta} <\\alpha,a>+<\\beta,b>-reg\sum_{i,j}\exp((\\alpha_i+\\beta_j-M_{i,j})/reg)
+
+    or when semi_dual is True the semi-dual [22]_ where :math:`\\alpha` is
+    replaced by its smoothed c-transform
+
+    .. math::
+        \max_{\\beta} <\\beta,b>-reg\sum_i a_i\log\sum_j\exp((\\beta_j-M_{i,j})/reg)
+
+    The objective and its gradient are computed together from the products
+    :math:`Kv` and :math:`K^Tu` with :math:`u=\exp(\\alpha/reg)` and
+    :math:`v=\exp(\\beta/reg)`, and the OT matrix and the log (u, v) are the
+    same as with ot.bregman.sinkhorn_knopp.
+
+
+    Parameters
+    ----------
+    a : np.ndarray (ns,)
+        samples weights in the source domain
+    b : np.ndarray (nt,) or np.ndarray (nt,nbb)
+        samples in the target domain, compute sinkhorn with multiple targets
+        and fixed M if b is a matrix (return OT loss + dual variables in log)
+    M : np.ndarray (ns,nt)
+        loss matrix
+    reg : float
+        Regularization term >0
+    semi_dual : bool, optional
+        Maximize the semi-dual instead of the dual
+    numItermax : int, optional
+        Max number of iterations
+    stopThr : float, optional
+        Stop threshol on error (>0)
+    warmstart : tuple of vectors, optional
+        if given then starting values (alpha, beta) for the dual potentials
+        (only beta is used for the semi-dual, see log['warmstart'])
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+
+
+    Returns
+    -------
+    gamma : (ns x nt) ndarray
+        Optimal transportation matrix for the given parameters
+    log : dict
+        log dictionary return only if log==True in parameters
+
+    Examples
+    --------
+
+    >>> import ot
+    >>> a=[.5,.5]
+    >>> b=[.5,.5]
+    >>> M=[[0.,1.],[1.,0.]]
+    >>> ot.sinkhorn(a,b,M,1,method='lbfgs_dual').round(4)
+    array([[ 0.3655,  0.1345],
+           [ 0.1345,  0.3655]])
+
+
+    References
+    ----------
+
+    .. [2] M. Cuturi, Sinkhorn Distances : Lightspeed Computation of Optimal Transport, Advances in Neural Information Processing Systems (NIPS) 26, 2013
+
+    .. [22] Genevay, A., Cuturi, M., Peyré, G. & Bach, F. (2016). Stochastic Optimization for Large-scale Optimal Transport. Advances in Neural Information Processing Systems (NIPS) 29.
+
+
+    See Also
+    --------
+    ot.lp.emd : Unregularized OT
+    ot.bregman.sinkhorn_knopp : Classic Sinkhorn [2]
+
+    """
+
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    M = np.asarray(M, dtype=np.float64)
+
+    if len(a) == 0:
+        a = np.ones((M.shape[0],), dtype=np.float64) / M.shape[0]
+    if len(b) == 0:
+        b = np.ones((M.shape[1],), dtype=np.float64) / M.shape[1]
+
+    if len(b.shape) > 1:
+        # one dual problem per target, solve them in turn
+        return _per_target(sinkhorn_lbfgs, a, b, M, reg, warmstart=warmstart,
+                           log=log, semi_dual=semi_dual, numItermax=numItermax,
+                           stopThr=stopThr, verbose=verbose)
+
+    # init data
+    Nini = len(a)
+    Nfin = len(b)
+
+    K = np.exp(-M / reg)
+
+    def dual(x):
+        # negative dual objective and gradient
+        alpha, beta = x[:Nini], x[Nini:]
+        u = np.exp(alpha / reg)
+        v = np.exp(beta / reg)
+        Kv = np.dot(K, v)
+        KtransposeU = np.dot(K.T, u)
+        f = np.dot(alpha, a) + np.dot(beta, b) - reg * np.dot(u, Kv)
+        return -f, -np.concatenate((a - u * Kv, b - v * KtransposeU))
+
+    def semidual(beta):
+        # negative semi-dual objective and gradient
+        v = np.exp(beta / reg)
+        Kv = np.dot(K, v)
+        u = a / Kv
+        f = np.dot(beta, b) - reg * np.dot(a, np.log(Kv))
+        return -f, -(b - v * np.dot(K.T, u))
+
+    if warmstart is None:
+        alpha0, beta0 = np.zeros(Nini), np.zeros(Nfin)
+    else:
+        alpha0, beta0 = warmstart
+
+    if semi_dual:
+        x0 = np.array(beta0, dtype=np.float64)
+        fun = semidual
+    else:
+        x0 = np.concatenate((alpha0, beta0)).astype(np.float64)
+        fun = dual
+
+    # stop when the squared norm of the marginal errors is below stopThr
+    x, f, d = scipy.optimize.fmin_l_bfgs_b(
+        fun, x0, maxiter=numItermax, pgtol=np.sqrt(stopThr / len(x0)),
+        factr=10, iprint=1 if verbose else -1)
+
+    if semi_dual:
+        v = np.exp(x / reg)
+        u = a / np.dot(K, v)
+    else:
+        u = np.exp(x[:Nini] / reg)
+        v = np.exp(x[Nini:] / reg)
+
+    if log:
+        log = {'err': [np.sum(d['grad']**2)], 'niter': d['nit'],
+               'warnflag': d['warnflag'], 'u': u, 'v': v,
+               'warmstart': (reg * np.log(u), reg * np.log(v))}
+        return u.reshape((-1, 1)) * K * v.reshape((1, -1)), log
+    else:
+        return u.reshape((-1, 1)) * K * v.reshape((1, -1))
+
+
+def sinkhorn_batch(a, b, M, reg, numItermax=1000, stopThr=1e-9,
+                   warmstart=None, verbose=False, log=False, **kwargs):
+    """
+    Solve a stack of entropic regularization optimal transport problems
+
+    The function solves independently for each k the following optimization
+    problem:
+
+    .. math::
+        \gamma_k = arg\min_\gamma <\gamma,M_k>_F + reg\cdot\Omega(\gamma)
+
+        s.t. \gamma 1 = a_k
+
+             \gamma^T 1= b_k
+
+             \gamma\geq 0
+    where :
+
+    - M_k are the (ns,nt) metric cost matrices
+    - :math:`\Omega` is the entropic regularization term :math:`\Omega(\gamma)=\sum_{i,j} \gamma_{i,j}\log(\gamma_{i,j})`
+    - a_k and b_k are source and target weights (sum to 1)
+
+    The Sinkhorn-Knopp iterations [2]_ of all the problems are computed
+    together with batched matrix products. Each problem is checked for
+    convergence separately and is removed from the batch once converged.
+
+
+    Parameters
+    ----------
+    a : np.ndarray (ns,) or np.ndarray (nbatch,ns)
+        samples weights in the source domain (shared by all problems if 1D)
+    b : np.ndarray (nt,) or np.ndarray (nbatch,nt)
+        samples weights in the target domain (shared by all problems if 1D)
+    M : np.ndarray (nbatch,ns,nt)
+        stack of loss matrices
+    reg : float
+        Regularization term >0
+    numItermax : int, optional
+        Max number of iterations
+    stopThr : float, optional
+        Stop threshol on error (>0)
+    warmstart : tuple of arrays, optional
+        if given then starting values (alpha, beta) for the dual potentials of
+        shape (nbatch,ns) and (nbatch,nt) (shared by all problems if 1D, see
+        log['warmstart'])
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+
+
+    Returns
+    -------
+    gamma : (nbatch x ns x nt) ndarray
+        Optimal transportation matrices for the given parameters
+    log : dict
+        log dictionary return only if log==True in parameters
+
+    Examples
+    --------
+
+    >>> import ot
+    >>> a=[.5,.5]
+    >>> b=[.5,.5]
+    >>> M=[[[0.,1.],[1.,0.]], [[0.,2.],[2.,0.]]]
+    >>> ot.bregman.sinkhorn_batch(a,b,M,1)
+    array([[[ 0.36552929,  0.13447071],
+            [ 0.13447071,  0.36552929]],
+    <BLANKLINE>
+           [[ 0.44039854,  0.05960146],
+            [ 0.05960146,  0.44039854]]])
+
+
+    References
+    ----------
+
+    .. [2] M. Cuturi, Sinkhorn Distances : Lightspeed Computation of Optimal Transport, Advances in Neural Information Processing Systems (NIPS) 26, 2013
+
+
+    See Also
+    --------
+    ot.bregman.sinkhorn_knopp : Classic Sinkhorn [2]
+
+    """
+
+    M = np.asarray(M, dtype=np.float64)
+    nbatch, Nini, Nfin = M.shape
+
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+
+    if len(a) == 0:
+        a = np.ones((Nini,), dtype=np.float64) / Nini
+    if len(b) == 0:
+        b = np.ones((Nfin,), dtype=np.float64) / Nfin
+
+    a = np.broadcast_to(a, (nbatch, Nini))
+    b = np.broadcast_to(b, (nbatch, Nfin))
+
+    if log:
+        log = {'err': []}
+
+    if warmstart is None:
+        u = np.ones((nbatch, Nini)) / Nini
+        v = np.ones((nbatch, Nfin)) / Nfin
+    else:
+        u = np.exp(np.asarray(warmstart[0]) / reg) * np.ones((nbatch, Nini))
+        v = np.exp(np.asarray(warmstart[1]) / reg) * np.ones((nbatch, Nfin))
+    niter = np.zeros(nbatch, dtype=int)
+    err = np.ones(nbatch)
+
+    K = np.exp(-M / reg)
+
+    # the iterations are computed only on the problems in idx
+    idx = np.arange(nbatch)
+    Ki, ai, bi, ui, vi = K, a, b, u, v
+
+    cpt = 0
+    while idx.size and cpt < numItermax:
+        uprev = ui
+        vprev = vi
+        KtransposeU = np.matmul(ui[:, None, :], Ki)[:, 0, :]
+        vi = bi / KtransposeU
+        ui = ai / np.matmul(Ki, vi[:, :, None])[:, :, 0]
+        cpt = cpt + 1
+
+        failed = ~(np.all(np.isfinite(ui), 1) & np.all(np.isfinite(vi), 1) &
+                   np.all(KtransposeU > 0, 1))
+        if np.any(failed):
+            # we have reached the machine precision for some problems
+            # come back to previous solution and stop them
+            print('Warning: numerical errors at iteration', cpt - 1)
+            ui[failed] = uprev[failed]
+            vi[failed] = vprev[failed]
+
+        if cpt % 10 == 0 or np.any(failed) or cpt == numItermax:
+            # error on the marginals checked only all the 10th iterations
+            transp = vi * np.matmul(ui[:, None, :], Ki)[:, 0, :]
+            err[idx] = np.sum((transp - bi)**2, 1)
+            if log:
+                log['err'].append(err.copy())
+
+            if verbose:
+                if cpt % 200 == 0:
+                    print(
+                        '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
+                print('{:5d}|{:8e}|'.format(cpt, np.max(err)))
+
+            # store and remove the converged problems
+            u[idx], v[idx], niter[idx] = ui, vi, cpt
+            done = failed | (err[idx] <= stopThr)
+            if np.any(done):
+                keep = ~done
+                idx = idx[keep]
+                Ki, ai, bi = Ki[keep], ai[keep], bi[keep]
+                ui, vi = ui[keep], vi[keep]
+
+    u[idx], v[idx], niter[idx] = ui, vi, cpt
+
+    if log:
+        log['u'] = u
+        log['v'] = v
+        log['warmstart'] = (reg * np.log(u), reg * np.log(v))
+        log['niter'] = niter
+        return u[:, :, None] * K * v[:, None, :], log
+    else:
+        return u[:, :, None] * K * v[:, None, :]
+
+
+def sinkhorn_stabilized(a, b, M, reg, numItermax=1000, tau=1e3, stopThr=1e-9,
+                        warmstart=None, verbose=False, print_period=20, log=False,
+                        sparse_thr=None, memory=2**28, **kwargs):
+    """
+    Solve the entropic regularization OT problem with log stabilization
+
+    The function solves the following optimization problem:
+
+    .. math::
+        \gamma = arg\min_\gamma <\gamma,M>_F + reg\cdot\Omega(\gamma)
+
+        s.t. \gamma 1 = a
+
+             \gamma^T 1= b
+
+             \gamma\geq 0
+    where :
+
+    - M is the (ns,nt) metric cost matrix
+    - :math:`\Omega` is the entropic regularization term :math:`\Omega(\gamma)=\sum_{i,j} \gamma_{i,j}\log(\gamma_{i,j})`
+    - a and b are source and target weights (sum to 1)
+
+    The algorithm used for solving the problem is the Sinkhorn-Knopp matrix
+    scaling algorithm as proposed in [2]_ but with the log stabilization
+    proposed in [10]_ an defined in [9]_ (Algo 3.1) .
+
+    When sparse_thr is given, the stabilized kernel is truncated as proposed
+    in [9]_ (Section 4.3): entries smaller than sparse_thr relative to the
+    current dual potentials are dropped and the kernel is stored as a CSR
+    sparse matrix. The sparsity pattern is updated at each absorption.
+
+    When b is a matrix, the problems of the targets are solved together with
+    one pair of dual potentials per target, absorbed in one stabilized kernel
+    per target, and the iterations are batched matrix-vector products. The
+    kernels are not shared between the targets, so the memory and the cost
+    of an iteration are O(nbb*ns*nt), as for nbb separate problems. The
+    kernels (c,ns,nt) of at most c targets fit in memory, larger numbers of
+    targets are solved by chunks of c targets.
+
+
+    Parameters
+    ----------
+    a : np.ndarray (ns,)
+        samples weights in the source domain
+    b : np.ndarray (nt,) or np.ndarray (nt,nbb)
+        samples in the target domain, compute sinkhorn with multiple targets
+        and fixed M if b is a matrix (return OT loss + dual variables in log)
+    M : np.ndarray (ns,nt)
+        loss matrix
+    reg : float
+        Regularization term >0
+    tau : float
+        thershold for max value in u or v for log scaling
+    warmstart : tible of vectors
+        if given then sarting values for alpha an beta log scalings, of shape
+        (ns,nbb) and (nt,nbb) for one value per target if b is a matrix
+    numItermax : int, optional
+        Max number of iterations
+    stopThr : float, optional
+        Stop threshol on error (>0)
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+    sparse_thr : float, optional
+        if given, truncation threshold of the stabilized kernel, which is then
+        stored as a scipy.sparse CSR matrix (for instance 1e-20)
+    memory : int, optional
+        Memory budget in bytes for the kernels of the targets solved together
+        when b is a matrix
+
+
+    Returns
+    -------
+    gamma : (ns x nt) ndarray or scipy.sparse.csr_matrix
+        Optimal transportation matrix for the given parameters (sparse if
+        sparse_thr is given)
+    log : dict
+        log dictionary return only if log==True in parameters
+
+    Examples
+    --------
+
+    >>> import ot
+    >>> a=[.5,.5]
+    >>> b=[.5,.5]
+    >>> M=[[0.,1.],[1.,0.]]
+    >>> ot.bregman.sinkhorn_stabilized(a,b,M,1)
+    array([[ 0.36552929,  0.13447071],
+           [ 0.13447071,  0.36552929]])
+
+
+    References
+    ----------
+
+    .. [2] M. Cuturi, Sinkhorn Distances : Lightspeed Computation of Optimal Transport, Advances in Neural Information Processing Systems (NIPS) 26, 2013
+
+    .. [9] Schmitzer, B. (2016). Stabilized Sparse Scaling Algorithms for Entropy Regularized Transport Problems. arXiv preprint arXiv:1610.06519.
+
+    .. [10] Chizat, L., Peyré, G., Schmitzer, B., & Vialard, F. X. (2016). Scaling algorithms for unbalanced transport problems. arXiv preprint arXiv:1607.05816.
+
+
+    See Also
+    --------
+    ot.lp.emd : Unregularized OT
+    ot.optim.cg : General regularized OT
+
+    """
+
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    M = np.asarray(M, dtype=np.float64)
+
+    if len(a) == 0:
+        a = np.ones((M.shape[0],), dtype=np.float64) / M.shape[0]
+    if len(b) == 0:
+        b = np.ones((M.shape[1],), dtype=np.float64) / M.shape[1]
+
+    ws = {'warmstart': warmstart}
+    red = reduce_support(a, b, M, ws)
+    if red is not None:
+        # solve on the support of the weights
+        ar, br, Mr, ia, ib = red
+        return expand_support(sinkhorn_stabilized(
+            ar, br, Mr, reg, numItermax=numItermax, tau=tau, stopThr=stopThr,
+            warmstart=ws['warmstart'], verbose=verbose,
+            print_period=print_period, log=log, sparse_thr=sparse_thr,
+            memory=memory), ia, ib, log)
+
+    # test if multiple target
+    if len(b.shape) > 1:
+        nbb = b.shape[1]
+    else:
+        nbb = 0
+
+    # number of targets whose kernels fit in memory
+    nchunk = max(1, int(memory // (8 * M.size)))
+    if nbb > nchunk:
+        # solve the targets by chunks
+        alpha = beta = None
+        if warmstart is not None:
+            alpha = np.asarray(warmstart[0], dtype=np.float64).reshape(
+                (len(a), -1)) * np.ones((1, nbb))
+            beta = np.asarray(warmstart[1], dtype=np.float64).reshape(
+                (len(b), -1)) * np.ones((1, nbb))
+        res = []
+        logs = []
+        for i in range(0, nbb, nchunk):
+            idx = slice(i, i + nchunk)
+            res_i, log_i = sinkhorn_stabilized(
+                a, b[:, idx], M, reg, numItermax=numItermax, tau=tau,
+                stopThr=stopThr, verbose=verbose, print_period=print_period,
+                log=True, sparse_thr=sparse_thr, memory=memory,
+                warmstart=None if alpha is None else (alpha[:, idx],
+                                                      beta[:, idx]))
+            res.append(res_i)
+            logs.append(log_i)
+        res = np.concatenate(res)
+        if log:
+            log = {'err': [log_i['err'] for log_i in logs]}
+            for key in ['logu', 'logv', 'alpha', 'beta']:
+                log[key] = np.concatenate([log_i[key] for log_i in logs], 1)
+            log['warmstart'] = (log['alpha'], log['beta'])
+            return res, log
+        else:
+            return res
+
+    if nbb:
+        a = a[:, np.newaxis]
+
+    # init data
+    na = len(a)
+    nb = len(b)
+
+    cpt = 0
+    if log:
+        log = {'err': []}
+
+    # we assume that no distances are null except those of the diagonal of
+    # distances
+    if warmstart is None:
+        alpha, beta = np.zeros(na), np.zeros(nb)
+    else:
+        alpha, beta = warmstart
+        alpha = np.asarray(alpha, dtype=np.float64)
+        beta = np.asarray(beta, dtype=np.float64)
+
+    if nbb:
+        # one potential per target
+        alpha = alpha.reshape((na, -1)) * np.ones((1, nbb))
+        beta = beta.reshape((nb, -1)) * np.ones((1, nbb))
+        u, v = np.ones((na, nbb)) / na, np.ones((nb, nbb)) / nb
+    else:
+        u, v = np.ones(na) / na, np.ones(nb) / nb
+
+    def get_K(alpha, beta):
+        """log space computation"""
+        if nbb:
+            # one kernel per target
+            if sparse_thr is not None:
+                return [sparse_kernel(M, alpha[:, k], beta[:, k], reg,
+                                      sparse_thr) for k in range(nbb)]
+            # computed in place to avoid (nbb,ns,nt) temporaries
+            K = np.subtract(alpha.T[:, :, None], M[None, :, :])
+            K += beta.T[:, None, :]
+            K /= reg
+            return np.exp(K, out=K)
+        if sparse_thr is not None:
+            return sparse_kernel(M, alpha, beta, reg, sparse_thr)
+        return np.exp(-(M - alpha.reshape((na, 1)) -
+                        beta.reshape((1, nb))) / reg)
+
+    def dot(K, v):
+        """product of the kernel(s) with the scalings v"""
+        if not nbb:
+            return K.dot(v)
+        if sparse_thr is not None:
+            return np.stack([K[k].dot(v[:, k]) for k in range(nbb)], 1)
+        return np.matmul(K, v.T[:, :, None])[:, :, 0].T
+
+    def transpose(K):
+        """transpose of the kernel(s)"""
+        if nbb:
+            if sparse_thr is not None:
+                return [Kk.T.tocsr() for Kk in K]
+            return K.transpose((0, 2, 1))
+        return K.T
+
+    def get_Gamma(alpha, beta, u, v):
+        """log space gamma computation"""
+        if sparse_thr is not None:
+            return sp.diags(u).dot(K).dot(sp.diags(v)).tocsr()
+        return np.exp(-(M - alpha.reshape((na, 1)) - beta.reshape((1, nb))) /
+                      reg + np.log(u.reshape((na, 1))) + np.log(v.reshape((1, nb))))
+
+    def get_loss(u, v):
+        """OT losses of the couplings with scalings u, v (one per column)"""
+        if sparse_thr is not None:
+            return np.sum(u * dot([Kk.multiply(M).tocsr() for Kk in K], v), 0)
+        # without the (nbb,ns,nt) product of the kernels with M
+        return np.einsum('ik,kij,ij,jk->k', u, K, M, v)
+
+    # print(np.min(K))
+
+    K = get_K(alpha, beta)
+    Kt = transpose(K)
+    loop = 1
+    cpt = 0
+    err = 1
+    while loop:
+
+        uprev = u
+        vprev = v
+
+        # sinkhorn update
+        v = b / (dot(Kt, u) + 1e-16)
+        u = a / (dot(K, v) + 1e-16)
+
+        # remove numerical problems and store them in K
+        if np.abs(u).max() > tau or np.abs(v).max() > tau:
+            # -inf potentials on the bins without mass of a target
+            with np.errstate(divide='ignore'):
+                alpha, beta = alpha + reg * np.log(u), beta + reg * np.log(v)
+            if nbb:
+                u, v = np.ones((na, nbb)) / na, np.ones((nb, nbb)) / nb
+            else:
+                u, v = np.ones(na) / na, np.ones(nb) / nb
+            K = get_K(alpha, beta)
+            Kt = transpose(K)
+
+        if cpt % print_period == 0:
+            # we can speed up the process by checking for the error only all
+            # the 10th iterations
+            # column marginals of the current couplings diag(u)Kdiag(v)
+            err = np.linalg.norm((v * dot(Kt, u) - b))**2
+            if log:
+                log['err'].append(err)
+
+            if verbose:
+                if cpt % (print_period * 20) == 0:
+                    print(
+                        '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
+                print('{:5d}|{:8e}|'.format(cpt, err))
+
+        if err <= stopThr:
+            loop = False
+
+        if cpt >= numItermax:
+            loop = False
+
+        if np.any(np.isnan(u)) or np.any(np.isnan(v)):
+            # we have reached the machine precision
+            # come back to previous solution and quit loop
+            print('Warning: numerical errors at iteration', cpt)
+            u = uprev
+            v = vprev
+            break
+
+        cpt = cpt + 1
+
+    # print('err=',err,' cpt=',cpt)
+    if log:
+        with np.errstate(divide='ignore'):
+            log['logu'] = alpha / reg + np.log(u)
+            log['logv'] = beta / reg + np.log(v)
+            log['alpha'] = alpha + reg * np.log(u)
+            log['beta'] = beta + reg * np.log(v)
+        log['warmstart'] = (log['alpha'], log['beta'])
+        if nbb:
+            return get_loss(u, v), log
+
+        else:
+            return get_Gamma(alpha, beta, u, v), log
+    else:
+        if nbb:
+            return get_loss(u, v)
+        else:
+            return get_Gamma(alpha, beta, u, v)
+
+
+def sinkhorn_epsilon_scaling(a, b, M, reg, numItermax=100, epsilon0=1e4, numInnerItermax=100,
+                             tau=1e3, stopThr=1e-9, warmstart=None, verbose=False, print_period=10, log=False,
+                             sparse_thr=None, **kwargs):
+    """
+    Solve the entropic regularization optimal transport problem with log
+    stabilization and epsilon scaling.
+
+    The function solves the following optimization problem:
+
+    .. math::
+        \gamma = arg\min_\gamma <\gamma,M>_F + reg\cdot\Omega(\gamma)
+
+        s.t. \gamma 1 = a
+
+             \gamma^T 1= b
+
+             \gamma\geq 0
+    where :
+
+    - M is the (ns,nt) metric cost matrix
+    - :math:`\Omega` is the entropic regularization term :math:`\Omega(\gamma)=\sum_{i,j} \gamma_{i,j}\log(\gamma_{i,j})`
+    - a and b are source and target weights (sum to 1)
+
+    The algorithm used for solving the problem is the Sinkhorn-Knopp matrix
+    scaling algorithm as proposed in [2]_ but with the log stabilization
+    proposed in [10]_ and the log scaling proposed in [9]_ algorithm 3.2
+
+    When sparse_thr is given, the truncated sparse kernel of [9]_ is used in
+    the inner stabilized solver (see ot.bregman.sinkhorn_stabilized), and its
+    sparsity pattern follows the dual potentials along the epsilon scaling.
+
+    When b is a matrix, the epsilon scaling is done on all the targets at
+    once with one potential per target.
+
+
+    Parameters
+    ----------
+    a : np.ndarray (ns,)
+        samples weights in the source domain
+    b : np.ndarray (nt,) or np.ndarray (nt,nbb)
+        samples in the target domain, compute sinkhorn with multiple targets
+        and fixed M if b is a matrix (return OT loss + dual variables in log)
+    M : np.ndarray (ns,nt)
+        loss matrix
+    reg : float
+        Regularization term >0
+    tau : float
+        thershold for max value in u or v for log scaling
+    tau : float
+        thershold for max value in u or v for log scaling
+    warmstart : tible of vectors
+        if given then sarting values for alpha an beta log scalings
+    numItermax : int, optional
+        Max number of iterations
+    numInnerItermax : int, optional
+        Max number of iterationsin the inner slog stabilized sinkhorn
+    epsilon0 : int, optional
+        first epsilon regularization value (then exponential decrease to reg)
+    stopThr : float, optional
+        Stop threshol on error (>0)
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+    sparse_thr : float, optional
+        if given, truncation threshold of the stabilized kernel, which is then
+        stored as a scipy.sparse CSR matrix (for instance 1e-20)
+
+
+    Returns
+    -------
+    gamma : (ns x nt) ndarray or scipy.sparse.csr_matrix
+        Optimal transportation matrix for the given parameters (sparse if
+        sparse_thr is given)
+    log : dict
+        log dictionary return only if log==True in parameters
+
+    Examples
+    --------
+
+    >>> import ot
+    >>> a=[.5,.5]
+    >>> b=[.5,.5]
+    >>> M=[[0.,1.],[1.,0.]]
+    >>> ot.bregman.sinkhorn_epsilon_scaling(a,b,M,1)
+    array([[ 0.36552929,  0.13447071],
+           [ 0.13447071,  0.36552929]])
+
+
+    References
+    ----------
+
+    .. [2] M. Cuturi, Sinkhorn Distances : Lightspeed Computation of Optimal Transport, Advances in Neural Information Processing Systems (NIPS) 26, 2013
+
+    .. [9] Schmitzer, B. (2016). Stabilized Sparse Scaling Algorithms for Entropy Regularized Transport Problems. arXiv preprint arXiv:1610.06519.
+
+    See Also
+    --------
+    ot.lp.emd : Unregularized OT
+    ot.optim.cg : General regularized OT
+    ot.bregman.sinkhorn_path : Solutions along a path of reg
+
+    """
+
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    M = np.asarray(M, dtype=np.float64)
+
+    if len(a) == 0:
+        a = np.ones((M.shape[0],), dtype=np.float64) / M.shape[0]
+    if len(b) == 0:
+        b = np.ones((M.shape[1],), dtype=np.float64) / M.shape[1]
+
+    # test if multiple target
+    if len(b.shape) > 1:
+        nbb = b.shape[1]
+    else:
+        nbb = 0
+
+    # init data
+    na = len(a)
+    nb = len(b)
+
+    # nrelative umerical precision with 64 bits
+    numItermin = 35
+    numItermax = max(numItermin, numItermax)  # ensure that last velue is exact
+
+    cpt = 0
+    if log:
+        log = {'err': []}
+
+    # we assume that no distances are null except those of the diagonal of
+    # distances
+    if warmstart is None:
+        alpha, beta = np.zeros(na), np.zeros(nb)
+    else:
+        alpha, beta = warmstart
+
+    def get_K(alpha, beta):
+        """log space computation"""
+        return np.exp(-(M - alpha.reshape((na, 1)) -
+                        beta.reshape((1, nb))) / reg)
+
+    # print(np.min(K))
+    def get_reg(n):  # exponential decreasing
+        return (epsilon0 - reg) * np.exp(-n) + reg
+
+    loop = 1
+    cpt = 0
+    err = 1
+    while loop:
+
+        regi = get_reg(cpt)
+
+        G, logi = sinkhorn_stabilized(a, b, M, regi, numItermax=numInnerItermax, stopThr=1e-9, warmstart=(
+            alpha, beta), verbose=False, print_period=20, tau=tau, log=True,
+            sparse_thr=sparse_thr)
 
         alpha = logi['alpha']
         beta = logi['beta']
 
-        if cpt >= numItermax:
-            loop = False
+        if cpt >= numItermax:
+            loop = False
+
+        if cpt % (print_period) == 0:  # spsion nearly converged
+            # we can speed up the process by checking for the error only all
+            # the 10th iterations
+            if nbb:
+                # G contains only the losses, compute the column marginals of
+                # the couplings from the potentials of each target
+                transp = np.stack([np.exp((alpha[:, k, None] +
+                                           beta[None, :, k] - M) / regi).sum(0)
+                                   for k in range(nbb)], 1)
+                err = np.linalg.norm(transp - b)**2
+            else:
+                transp = G
+                err = np.linalg.norm(
+                    (np.asarray(transp.sum(0)).ravel() - b))**2 + \
+                    np.linalg.norm((np.asarray(transp.sum(1)).ravel() - a))**2
+            if log:
+                log['err'].append(err)
+
+            if verbose:
+                if cpt % (print_period * 10) == 0:
+                    print(
+                        '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
+                print('{:5d}|{:8e}|'.format(cpt, err))
+
+        if err <= stopThr and cpt > numItermin:
+            loop = False
+
+        cpt = cpt + 1
+    # print('err=',err,' cpt=',cpt)
+    if log:
+        log['alpha'] = alpha
+        log['beta'] = beta
+        log['warmstart'] = (log['alpha'], log['beta'])
+        return G, log
+    else:
+        return G
+
+
+def sinkhorn_path(a, b, M, regs, method='sinkhorn_stabilized',
+                  numItermax=1000, stopThr=1e-9, warmstart=None,
+                  verbose=False, log=False, **kwargs):
+    """
+    Solve the entropic regularization optimal transport problem along a path of regularization terms
+
+    The function solves the following optimization problem for each reg in
+    regs:
+
+    .. math::
+        \gamma = arg\min_\gamma <\gamma,M>_F + reg\cdot\Omega(\gamma)
+
+        s.t. \gamma 1 = a
+
+             \gamma^T 1= b
+
+             \gamma\geq 0
+    where :
+
+    - M is the (ns,nt) metric cost matrix
+    - :math:`\Omega` is the entropic regularization term :math:`\Omega(\gamma)=\sum_{i,j} \gamma_{i,j}\log(\gamma_{i,j})`
+    - a and b are source and target weights (sum to 1)
+
+    The problems are solved from the largest to the smallest reg, each
+    solver being warm started from the dual potentials of the previous
+    (more regularized) problem as in the epsilon scaling of [9]_ (see
+    ot.bregman.sinkhorn_epsilon_scaling). The solutions are returned lazily
+    by a generator so that only one OT matrix is stored at a time.
+
+
+    Parameters
+    ----------
+    a : np.ndarray (ns,)
+        samples weights in the source domain
+    b : np.ndarray (nt,) or np.ndarray (nt,nbb)
+        samples in the target domain, compute sinkhorn with multiple targets
+        and fixed M if b is a matrix (return OT loss + dual variables in log)
+    M : np.ndarray (ns,nt)
+        loss matrix
+    regs : list of float
+        Regularization terms >0
+    method : str
+        method used for the solver (see ot.bregman.sinkhorn), should accept
+        a warmstart and work in the log domain for small reg (default is
+        'sinkhorn_stabilized')
+    numItermax : int, optional
+        Max number of iterations for each reg
+    stopThr : float, optional
+        Stop threshol on error (>0)
+    warmstart : tuple of vectors, optional
+        if given then starting values (alpha, beta) for the dual potentials of
+        the first problem
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+
+
+    Returns
+    -------
+    path : generator
+        generator of (reg, gamma) or (reg, gamma, log) if log==True in
+        parameters, with reg in decreasing order and gamma the OT matrix (or
+        the OT losses if b is a matrix) for this reg
+
+    Examples
+    --------
+
+    >>> import ot
+    >>> a=[.5,.5]
+    >>> b=[.5,.5]
+    >>> M=[[0.,1.],[1.,0.]]
+    >>> for reg, G in ot.bregman.sinkhorn_path(a,b,M,[.1,1]):
+    ...     print(reg, G[0, 1].round(4))
+    1 0.1345
+    0.1 0.0
+
+
+    References
+    ----------
+
+    .. [9] Schmitzer, B. (2016). Stabilized Sparse Scaling Algorithms for Entropy Regularized Transport Problems. arXiv preprint arXiv:1610.06519.
+
+    See Also
+    --------
+    ot.bregman.sinkhorn : Entropic regularized OT
+    ot.bregman.sinkhorn_epsilon_scaling : Sinkhorn with epsilon scaling [9]
+
+    """
+
+    for reg in sorted(regs, reverse=True):
+        if verbose:
+            print('reg={:8e}'.format(reg))
+
+        G, logi = sinkhorn(a, b, M, reg, method=method, numItermax=numItermax,
+                           stopThr=stopThr, warmstart=warmstart,
+                           verbose=verbose, log=True, **kwargs)
+        warmstart = logi['warmstart']
+
+        if log:
+            yield reg, G, logi
+        else:
+            yield reg, G
+
+
+def sinkhorn_nystrom(a, b, Xs, Xt, reg, rank=100, rankThr=1e-6, maxRank=None,
+                     metric='sqeuclidean', numItermax=1000, stopThr=1e-9,
+                     random_state=None, warmstart=None, verbose=False,
+                     log=False, **kwargs):
+    """
+    Solve the entropic regularization optimal transport problem between samples with a low rank Nystrom kernel
+
+    The function solves the following optimization problem:
+
+    .. math::
+        \gamma = arg\min_\gamma <\gamma,M>_F + reg\cdot\Omega(\gamma)
+
+        s.t. \gamma 1 = a
+
+             \gamma^T 1= b
+
+             \gamma\geq 0
+    where :
+
+    - M is the (ns,nt) metric cost matrix between the samples Xs and Xt
+    - :math:`\Omega` is the entropic regularization term :math:`\Omega(\gamma)=\sum_{i,j} \gamma_{i,j}\log(\gamma_{i,j})`
+    - a and b are source and target weights (sum to 1)
+
+    The algorithm used for solving the problem is the Sinkhorn-Knopp matrix
+    scaling algorithm as proposed in [2]_ where the kernel
+    :math:`K=\exp(-M/reg)` is replaced by its Nystrom approximation
+    :math:`K\\approx\Phi_s\Phi_t^T` computed from landmarks sampled among
+    the samples [18]_. The rank is doubled until the mean error on the
+    diagonal of the kernel is below rankThr or the rank reaches maxRank (with
+    a warning). Small values of reg need large ranks, maxRank bounds the
+    memory and the cost of the eigendecomposition. Neither M nor K are built, the
+    memory is O((ns+nt)r) and each iteration costs O((ns+nt)r) where r is the
+    final rank.
+
+    The OT matrix :math:`\gamma=diag(u)\Phi_s\Phi_t^Tdiag(v)` is returned in
+    factored form as the two matrices :math:`diag(u)\Phi_s` and
+    :math:`diag(v)\Phi_t` so that it can be applied without being built.
+    Note that the approximated kernel can have negative entries when the rank
+    is too small, in which case the iterations stop with a warning.
+
+
+    Parameters
+    ----------
+    a : np.ndarray (ns,)
+        samples weights in the source domain
+    b : np.ndarray (nt,)
+        samples weights in the target domain
+    Xs : np.ndarray (ns,d)
+        samples in the source domain
+    Xt : np.ndarray (nt,d)
+        samples in the target domain
+    reg : float
+        Regularization term >0
+    rank : int, optional
+        Initial number of landmarks
+    rankThr : float, optional
+        Threshold on the mean error of the diagonal of the approximated kernel
+    maxRank : int, optional
+        Max number of landmarks (10*sqrt(ns+nt) by default)
+    metric : str, optional
+        Metric used for the cost matrix computation, must give a positive
+        definite kernel (e.g. 'sqeuclidean' or 'euclidean')
+    numItermax : int, optional
+        Max number of iterations
+    stopThr : float, optional
+        Stop threshol on error (>0)
+    random_state : int, RandomState instance or None, optional
+        Seed or generator used to sample the landmarks
+    warmstart : tuple of vectors, optional
+        if given then starting values (alpha, beta) for the dual potentials,
+        the scalings are initialized to :math:`u=\exp(\\alpha/reg)` and
+        :math:`v=\exp(\\beta/reg)` (see log['warmstart'])
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+
+
+    Returns
+    -------
+    Gs : (ns x r) ndarray
+        Source factor of the OT matrix
+    Gt : (nt x r) ndarray
+        Target factor of the OT matrix (gamma=Gs.dot(Gt.T))
+    log : dict
+        log dictionary return only if log==True in parameters
+
+    Examples
+    --------
+
+    >>> import ot
+    >>> rng = np.random.RandomState(0)
+    >>> Xs = rng.randn(100, 2)
+    >>> Xt = rng.randn(200, 2)
+    >>> Gs, Gt = ot.bregman.sinkhorn_nystrom([], [], Xs, Xt, 10, random_state=0)
+    >>> Gs.dot(Gt.T.dot(Xt)).shape # barycentric mapping of the samples
+    (100, 2)
+
+
+    References
+    ----------
+
+    .. [2] M. Cuturi, Sinkhorn Distances : Lightspeed Computation of Optimal Transport, Advances in Neural Information Processing Systems (NIPS) 26, 2013
+
+    .. [18] Altschuler J., Bach F., Rudi A., Weed J. (2018). Massively scalable Sinkhorn distances via the Nyström method. arXiv preprint arXiv:1812.05189.
+
+
+    See Also
+    --------
+    ot.bregman.sinkhorn_knopp : Classic Sinkhorn [2]
+    ot.bregman.nystrom_kernel : Adaptive Nystrom kernel approximation
+
+    """
+
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+
+    if len(a) == 0:
+        a = np.ones((Xs.shape[0],), dtype=np.float64) / Xs.shape[0]
+    if len(b) == 0:
+        b = np.ones((Xt.shape[0],), dtype=np.float64) / Xt.shape[0]
+
+    Phis, Phit = nystrom_kernel(Xs, Xt, reg, rank=rank, rankThr=rankThr,
+                                maxRank=maxRank, metric=metric,
+                                random_state=random_state)
+
+    if log:
+        log = {'err': [], 'rank': Phis.shape[1]}
+
+    if warmstart is None:
+        u = np.ones(len(a)) / len(a)
+        v = np.ones(len(b)) / len(b)
+    else:
+        u = np.exp(np.asarray(warmstart[0], dtype=np.float64) / reg)
+        v = np.exp(np.asarray(warmstart[1], dtype=np.float64) / reg)
+
+    cpt = 0
+    err = 1
+    while (err > stopThr and cpt < numItermax):
+        uprev = u
+        vprev = v
+        KtransposeU = Phit.dot(Phis.T.dot(u))
+        v = np.divide(b, KtransposeU)
+        Kv = Phis.dot(Phit.T.dot(v))
+        u = np.divide(a, Kv)
+
+        if (np.any(KtransposeU <= 0) or np.any(Kv <= 0) or
+                np.any(np.isnan(u)) or np.any(np.isnan(v)) or
+                np.any(np.isinf(u)) or np.any(np.isinf(v))):
+            # the approximated kernel is not positive or we have reached the
+            # machine precision, come back to previous solution and quit loop
+            print('Warning: numerical errors at iteration', cpt)
+            u = uprev
+            v = vprev
+            break
+        if cpt % 10 == 0:
+            # we can speed up the process by checking for the error only all
+            # the 10th iterations
+            err = np.linalg.norm(v * Phit.dot(Phis.T.dot(u)) - b)**2
+            if log:
+                log['err'].append(err)
+
+            if verbose:
+                if cpt % 200 == 0:
+                    print(
+                        '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
+                print('{:5d}|{:8e}|'.format(cpt, err))
+        cpt = cpt + 1
+
+    if log:
+        log['u'] = u
+        log['v'] = v
+        log['warmstart'] = (reg * np.log(u), reg * np.log(v))
+        log['niter'] = cpt
+        return u.reshape((-1, 1)) * Phis, v.reshape((-1, 1)) * Phit, log
+    else:
+        return u.reshape((-1, 1)) * Phis, v.reshape((-1, 1)) * Phit
+
+
+def nystrom_kernel(Xs, Xt, reg, rank=100, rankThr=1e-6, maxRank=None,
+                   metric='sqeuclidean', random_state=None):
+    """return the factors of the Nystrom approximation of exp(-M/reg)
+
+    The landmarks are sampled uniformly among the source and target samples
+    with random_state and their number is doubled until the mean error on the
+    diagonal of the kernel (equal to 1) is below rankThr or reaches maxRank
+    (10*sqrt(ns+nt) by default), in which case a warning is printed.
+
+    Returns
+    -------
+    Phis : (ns x r) ndarray
+    Phit : (nt x r) ndarray
+        Factors of the approximated kernel K=Phis.dot(Phit.T)
+    """
+    def factor(X, Z, W):
+        # computed by blocks of rows to avoid the (n,rank) temporaries
+        nrows = max(1, 2**20 // Z.shape[0])
+        Phi = np.empty((X.shape[0], W.shape[1]))
+        for i in range(0, X.shape[0], nrows):
+            Phi[i:i + nrows] = np.exp(
+                -dist(X[i:i + nrows], Z, metric=metric) / reg).dot(W)
+        return Phi
+
+    ns, nt = Xs.shape[0], Xt.shape[0]
+    perm = check_random_state(random_state).permutation(ns + nt)
+    if maxRank is None:
+        maxRank = max(rank, int(10 * np.sqrt(ns + nt)))
+    maxRank = min(maxRank, ns + nt)
+    rank = min(rank, maxRank)
+
+    while True:
+        idx = perm[:rank]
+        Z = np.vstack((Xs[idx[idx < ns]], Xt[idx[idx >= ns] - ns]))
+
+        # K_zz^{-1/2} with the small eigenvalues removed
+        w, V = np.linalg.eigh(np.exp(-dist(Z, Z, metric=metric) / reg))
+        keep = w > w.max() * 1e-10
+        W = V[:, keep] / np.sqrt(w[keep])
+
+        Phis = factor(Xs, Z, W)
+        Phit = factor(Xt, Z, W)
+
+        # mean error on the diagonal of the kernel (trace norm error)
+        err = (np.sum(1 - np.sum(Phis**2, 1)) +
+               np.sum(1 - np.sum(Phit**2, 1))) / (ns + nt)
+        if err <= rankThr:
+            return Phis, Phit
+        if rank == maxRank:
+            print('Warning: Nystrom kernel error {:e} above rankThr with the '
+                  'max rank {}'.format(err, rank))
+            return Phis, Phit
+        rank = min(2 * rank, maxRank)
+
+
+def sinkhorn_lazy(a, b, Xs, Xt, reg, metric='sqeuclidean', numItermax=1000,
+                  stopThr=1e-9, memory=2**28, n_threads=None, warmstart=None,
+                  verbose=False, log=False, **kwargs):
+    """
+    Solve the entropic regularization optimal transport problem between samples without storing the cost matrix
+
+    The function solves the following optimization problem:
+
+    .. math::
+        \gamma = arg\min_\gamma <\gamma,M>_F + reg\cdot\Omega(\gamma)
+
+        s.t. \gamma 1 = a
+
+             \gamma^T 1= b
+
+             \gamma\geq 0
+    where :
+
+    - M is the (ns,nt) metric cost matrix between the samples Xs and Xt
+    - :math:`\Omega` is the entropic regularization term :math:`\Omega(\gamma)=\sum_{i,j} \gamma_{i,j}\log(\gamma_{i,j})`
+    - a and b are source and target weights (sum to 1)
+
+    The algorithm used for solving the problem is the Sinkhorn-Knopp matrix
+    scaling algorithm as proposed in [2]_ computed in the log domain on the
+    dual potentials :math:`\\alpha,\\beta` such that
+    :math:`\gamma_{i,j}=\exp((\\alpha_i+\\beta_j-M_{i,j})/reg)`. Neither M nor
+    the kernel are stored: the cost is recomputed from the samples by blocks
+    of rows whose size is chosen such that the blocks processed in parallel
+    use about memory bytes. Each iteration is a single pass over the blocks,
+    in which the source potentials of a block are updated and its
+    contribution to the log-sum-exp of the target potentials is accumulated.
+    The blocks are spread over a pool of n_threads threads.
+
+    The OT matrix is never built, the function returns the potentials and a
+    function that computes the rows of the OT matrix for given source
+    indices.
+
+
+    Parameters
+    ----------
+    a : np.ndarray (ns,)
+        samples weights in the source domain
+    b : np.ndarray (nt,)
+        samples weights in the target domain
+    Xs : np.ndarray (ns,d)
+        samples in the source domain
+    Xt : np.ndarray (nt,d)
+        samples in the target domain
+    reg : float
+        Regularization term >0
+    metric : str, optional
+        Metric used for the cost matrix computation (see ot.dist)
+    numItermax : int, optional
+        Max number of iterations
+    stopThr : float, optional
+        Stop threshol on error (>0)
+    memory : int, optional
+        Memory budget in bytes for the blocks of the cost matrix
+    n_threads : int, optional
+        Number of threads (default is the number of cpu)
+    warmstart : tuple of vectors, optional
+        if given then starting values (alpha, beta) for the dual potentials
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+
+
+    Returns
+    -------
+    alpha : (ns,) ndarray
+        Dual potential of the source samples
+    beta : (nt,) ndarray
+        Dual potential of the target samples
+    get_G : function
+        get_G(idx) returns the rows idx of the OT matrix as a
+        (len(idx) x nt) ndarray
+    log : dict
+        log dictionary return only if log==True in parameters
+
+    Examples
+    --------
+
+    >>> import ot
+    >>> Xs = np.random.randn(1000, 2)
+    >>> Xt = np.random.randn(2000, 2)
+    >>> alpha, beta, get_G = ot.bregman.sinkhorn_lazy([], [], Xs, Xt, 1)
+    >>> get_G(np.arange(10)).shape
+    (10, 2000)
+
+
+    References
+    ----------
+
+    .. [2] M. Cuturi, Sinkhorn Distances : Lightspeed Computation of Optimal Transport, Advances in Neural Information Processing Systems (NIPS) 26, 2013
+
+
+    See Also
+    --------
+    ot.bregman.sinkhorn_knopp : Classic Sinkhorn [2]
+    ot.bregman.sinkhorn_stabilized: Stabilized sinkhorn [9][10]
+
+    """
+
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+
+    ns, nt = Xs.shape[0], Xt.shape[0]
+
+    if len(a) == 0:
+        a = np.ones((ns,), dtype=np.float64) / ns
+    if len(b) == 0:
+        b = np.ones((nt,), dtype=np.float64) / nt
+
+    if n_threads is None:
+        n_threads = multiprocessing.cpu_count()
+
+    # two (nrows,nt) buffers per block in use
+    nrows = int(max(1, memory // (16 * nt * n_threads)))
+    blocks = [slice(i, min(i + nrows, ns)) for i in range(0, ns, nrows)]
+
+    if metric == 'sqeuclidean':
+        Xs2 = np.sum(Xs**2, 1)
+        Xt2 = np.sum(Xt**2, 1)
+
+    def get_M(idx):
+        if metric == 'sqeuclidean':
+            M = np.dot(Xs[idx], -2 * Xt.T)
+            M += Xs2[idx].reshape((-1, 1))
+            M += Xt2.reshape((1, -1))
+            return np.maximum(M, 0, out=M)
+        else:
+            return dist(Xs[idx], Xt, metric=metric)
+
+    loga = np.log(a)
+    logb = np.log(b)
+
+    if warmstart is None:
+        alpha = np.zeros(ns)
+        beta = np.zeros(nt)
+    else:
+        alpha = np.array(warmstart[0], dtype=np.float64)
+        beta = np.array(warmstart[1], dtype=np.float64)
+
+    def update_block(idx):
+        # update of alpha on the block with the current beta
+        M = get_M(idx)
+        S = np.subtract(beta, M)
+        S /= reg
+        smax = S.max(1)
+        S -= smax.reshape((-1, 1))
+        np.exp(S, out=S)
+        alpha[idx] = reg * (loga[idx] - smax - np.log(S.sum(1)))
+
+        # partial log-sum-exp over the block for the update of beta
+        np.subtract(alpha[idx].reshape((-1, 1)), M, out=S)
+        S /= reg
+        smax = S.max(0)
+        smax[~np.isfinite(smax)] = 0
+        S -= smax.reshape((1, -1))
+        np.exp(S, out=S)
+        return smax, S.sum(0)
+
+    if log:
+        log = {'err': []}
+
+    cpt = 0
+    err = 1
+    pool = ThreadPool(n_threads)
+    try:
+        while (err > stopThr and cpt < numItermax):
+
+            res = pool.map(update_block, blocks)
+
+            # combine the partial log-sum-exp of the blocks
+            smax = np.max([r[0] for r in res], 0)
+            ssum = np.sum([r[1] * np.exp(r[0] - smax) for r in res], 0)
+            lse = smax + np.log(ssum)
+
+            # the marginal of the OT matrix before the update of beta is free
+            err = np.linalg.norm(np.exp(beta / reg + lse) - b)**2
+
+            beta = reg * (logb - lse)
+
+            if np.any(np.isnan(alpha)) or np.any(np.isnan(beta)):
+                print('Warning: numerical errors at iteration', cpt)
+                break
+
+            if cpt % 10 == 0:
+                if log:
+                    log['err'].append(err)
+
+                if verbose:
+                    if cpt % 200 == 0:
+                        print(
+                            '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
+                    print('{:5d}|{:8e}|'.format(cpt, err))
+            cpt = cpt + 1
+    finally:
+        pool.close()
+        pool.join()
+
+    def get_G(idx):
+        return np.exp((alpha[idx].reshape((-1, 1)) + beta.reshape((1, -1)) -
+                       get_M(idx)) / reg)
+
+    if log:
+        log['niter'] = cpt
+        log['warmstart'] = (alpha, beta)
+        return alpha, beta, get_G, log
+    else:
+        return alpha, beta, get_G
+
+
+def sinkhorn_memmap(a, b, M, reg, numItermax=1000, stopThr=1e-9,
+                    memory=2**28, out=None, warmstart=None, verbose=False,
+                    log=False, **kwargs):
+    """
+    Solve the entropic regularization optimal transport problem with a cost matrix stored on disk
+
+    The function solves the following optimization problem:
+
+    .. math::
+        \gamma = arg\min_\gamma <\gamma,M>_F + reg\cdot\Omega(\gamma)
+
+        s.t. \gamma 1 = a
+
+             \gamma^T 1= b
+
+             \gamma\geq 0
+    where :
+
+    - M is the (ns,nt) metric cost matrix
+    - :math:`\Omega` is the entropic regularization term :math:`\Omega(\gamma)=\sum_{i,j} \gamma_{i,j}\log(\gamma_{i,j})`
+    - a and b are source and target weights (sum to 1)
+
+    The algorithm used for solving the problem is the Sinkhorn-Knopp matrix
+    scaling algorithm as proposed in [2]_ where M is a memory mapped array
+    (or the path of a .npy file) that is read sequentially by blocks of rows
+    of about memory bytes. Each iteration is a single pass over the blocks in
+    which the kernel of the block is computed, the scaling u of its rows is
+    updated and its contribution to :math:`K^Tu` is accumulated.
+
+
+    Parameters
+    ----------
+    a : np.ndarray (ns,)
+        samples weights in the source domain
+    b : np.ndarray (nt,) or np.ndarray (nt,nbb)
+        samples in the target domain, compute sinkhorn with multiple targets
+        and fixed M if b is a matrix (return OT loss + dual variables in log)
+    M : np.memmap (ns,nt) or str
+        loss matrix or path of the .npy file containing it
+    reg : float
+        Regularization term >0
+    numItermax : int, optional
+        Max number of iterations
+    stopThr : float, optional
+        Stop threshol on error (>0)
+    memory : int, optional
+        Memory budget in bytes for the blocks of the cost matrix
+    out : np.ndarray (ns,nt) or str, optional
+        Array (possibly memory mapped) or path of the .npy file in which the
+        OT matrix is written (default is a new array in memory)
+    warmstart : tuple of vectors, optional
+        if given then starting values (alpha, beta) for the dual potentials,
+        the scalings are initialized to :math:`u=\exp(\\alpha/reg)` and
+        :math:`v=\exp(\\beta/reg)` (see log['warmstart'])
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+
+
+    Returns
+    -------
+    gamma : (ns x nt) ndarray
+        Optimal transportation matrix for the given parameters
+    log : dict
+        log dictionary return only if log==True in parameters
+
+    References
+    ----------
+
+    .. [2] M. Cuturi, Sinkhorn Distances : Lightspeed Computation of Optimal Transport, Advances in Neural Information Processing Systems (NIPS) 26, 2013
+
+
+    See Also
+    --------
+    ot.bregman.sinkhorn_knopp : Classic Sinkhorn [2]
+
+    """
+
+    if isinstance(M, str):
+        M = np.load(M, mmap_mode='r')
+
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+
+    if len(a) == 0:
+        a = np.ones((M.shape[0],), dtype=np.float64) / M.shape[0]
+    if len(b) == 0:
+        b = np.ones((M.shape[1],), dtype=np.float64) / M.shape[1]
+
+    # init data
+    Nini = len(a)
+    Nfin = len(b)
+
+    if len(b.shape) > 1:
+        nbb = b.shape[1]
+        a = a.reshape((-1, 1))
+    else:
+        nbb = 0
+
+    # two (nrows,nt) blocks in memory (cost and kernel)
+    nrows = int(max(1, memory // (16 * Nfin)))
+    blocks = [slice(i, min(i + nrows, Nini)) for i in range(0, Nini, nrows)]
+
+    def get_K(idx):
+        Mi = np.asarray(M[idx], dtype=np.float64)
+        return Mi, np.exp(-Mi / reg)
+
+    if log:
+        log = {'err': []}
+
+    if warmstart is not None:
+        u = np.exp(np.asarray(warmstart[0], dtype=np.float64) / reg)
+        v = np.exp(np.asarray(warmstart[1], dtype=np.float64) / reg)
+        if nbb:
+            u = u.reshape((Nini, -1)) * np.ones((1, nbb))
+            v = v.reshape((Nfin, -1)) * np.ones((1, nbb))
+    elif nbb:
+        u = np.ones((Nini, nbb)) / Nini
+        v = np.ones((Nfin, nbb)) / Nfin
+    else:
+        u = np.ones(Nini) / Nini
+        v = np.ones(Nfin) / Nfin
+
+    cpt = 0
+    err = 1
+    while (err > stopThr and cpt < numItermax):
+        uprev = u.copy()
+        vprev = v
+
+        # single pass on the blocks of M
+        KtransposeU = 0
+        for idx in blocks:
+            Ki = get_K(idx)[1]
+            u[idx] = a[idx] / np.dot(Ki, v)
+            KtransposeU += np.dot(Ki.T, u[idx])
+
+        # the marginal of the OT matrix before the update of v is free
+        err = np.linalg.norm(v * KtransposeU - b)**2
+        v = np.divide(b, KtransposeU)
+
+        if (np.any(KtransposeU == 0) or
+                np.any(np.isnan(u)) or np.any(np.isnan(v)) or
+                np.any(np.isinf(u)) or np.any(np.isinf(v))):
+            # we have reached the machine precision
+            # come back to previous solution and quit loop
+            print('Warning: numerical errors at iteration', cpt)
+            u = uprev
+            v = vprev
+            break
+        if cpt % 10 == 0:
+            if log:
+                log['err'].append(err)
+
+            if verbose:
+                if cpt % 200 == 0:
+                    print(
+                        '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
+                print('{:5d}|{:8e}|'.format(cpt, err))
+        cpt = cpt + 1
+    if log:
+        log['u'] = u
+        log['v'] = v
+        log['warmstart'] = (reg * np.log(u), reg * np.log(v))
+
+    if nbb:  # return only loss
+        res = np.zeros((nbb))
+        for idx in blocks:
+            Mi, Ki = get_K(idx)
+            res += np.sum(u[idx] * np.dot(Ki * Mi, v), 0)
+        if log:
+            return res, log
+        else:
+            return res
+
+    else:  # return OT matrix
+        if out is None:
+            G = np.empty((Nini, Nfin))
+        elif isinstance(out, str):
+            G = np.lib.format.open_memmap(out, mode='w+', dtype=np.float64,
+                                          shape=(Nini, Nfin))
+        else:
+            G = out
+        for idx in blocks:
+            G[idx] = u[idx].reshape((-1, 1)) * get_K(idx)[1] * v.reshape((1, -1))
+        if isinstance(G, np.memmap):
+            G.flush()
+
+        if log:
+            return G, log
+        else:
+            return G
+
+
+def sinkhorn_divergence(Xs, Xt, a, b, reg, metric='sqeuclidean',
+                        numItermax=1000, stopThr=1e-9, verbose=False,
+                        log=False, **kwargs):
+    """
+    Compute the debiased Sinkhorn divergence between two empirical distributions
+
+    The function computes the Sinkhorn divergence [23]_:
+
+    .. math::
+        S(a,b) = W(a,b) - \frac{1}{2}(W(a,a) + W(b,b))
+
+    where :
+
+    - :math:`W(a,b)=<\gamma,M>_F` is the loss of the entropic regularized OT
+      matrix :math:`\gamma` between a and b (see ot.bregman.sinkhorn2)
+    - M is the metric cost matrix between the samples
+    - a and b are source and target weights (sum to 1)
+
+    The three OT problems (between Xs and Xt, Xs and Xs, Xt and Xt) have
+    their own cost matrix and kernel, and their iterations are run in the
+    same loop until all of them have converged. The symmetric problems
+    :math:`W(a,a)` and :math:`W(b,b)` have a symmetric OT matrix :math:`\gamma=diag(u)Kdiag(u)` and are solved with
+    the fixed point iterations :math:`u \leftarrow \sqrt{u\ a / Ku}` that
+    need only one product with the kernel per iteration.
+
+
+    Parameters
+    ----------
+    Xs : np.ndarray (ns,d)
+        samples in the source domain
+    Xt : np.ndarray (nt,d)
+        samples in the target domain
+    a : np.ndarray (ns,)
+        samples weights in the source domain
+    b : np.ndarray (nt,)
+        samples weights in the target domain
+    reg : float
+        Regularization term >0
+    metric : str, optional
+        Metric used for the cost matrix computation (see ot.dist)
+    numItermax : int, optional
+        Max number of iterations
+    stopThr : float, optional
+        Stop threshol on error (>0)
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+
+
+    Returns
+    -------
+    S : float
+        Sinkhorn divergence
+    log : dict
+        log dictionary return only if log==True in parameters, contains the
+        losses W(a,b), W(a,a), W(b,b), the scalings u, v of W(a,b) and us, ut
+        of W(a,a), W(b,b)
+
+    Examples
+    --------
+
+    >>> import ot
+    >>> Xs = np.array([[0.], [1.]])
+    >>> Xt = np.array([[0.], [2.]])
+    >>> a = [.5, .5]
+    >>> print('{:.5f}'.format(ot.bregman.sinkhorn_divergence(Xs, Xt, a, a, 1)))
+    0.56796
+
+
+    References
+    ----------
+
+    .. [23] Genevay, A., Peyré, G., Cuturi, M. (2018). Learning Generative Models with Sinkhorn Divergences. Proceedings of the Twenty-First International Conference on Artficial Intelligence and Statistics (AISTATS) 21, 2018
+
+
+    See Also
+    --------
+    ot.bregman.sinkhorn2 : Entropic regularized OT loss
+    ot.bregman.sinkhorn_lazy : Sinkhorn between samples without storing M
+
+    """
+
+    Xs = np.asarray(Xs, dtype=np.float64)
+    Xt = np.asarray(Xt, dtype=np.float64)
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+
+    ns, nt = len(Xs), len(Xt)
+
+    if len(a) == 0:
+        a = np.ones((ns,), dtype=np.float64) / ns
+    if len(b) == 0:
+        b = np.ones((nt,), dtype=np.float64) / nt
+
+    # cost and kernel of the three problems
+    Mst = dist(Xs, Xt, metric=metric)
+    Mss = dist(Xs, Xs, metric=metric)
+    Mtt = dist(Xt, Xt, metric=metric)
+    Kst = np.exp(-Mst / reg)
+    Kss = np.exp(-Mss / reg)
+    Ktt = np.exp(-Mtt / reg)
+
+    if log:
+        log = {'err': []}
+
+    u = np.ones(ns) / ns
+    v = np.ones(nt) / nt
+    us = np.ones(ns)
+    ut = np.ones(nt)
+
+    cpt = 0
+    err = 1
+    while (err > stopThr and cpt < numItermax):
+        uprev, vprev, usprev, utprev = u, v, us, ut
+
+        # Sinkhorn iterations for W(a,b)
+        KtransposeU = np.dot(Kst.T, u)
+        v = np.divide(b, KtransposeU)
+        u = np.divide(a, np.dot(Kst, v))
+
+        # symmetric iterations for W(a,a) and W(b,b)
+        Kus = np.dot(Kss, us)
+        Kut = np.dot(Ktt, ut)
+        us = np.sqrt(us * a / Kus)
+        ut = np.sqrt(ut * b / Kut)
+
+        if (np.any(KtransposeU == 0) or np.any(Kus == 0) or np.any(Kut == 0) or
+                not np.all(np.isfinite(u)) or not np.all(np.isfinite(v)) or
+                not np.all(np.isfinite(us)) or not np.all(np.isfinite(ut))):
+            # we have reached the machine precision
+            # come back to previous solution and quit loop
+            print('Warning: numerical errors at iteration', cpt)
+            u, v, us, ut = uprev, vprev, usprev, utprev
+            break
+        if cpt % 10 == 0:
+            # we can speed up the process by checking for the error only all
+            # the 10th iterations
+            err = max(np.linalg.norm(v * np.dot(Kst.T, u) - b)**2,
+                      np.linalg.norm(us * np.dot(Kss, us) - a)**2,
+                      np.linalg.norm(ut * np.dot(Ktt, ut) - b)**2)
+            if log:
+                log['err'].append(err)
+
+            if verbose:
+                if cpt % 200 == 0:
+                    print(
+                        '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
+                print('{:5d}|{:8e}|'.format(cpt, err))
+        cpt = cpt + 1
+
+    # losses without the products of the kernels with M
+    loss_st = np.einsum('i,ij,ij,j->', u, Kst, Mst, v)
+    loss_ss = np.einsum('i,ij,ij,j->', us, Kss, Mss, us)
+    loss_tt = np.einsum('i,ij,ij,j->', ut, Ktt, Mtt, ut)
+
+    res = loss_st - (loss_ss + loss_tt) / 2
+
+    if log:
+        log['loss'] = (loss_st, loss_ss, loss_tt)
+        log['u'] = u
+        log['v'] = v
+        log['us'] = us
+        log['ut'] = ut
+        log['niter'] = cpt
+        return res, log
+    else:
+        return res
+
+
+def sparse_kernel(M, alpha, beta, reg, thr):
+    """return the log stabilized kernel truncated below thr as a CSR matrix
+
+    The kernel is computed by blocks of rows so that the dense (ns,nt) kernel
+    is never built.
+    """
+    na, nb = M.shape
+    nrows = max(1, 2**20 // nb)
+    blocks = []
+    for i in range(0, na, nrows):
+        Ki = np.exp(-(M[i:i + nrows] - alpha[i:i + nrows].reshape((-1, 1)) -
+                      beta.reshape((1, nb))) / reg)
+        Ki[Ki < thr] = 0
+        blocks.append(sp.csr_matrix(Ki))
+    return sp.vstack(blocks, format='csr')
+
+
+def geometricBar(weights, alldistribT):
+    """return the weighted geometric mean of distributions"""
+    assert(len(weights) == alldistribT.shape[1])
+    return np.exp(np.dot(np.log(alldistribT), weights.T))
+
+
+def geometricMean(alldistribT):
+    """return the  geometric mean of distributions"""
+    return np.exp(np.mean(np.log(alldistribT), axis=1))
+
+
+def projR(gamma, p):
+    """return the KL projection on the row constrints """
+    return np.multiply(gamma.T, p / np.maximum(np.sum(gamma, axis=1), 1e-10)).T
+
+
+def projC(gamma, q):
+    """return the KL projection on the column constrints """
+    return np.multiply(gamma, q / np.maximum(np.sum(gamma, axis=0), 1e-10))
+
+
+def barycenter(A, M, reg, weights=None, method='sinkhorn', numItermax=1000,
+               stopThr=1e-4, verbose=False, log=False, **kwargs):
+    """Compute the entropic regularized wasserstein barycenter of distributions A
+
+     The function solves the following optimization problem:
+
+    .. math::
+       \mathbf{a} = arg\min_\mathbf{a} \sum_i W_{reg}(\mathbf{a},\mathbf{a}_i)
+
+    where :
+
+    - :math:`W_{reg}(\cdot,\cdot)` is the entropic regularized Wasserstein distance (see ot.bregman.sinkhorn)
+    - :math:`\mathbf{a}_i` are training distributions in the columns of matrix :math:`\mathbf{A}`
+    - reg and :math:`\mathbf{M}` are respectively the regularization term and the cost matrix for OT
+
+    The algorithm used for solving the problem is the Sinkhorn-Knopp matrix scaling algorithm as proposed in [3]_
+
+    Parameters
+    ----------
+    A : np.ndarray (d,n) or np.ndarray (ngroups,d,n)
+        n training distributions of size d (ngroups barycenters are
+        computed at once for a 3D array with method 'sinkhorn')
+    M : np.ndarray (d,d)
+        loss matrix   for OT
+    reg : float
+        Regularization term >0
+    weights : np.ndarray (n,) or np.ndarray (ngroups,n), optional
+        Weights of the training distributions (uniform by default)
+    method : str
+        method used for the solver either 'sinkhorn' or 'sinkhorn_stabilized'
+        (for small reg), see those function for specific parameters
+    numItermax : int, optional
+        Max number of iterations
+    stopThr : float, optional
+        Stop threshol on error (>0)
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+
+
+    Returns
+    -------
+    a : (d,) ndarray or (ngroups,d) ndarray
+        Wasserstein barycenter (of each group)
+    log : dict
+        log dictionary return only if log==True in parameters
+
+
+    References
+    ----------
+
+    .. [3] Benamou, J. D., Carlier, G., Cuturi, M., Nenna, L., & Peyré, G. (2015). Iterative Bregman projections for regularized transportation problems. SIAM Journal on Scientific Computing, 37(2), A1111-A1138.
+
+
+    See Also
+    --------
+    ot.bregman.barycenter_sinkhorn : Barycenter with Bregman projections [3]
+    ot.bregman.barycenter_stabilized : Log stabilized barycenter [3][9]
+
+    """
+
+    if method.lower() == 'sinkhorn':
+        return barycenter_sinkhorn(A, M, reg, weights=weights,
+                                   numItermax=numItermax, stopThr=stopThr,
+                                   verbose=verbose, log=log, **kwargs)
+    elif method.lower() == 'sinkhorn_stabilized':
+        return barycenter_stabilized(A, M, reg, weights=weights,
+                                     numItermax=numItermax, stopThr=stopThr,
+                                     verbose=verbose, log=log, **kwargs)
+    else:
+        print('Warning : unknown method using classic Sinkhorn')
+        return barycenter_sinkhorn(A, M, reg, weights=weights,
+                                   numItermax=numItermax, stopThr=stopThr,
+                                   verbose=verbose, log=log, **kwargs)
+
+
+def barycenter_sinkhorn(A, M, reg, weights=None, numItermax=1000,
+                        stopThr=1e-4, warmstart=None, verbose=False,
+                        log=False, **kwargs):
+    """Compute the entropic regularized wasserstein barycenter of distributions A
+
+     The function solves the following optimization problem:
+
+    .. math::
+       \mathbf{a} = arg\min_\mathbf{a} \sum_i W_{reg}(\mathbf{a},\mathbf{a}_i)
+
+    where :
+
+    - :math:`W_{reg}(\cdot,\cdot)` is the entropic regularized Wasserstein distance (see ot.bregman.sinkhorn)
+    - :math:`\mathbf{a}_i` are training distributions in the columns of matrix :math:`\mathbf{A}`
+    - reg and :math:`\mathbf{M}` are respectively the regularization term and the cost matrix for OT
+
+    The algorithm used for solving the problem is the Sinkhorn-Knopp matrix scaling algorithm as proposed in [3]_
+
+    Only the bins with mass in one of the distributions are kept on their
+    side of the OT matrices, so that the kernel is (d,s) for a support of
+    size s and sparse histograms are solved faster.
+
+    A 3D array A (ngroups,d,n) can be given to compute ngroups barycenters
+    at once with the same kernel. The iterations of all the groups are then
+    batched matrix products, each group is checked for convergence
+    separately and is removed from the batch once converged.
+
+    Parameters
+    ----------
+    A : np.ndarray (d,n) or np.ndarray (ngroups,d,n)
+        n training distributions of size d (for each group)
+    M : np.ndarray (d,d)
+        loss matrix   for OT
+    reg : float
+        Regularization term >0
+    weights : np.ndarray (n,) or np.ndarray (ngroups,n), optional
+        Weights of the training distributions (uniform by default, shared by
+        all the groups if 1D)
+    numItermax : int, optional
+        Max number of iterations
+    stopThr : float, optional
+        Stop threshol on error (>0)
+    warmstart : tuple of arrays, optional
+        if given then starting values (alpha, beta) of shape (d,n) (or
+        (ngroups,d,n)) for the dual potentials of the n OT problems between
+        the barycenter and the training distributions, typically the
+        log['warmstart'] of a previous call on similar distributions. The
+        scalings are initialized to :math:`u=\exp(\\alpha/reg)`.
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+
+
+    Returns
+    -------
+    a : (d,) ndarray or (ngroups,d) ndarray
+        Wasserstein barycenter (of each group)
+    log : dict
+        log dictionary return only if log==True in parameters
+
+
+    References
+    ----------
+
+    .. [3] Benamou, J. D., Carlier, G., Cuturi, M., Nenna, L., & Peyré, G. (2015). Iterative Bregman projections for regularized transportation problems. SIAM Journal on Scientific Computing, 37(2), A1111-A1138.
+
+
+
+    """
+
+    A = np.asarray(A, dtype=np.float64)
+    batch = A.ndim == 3
+    if not batch:
+        A = A[None]
+    ngroups, d, n = A.shape
+
+    if weights is None:
+        weights = np.ones(n) / n
+    else:
+        weights = np.asarray(weights, dtype=np.float64)
+        assert(weights.shape[-1] == n)
+    weights = np.broadcast_to(weights, (ngroups, n))
+
+    if log:
+        log = {'err': []}
+
+    # M = M/np.median(M) # suggested by G. Peyre
+    M = np.asarray(M, dtype=np.float64)
+
+    # the bins without mass in all the distributions are removed on their
+    # side of the OT matrices
+    supp = np.any(A > 0, axis=(0, 2))
+    if np.all(supp):
+        Kin = Kout = np.exp(-M / reg)
+    else:
+        Kin = np.exp(-M[supp, :] / reg)
+        Kout = np.exp(-M[:, supp] / reg)
+        A = A[:, supp, :]
+
+    bary = np.zeros((ngroups, d))
+    niter = np.zeros(ngroups, dtype=int)
+    err = np.ones(ngroups)
+
+    def geometric_bars(w, UKv):
+        return np.exp(np.sum(np.log(UKv) * w[:, None, :], 2))
+
+    if warmstart is None:
+        UKv = np.matmul(Kout, A / np.sum(Kout, axis=0)[:, None])
+        u = np.exp(np.mean(np.log(UKv), 2))[:, :, None] / UKv
+    else:
+        u = np.exp(np.asarray(warmstart[0], dtype=np.float64) / reg)
+        u = u * np.ones((ngroups, d, n))
+    uall = u.copy()
+
+    # the iterations are computed only on the groups in idx
+    idx = np.arange(ngroups)
+    Ai, wi = A, weights
+
+    cpt = 0
+    while idx.size and cpt < numItermax:
+        cpt = cpt + 1
+        UKv = u * np.matmul(Kout, Ai / np.matmul(Kin, u))
+        u = u * geometric_bars(wi, UKv)[:, :, None] / UKv
+
+        if cpt % 10 == 1:
+            err[idx] = np.sum(np.std(UKv, axis=2), 1)
+
+            # log and verbose print
+            if log:
+                log['err'].append(err.copy() if batch else err[0])
+
+            if verbose:
+                if cpt % 200 == 0:
+                    print(
+                        '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
+                print('{:5d}|{:8e}|'.format(cpt, np.max(err)))
+
+            # store and remove the converged groups
+            bary[idx], niter[idx] = geometric_bars(wi, UKv), cpt
+            uall[idx] = u
+            keep = err[idx] > stopThr
+            if not np.all(keep):
+                idx = idx[keep]
+                Ai, wi = Ai[keep], wi[keep]
+                u, UKv = u[keep], UKv[keep]
+
+    if idx.size:
+        bary[idx], niter[idx] = geometric_bars(wi, UKv), cpt
+        uall[idx] = u
+
+    if not batch:
+        bary, niter, uall, A = bary[0], niter[0], uall[0], A[0]
+
+    if log:
+        log['niter'] = niter
+        v = np.zeros(uall.shape)
+        v[..., supp, :] = A / np.maximum(np.matmul(Kin, uall), 1e-300)
+        log['warmstart'] = (reg * np.log(np.maximum(uall, 1e-300)),
+                            reg * np.log(np.maximum(v, 1e-300)))
+        return bary, log
+    else:
+        return bary
+
+
+def barycenter_stabilized(A, M, reg, weights=None, numItermax=1000,
+                          tau=1e3, epsilon0=None, stopThr=1e-4,
+                          warmstart=None, verbose=False, log=False, **kwargs):
+    """Compute the entropic regularized wasserstein barycenter of distributions A with log stabilization
+
+     The function solves the following optimization problem:
+
+    .. math::
+       \mathbf{a} = arg\min_\mathbf{a} \sum_i W_{reg}(\mathbf{a},\mathbf{a}_i)
+
+    where :
+
+    - :math:`W_{reg}(\cdot,\cdot)` is the entropic regularized Wasserstein distance (see ot.bregman.sinkhorn)
+    - :math:`\mathbf{a}_i` are training distributions in the columns of matrix :math:`\mathbf{A}`
+    - reg and :math:`\mathbf{M}` are respectively the regularization term and the cost matrix for OT
+
+    The algorithm used for solving the problem is the iterative Bregman
+    projections of [3]_ on the OT matrices
+    :math:`\gamma_i=diag(u_i)K_idiag(v_i)` with the log stabilization of
+    [9]_: the scalings larger than tau are absorbed in the dual potentials
+    of each distribution, stored in its kernel
+    :math:`K_i=\exp((\\alpha_i+\\beta_i^T-M)/reg)`, so that the barycenter
+    can be computed for small reg. The n kernels (n,d,s) are stored in
+    memory, where s is the number of bins with mass in one of the
+    distributions, and the iterations are batched matrix products.
+
+    When epsilon0 is given, the regularization term is divided by 2 every 10
+    iterations from epsilon0 to reg (epsilon scaling as in
+    ot.bregman.sinkhorn_epsilon_scaling), which reduces the number of
+    iterations for small reg.
+
+    Parameters
+    ----------
+    A : np.ndarray (d,n)
+        n training distributions of size d
+    M : np.ndarray (d,d)
+        loss matrix   for OT
+    reg : float
+        Regularization term >0
+    weights : np.ndarray (n,), optional
+        Weights of the training distributions (uniform by default)
+    numItermax : int, optional
+        Max number of iterations
+    tau : float
+        thershold for max value in u or v for log scaling
+    epsilon0 : float, optional
+        if given, first regularization term of the epsilon scaling
+    stopThr : float, optional
+        Stop threshol on error (>0)
+    warmstart : tuple of arrays, optional
+        if given then starting values (alpha, beta) of shape (d,n) for the
+        dual potentials of the n OT problems, typically the log['warmstart']
+        of a previous call on similar distributions
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+
+
+    Returns
+    -------
+    a : (d,) ndarray
+        Wasserstein barycenter
+    log : dict
+        log dictionary return only if log==True in parameters
+
+
+    References
+    ----------
+
+    .. [3] Benamou, J. D., Carlier, G., Cuturi, M., Nenna, L., & Peyré, G. (2015). Iterative Bregman projections for regularized transportation problems. SIAM Journal on Scientific Computing, 37(2), A1111-A1138.
+
+    .. [9] Schmitzer, B. (2016). Stabilized Sparse Scaling Algorithms for Entropy Regularized Transport Problems. arXiv preprint arXiv:1610.06519.
+
+
+    See Also
+    --------
+    ot.bregman.barycenter : Wasserstein barycenter
+    ot.bregman.sinkhorn_stabilized : Stabilized sinkhorn [9][10]
+
+    """
+
+    A = np.asarray(A, dtype=np.float64)
+    M = np.asarray(M, dtype=np.float64)
 
-        if cpt % (print_period) == 0:  # spsion nearly converged
-            # we can speed up the process by checking for the error only all
-            # the 10th iterations
-            transp = G
-            err = np.linalg.norm(
-                (np.sum(transp, axis=0) - b))**2 + np.linalg.norm((np.sum(transp, axis=1) - a))**2
+    if weights is None:
+        weights = np.ones(A.shape[1]) / A.shape[1]
+    else:
+        assert(len(weights) == A.shape[1])
+
+    if log:
+        log = {'err': []}
+
+    d, n = A.shape
+
+    # the bins without mass in all the distributions are removed on their
+    # side of the OT matrices
+    supp = np.any(A > 0, axis=1)
+    A, Ms = A[supp], M[:, supp]
+    s = A.shape[0]
+
+    # gamma_i = diag(u_i) K_i diag(v_i) with
+    # K_i = exp((alpha_i + beta_i^T - M) / reg)
+    if warmstart is None:
+        alpha, beta = np.zeros((d, n)), np.zeros((s, n))
+    else:
+        alpha = np.asarray(warmstart[0], dtype=np.float64) * np.ones((d, n))
+        beta = (np.asarray(warmstart[1], dtype=np.float64) *
+                np.ones((d, n)))[supp]
+    u, v = np.ones((d, n)), np.ones((s, n))
+
+    def get_K(alpha, beta):
+        """log space computation of the (n,d,s) kernels"""
+        return np.exp(-(Ms[None, :, :] - alpha.T[:, :, None] -
+                        beta.T[:, None, :]) / regi)
+
+    def dot(K, v):
+        """products K_i v_i for all distributions"""
+        return np.matmul(K, v.T[:, :, None])[:, :, 0].T
+
+    regi = reg if epsilon0 is None else max(epsilon0, reg)
+
+    K = get_K(alpha, beta)
+    Kt = K.transpose((0, 2, 1))
+    UKv = u * dot(K, v)
+
+    cpt = 0
+    err = 1
+    while ((err > stopThr or regi > reg) and cpt < numItermax):
+        cpt = cpt + 1
+
+        if regi > reg and cpt % 10 == 0:
+            # absorb the scalings and decrease the regularization
+            alpha = alpha + regi * np.log(np.maximum(u, 1e-300))
+            beta = beta + regi * np.log(np.maximum(v, 1e-300))
+            u, v = np.ones((d, n)), np.ones((s, n))
+            regi = max(regi / 2, reg)
+            K = get_K(alpha, beta)
+            Kt = K.transpose((0, 2, 1))
+
+        uprev, vprev = u, v
+
+        # projection on the training distributions
+        v = A / np.maximum(dot(Kt, u), 1e-300)
+
+        # projection on the common marginal (the barycenter)
+        Kv = dot(K, v)
+        UKv = u * Kv
+        bary = geometricBar(weights, UKv)
+        u = bary.reshape((-1, 1)) / np.maximum(Kv, 1e-300)
+
+        if not (np.all(np.isfinite(u)) and np.all(np.isfinite(v))):
+            # we have reached the machine precision
+            # come back to previous solution and quit loop
+            print('Warning: numerical errors at iteration', cpt)
+            u, v = uprev, vprev
+            UKv = u * dot(K, v)
+            break
+
+        # remove numerical problems and store them in K
+        if np.abs(u).max() > tau or np.abs(v).max() > tau:
+            alpha = alpha + regi * np.log(np.maximum(u, 1e-300))
+            beta = beta + regi * np.log(np.maximum(v, 1e-300))
+            u, v = np.ones((d, n)), np.ones((s, n))
+            K = get_K(alpha, beta)
+            Kt = K.transpose((0, 2, 1))
+
+        if cpt % 10 == 1:
+            err = np.sum(np.std(UKv, axis=1))
+
+            # log and verbose print
             if log:
                 log['err'].append(err)
 
             if verbose:
-                if cpt % (print_period * 10) == 0:
+                if cpt % 200 == 0:
                     print(
                         '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
                 print('{:5d}|{:8e}|'.format(cpt, err))
 
-        if err <= stopThr and cpt > numItermin:
-            loop = False
-
-        cpt = cpt + 1
-    # print('err=',err,' cpt=',cpt)
     if log:
-        log['alpha'] = alpha
-        log['beta'] = beta
+        log['niter'] = cpt
+        log['alpha'] = alpha + regi * np.log(np.maximum(u, 1e-300))
+        # no potential on the bins without mass
+        log['beta'] = np.full((d, n), -np.inf)
+        log['beta'][supp] = beta + regi * np.log(np.maximum(v, 1e-300))
         log['warmstart'] = (log['alpha'], log['beta'])
-        return G, log
+        return geometricBar(weights, UKv), log
     else:
-        return G
+        return geometricBar(weights, UKv)
 
 
-def geometricBar(weights, alldistribT):
-    """return the weighted geometric mean of distributions"""
-    assert(len(weights) == alldistribT.shape[1])
-    return np.exp(np.dot(np.log(alldistribT), weights.T))
+def grid_kernels(shape, reg):
+    """return the 1D gaussian kernels of a regular grid in [0,1]^d
 
+    The Gibbs kernel exp(-M/reg) of the squared Euclidean cost on the grid
+    is the tensor product of the returned kernels.
+    """
+    kernels = []
+    for n in shape:
+        t = np.linspace(0, 1, n)
+        kernels.append(np.exp(-(t.reshape((-1, 1)) - t.reshape((1, -1)))**2 / reg))
+    return kernels
 
-def geometricMean(alldistribT):
-    """return the  geometric mean of distributions"""
-    return np.exp(np.mean(np.log(alldistribT), axis=1))
 
+def convolve_grid(X, kernels):
+    """apply the separable kernel given by 1D kernels to the last axes of X"""
+    nd = len(kernels)
+    for i, Ki in enumerate(kernels):
+        axis = X.ndim - nd + i
+        X = np.moveaxis(np.tensordot(Ki, X, axes=([1], [axis])), 0, axis)
+    return X
 
-def projR(gamma, p):
-    """return the KL projection on the row constrints """
-    return np.multiply(gamma.T, p / np.maximum(np.sum(gamma, axis=1), 1e-10)).T
 
+def convolutional_sinkhorn2(a, b, reg, numItermax=1000, stopThr=1e-9,
+                            stabThr=1e-30, warmstart=None, verbose=False,
+                            log=False):
+    """
+    Solve the entropic regularization OT problem between histograms on a regular grid and return the loss
 
-def projC(gamma, q):
-    """return the KL projection on the column constrints """
-    return np.multiply(gamma, q / np.maximum(np.sum(gamma, axis=0), 1e-10))
+    The function solves the following optimization problem:
 
+    .. math::
+        W = \min_\gamma <\gamma,M>_F + reg\cdot\Omega(\gamma)
 
-def barycenter(A, M, reg, weights=None, numItermax=1000,
-               stopThr=1e-4, verbose=False, log=False):
-    """Compute the entropic regularized wasserstein barycenter of distributions A
+        s.t. \gamma 1 = a
+
+             \gamma^T 1= b
+
+             \gamma\geq 0
+    where :
+
+    - M is the squared Euclidean cost between the points of a regular grid
+      in :math:`[0,1]^d` (d=a.ndim)
+    - :math:`\Omega` is the entropic regularization term :math:`\Omega(\gamma)=\sum_{i,j} \gamma_{i,j}\log(\gamma_{i,j})`
+    - a and b are histograms on the grid (sum to 1)
+
+    The algorithm is the Sinkhorn-Knopp algorithm [2]_ where the Gibbs kernel
+    is applied as separable 1D convolutions along each axis of the grid [17]_.
+    Neither M nor the kernel are built, so that the memory is linear in the
+    number of bins N and the time per iteration is O(N * side).
+
+
+    Parameters
+    ----------
+    a : np.ndarray (n1,...,nd)
+        source histogram on the grid
+    b : np.ndarray (n1,...,nd)
+        target histogram on the grid
+    reg : float
+        Regularization term >0
+    numItermax : int, optional
+        Max number of iterations
+    stopThr : float, optional
+        Stop threshol on error (>0)
+    stabThr : float, optional
+        Stabilization threshold to avoid numerical precision issue
+    warmstart : tuple of np.ndarray (n1,...,nd), optional
+        if given then starting values (alpha, beta) for the dual potentials,
+        the scalings are initialized to :math:`u=\exp(\\alpha/reg)` and
+        :math:`v=\exp(\\beta/reg)` (see log['warmstart'])
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+
+
+    Returns
+    -------
+    W : float
+        Optimal transportation loss for the given parameters
+    log : dict
+        log dictionary return only if log==True in parameters, the scalings
+        u and v of the OT matrix are given on the grid
+
+
+    References
+    ----------
+
+    .. [2] M. Cuturi, Sinkhorn Distances : Lightspeed Computation of Optimal Transport, Advances in Neural Information Processing Systems (NIPS) 26, 2013
+
+    .. [17] Solomon, J., De Goes, F., Peyré, G., Cuturi, M., Butscher, A., Nguyen, A. & Guibas, L. (2015). Convolutional wasserstein distances: Efficient optimal transportation on geometric domains. ACM Transactions on Graphics (TOG), 34(4), 66.
+
+
+    See Also
+    --------
+    ot.bregman.sinkhorn2 : Entropic regularized OT loss
+    ot.bregman.convolutional_barycenter : Barycenter on a grid [17]
+
+    """
+
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    kernels = grid_kernels(a.shape, reg)
+
+    if log:
+        log = {'err': []}
+
+    if warmstart is None:
+        u = np.ones(a.shape)
+        v = np.ones(b.shape)
+    else:
+        u = np.exp(np.asarray(warmstart[0], dtype=np.float64) / reg)
+        v = np.exp(np.asarray(warmstart[1], dtype=np.float64) / reg)
+
+    cpt = 0
+    err = 1
+    while (err > stopThr and cpt < numItermax):
+        v = b / np.maximum(convolve_grid(u, kernels), stabThr)
+        u = a / np.maximum(convolve_grid(v, kernels), stabThr)
+
+        if cpt % 10 == 0:
+            err = np.sum((v * convolve_grid(u, kernels) - b)**2)
+            if log:
+                log['err'].append(err)
+
+            if verbose:
+                if cpt % 200 == 0:
+                    print(
+                        '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
+                print('{:5d}|{:8e}|'.format(cpt, err))
+        cpt = cpt + 1
+
+    # the kernel times the cost is a sum of separable kernels
+    loss = 0
+    for i, n in enumerate(a.shape):
+        t = np.linspace(0, 1, n)
+        kernels_M = list(kernels)
+        kernels_M[i] = kernels[i] * (t.reshape((-1, 1)) - t.reshape((1, -1)))**2
+        loss += np.sum(u * convolve_grid(v, kernels_M))
+
+    if log:
+        log['u'] = u
+        log['v'] = v
+        log['warmstart'] = (reg * np.log(u), reg * np.log(v))
+        log['niter'] = cpt
+        return loss, log
+    else:
+        return loss
+
+
+def convolutional_barycenter(A, reg, weights=None, numItermax=10000,
+                             stopThr=1e-9, stabThr=1e-30, warmstart=None,
+                             verbose=False, log=False):
+    """Compute the entropic regularized wasserstein barycenter of histograms on a regular grid
 
      The function solves the following optimization problem:
 
@@ -831,23 +3845,36 @@ def barycenter(A, M, reg, weights=None, numItermax=1000,
     where :
 
     - :math:`W_{reg}(\cdot,\cdot)` is the entropic regularized Wasserstein distance (see ot.bregman.sinkhorn)
-    - :math:`\mathbf{a}_i` are training distributions in the columns of matrix :math:`\mathbf{A}`
-    - reg and :math:`\mathbf{M}` are respectively the regularization term and the cost matrix for OT
+      for the squared Euclidean cost between the points of a regular grid in :math:`[0,1]^d`
+    - :math:`\mathbf{a}_i` are training histograms given on the grid in A[i]
+    - reg is the regularization term for OT
 
-    The algorithm used for solving the problem is the Sinkhorn-Knopp matrix scaling algorithm as proposed in [3]_
+    The algorithm used for solving the problem is the Sinkhorn-Knopp matrix
+    scaling algorithm as proposed in [3]_, with the Gibbs kernel applied as
+    separable 1D convolutions along each axis of the grid as proposed in
+    [17]_. The memory is linear in the number of bins N and the time per
+    iteration is O(N * side).
 
     Parameters
     ----------
-    A : np.ndarray (d,n)
-        n training distributions of size d
-    M : np.ndarray (d,d)
-        loss matrix   for OT
+    A : np.ndarray (n,n1,...,nd)
+        n training histograms on a grid of size (n1,...,nd)
     reg : float
         Regularization term >0
+    weights : np.ndarray (n,)
+        Weights of each histogram a_i on the simplex (barycentric coodinates)
     numItermax : int, optional
         Max number of iterations
     stopThr : float, optional
         Stop threshol on error (>0)
+    stabThr : float, optional
+        Stabilization threshold to avoid numerical precision issue
+    warmstart : tuple of arrays, optional
+        if given then starting values (alpha, beta) of shape (n,n1,...,nd)
+        for the dual potentials of the n OT problems on the side of the
+        barycenter and of the training histograms, typically the
+        log['warmstart'] of a previous call on similar histograms. The
+        scalings are initialized to :math:`v=\exp(\\alpha/reg)`.
     verbose : bool, optional
         Print information along iterations
     log : bool, optional
@@ -856,7 +3883,7 @@ def barycenter(A, M, reg, weights=None, numItermax=1000,
 
     Returns
     -------
-    a : (d,) ndarray
+    a : (n1,...,nd) ndarray
         Wasserstein barycenter
     log : dict
         log dictionary return only if log==True in parameters
@@ -867,50 +3894,67 @@ def barycenter(A, M, reg, weights=None, numItermax=1000,
 
     .. [3] Benamou, J. D., Carlier, G., Cuturi, M., Nenna, L., & Peyré, G. (2015). Iterative Bregman projections for regularized transportation problems. SIAM Journal on Scientific Computing, 37(2), A1111-A1138.
 
+    .. [17] Solomon, J., De Goes, F., Peyré, G., Cuturi, M., Butscher, A., Nguyen, A. & Guibas, L. (2015). Convolutional wasserstein distances: Efficient optimal transportation on geometric domains. ACM Transactions on Graphics (TOG), 34(4), 66.
+
 
+    See Also
+    --------
+    ot.bregman.barycenter : Barycenter with a given cost matrix [3]
 
     """
 
+    A = np.asarray(A, dtype=np.float64)
+
     if weights is None:
-        weights = np.ones(A.shape[1]) / A.shape[1]
+        weights = np.ones(A.shape[0]) / A.shape[0]
     else:
-        assert(len(weights) == A.shape[1])
+        assert(len(weights) == A.shape[0])
 
     if log:
         log = {'err': []}
 
-    # M = M/np.median(M) # suggested by G. Peyre
-    K = np.exp(-M / reg)
+    kernels = grid_kernels(A.shape[1:], reg)
+
+    U = np.ones(A.shape)
+    if warmstart is None:
+        V = np.ones(A.shape)
+    else:
+        V = np.exp(np.asarray(warmstart[0], dtype=np.float64) / reg)
+        V = V * np.ones(A.shape)
 
     cpt = 0
     err = 1
-
-    UKv = np.dot(K, np.divide(A.T, np.sum(K, axis=0)).T)
-    u = (geometricMean(UKv) / UKv.T).T
-
     while (err > stopThr and cpt < numItermax):
         cpt = cpt + 1
-        UKv = u * np.dot(K, np.divide(A, np.dot(K, u)))
-        u = (u.T * geometricBar(weights, UKv)).T / UKv
+
+        U = A / np.maximum(convolve_grid(V, kernels), stabThr)
+        KU = convolve_grid(U, kernels)
+        # marginals of the OT matrices on the barycenter side
+        UKV = V * KU
+        bar = np.exp(np.tensordot(
+            weights, np.log(np.maximum(UKV, stabThr)), axes=1))
+        V = bar / np.maximum(KU, stabThr)
 
         if cpt % 10 == 1:
-            err = np.sum(np.std(UKv, axis=1))
+            err = np.sum(np.std(UKV, axis=0))
 
             # log and verbose print
             if log:
                 log['err'].append(err)
 
             if verbose:
-                if cpt % 200 == 0:
+                if cpt % 200 == 1:
                     print(
                         '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
                 print('{:5d}|{:8e}|'.format(cpt, err))
 
     if log:
         log['niter'] = cpt
-        return geometricBar(weights, UKv), log
+        log['warmstart'] = (reg * np.log(np.maximum(V, 1e-300)),
+                            reg * np.log(np.maximum(U, 1e-300)))
+        return bar, log
     else:
-        return geometricBar(weights, UKv)
+        return bar
 
 
 def unmix(a, D, M, M0, h0, reg, reg0, alpha, numItermax=1000,
@@ -1000,7 +4044,7 @@ def unmix(a, D, M, M0, h0, reg, reg0, alpha, numItermax=1000,
         # geometric interpolation
         delta = np.exp(alpha * np.log(other) + (1 - alpha) * np.log(inv_new))
         K = projR(K, delta)
-        K0 = np.dot(np.diag(np.dot(D.T, delta / inv_new)), K0)
+        K0 = np.dot(D.T, delta / inv_new).reshape((-1, 1)) * K0
 
         err = np.linalg.norm(np.sum(K0, axis=1) - old)
         old = new
@@ -1019,3 +4063,158 @@ def unmix(a, D, M, M0, h0, reg, reg0, alpha, numItermax=1000,
         return np.sum(K0, axis=1), log
     else:
         return np.sum(K0, axis=1)
+
+
+def unmix_batch(A, D, M, M0, h0, reg, reg0, alpha, numItermax=1000,
+                stopThr=1e-3, memory=2**28, n_threads=None, verbose=False,
+                log=False):
+    """
+    Compute the unmixing of several observations with a given dictionary using Wasserstein distance
+
+    The function solve the following optimization problem for each column
+    :math:`\mathbf{a}` of A:
+
+    .. math::
+       \mathbf{h} = arg\min_\mathbf{h}  (1- \\alpha) W_{M,reg}(\mathbf{a},\mathbf{Dh})+\\alpha W_{M0,reg0}(\mathbf{h}_0,\mathbf{h})
+
+
+    where :
+
+    - :math:`W_{M,reg}(\cdot,\cdot)` is the entropic regularized Wasserstein distance with M loss matrix (see ot.bregman.sinkhorn)
+    - :math:`\mathbf{a}` is an observed distribution,  :math:`\mathbf{h}_0` is aprior on unmixing
+    - reg and :math:`\mathbf{M}` are respectively the regularization term and the cost matrix for OT data fitting
+    - reg0 and :math:`\mathbf{M0}` are respectively the regularization term and the cost matrix for regularization
+    - :math:`\\alpha`weight data fitting and regularization
+
+    The optimization problem is solved with the algorithm described in [4]
+    as in ot.bregman.unmix, but the Bregman projections are expressed on the
+    scalings of the rows and columns of the kernels, so that the iterations
+    for all the observations are matrix products with the (d,d) and (n,n)
+    kernels and only O((d+n) n_obs) memory is used. The observations are
+    processed by chunks that fit in memory with a pool of n_threads threads.
+
+
+    Parameters
+    ----------
+    A : np.ndarray (d,n_obs)
+        observed distributions
+    D : np.ndarray (d,n)
+        dictionary matrix
+    M : np.ndarray (d,d)
+        loss matrix
+    M0 : np.ndarray (n,n)
+        loss matrix
+    h0 : np.ndarray (n,) or np.ndarray (n,n_obs)
+        prior on h (shared by all the observations if 1D)
+    reg : float
+        Regularization term >0 (Wasserstein data fitting)
+    reg0 : float
+        Regularization term >0 (Wasserstein reg with h0)
+    alpha : float
+        How much should we trust the prior ([0,1])
+    numItermax : int, optional
+        Max number of iterations
+    stopThr : float, optional
+        Stop threshol on error (>0)
+    memory : int, optional
+        Memory budget in bytes for each chunk of observations
+    n_threads : int, optional
+        Number of threads (default is the number of cpu)
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+
+
+    Returns
+    -------
+    H : (n,n_obs) ndarray
+        Unmixing of the observations
+    log : dict
+        log dictionary return only if log==True in parameters
+
+    References
+    ----------
+
+    .. [4] S. Nakhostin, N. Courty, R. Flamary, D. Tuia, T. Corpetti, Supervised planetary unmixing with optimal transport, Whorkshop on Hyperspectral Image and Signal Processing : Evolution in Remote Sensing (WHISPERS), 2016.
+
+    See Also
+    --------
+    ot.bregman.unmix : Unmixing of one observation
+
+    """
+
+    A = np.asarray(A, dtype=np.float64)
+    D = np.asarray(D, dtype=np.float64)
+    h0 = np.asarray(h0, dtype=np.float64)
+
+    d, n_obs = A.shape
+    n = D.shape[1]
+
+    if n_threads is None:
+        n_threads = multiprocessing.cpu_count()
+
+    # about 16 (d,) or (n,) vectors per observation in memory
+    ncols = int(max(1, memory // (128 * (d + n))))
+    chunks = [slice(i, min(i + ncols, n_obs)) for i in range(0, n_obs, ncols)]
+
+    K = np.exp(-M / reg)
+    K0 = np.exp(-M0 / reg0)
+
+    def solve(idx):
+        # the kernels are diag(r) K diag(c) and diag(r0) K0 diag(c0)
+        a = A[:, idx]
+        nc = a.shape[1]
+        h0i = h0[:, idx] if h0.ndim > 1 else h0.reshape((-1, 1))
+        r, c = np.ones((d, nc)), np.ones((d, nc))
+        r0, c0 = np.ones((n, nc)), np.ones((n, nc))
+        old = np.ones((n, nc)) * h0i
+
+        errs = []
+        err = 1
+        cpt = 0
+        while (err > stopThr and cpt < numItermax):
+            # projC on the observations and the prior
+            c *= a / np.maximum(c * np.dot(K.T, r), 1e-10)
+            c0 *= h0i / np.maximum(c0 * np.dot(K0.T, r0), 1e-10)
+            new = r0 * np.dot(K0, c0)
+            # we recombine the current selection from dictionnary
+            inv_new = np.dot(D, new)
+            Kc = np.dot(K, c)
+            other = r * Kc
+            # geometric interpolation
+            delta = np.exp(alpha * np.log(other) +
+                           (1 - alpha) * np.log(inv_new))
+            # projR on the interpolation
+            r *= delta / np.maximum(other, 1e-10)
+            r0 *= np.dot(D.T, delta / inv_new)
+
+            err = np.max(np.linalg.norm(r0 * np.dot(K0, c0) - old, axis=0))
+            old = new
+            errs.append(err)
+            cpt = cpt + 1
+
+        if verbose:
+            print('{:5d}|{:8e}|'.format(cpt, err))
+
+        return r0 * np.dot(K0, c0), errs, cpt
+
+    if verbose:
+        print('{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
+
+    pool = ThreadPool(n_threads)
+    try:
+        res = pool.map(solve, chunks)
+    finally:
+        pool.close()
+        pool.join()
+
+    H = np.concatenate([r[0] for r in res], axis=1)
+
+    if log:
+        log = {'err': [r[1] for r in res],
+               'niter': np.concatenate([[r[2]] * (idx.stop - idx.start)
+                                        for r, idx in zip(res, chunks)])}
+        return H, log
+    else:
+        return H
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Cython kernels for the fused Sinkhorn iterations
+"""
+
+# License: MIT License
+
+import numpy as np
+cimport numpy as np
+
+cimport cython
+
+from libc.math cimport exp, isfinite
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def gibbs_kernel(double[:, ::1] M, double[:, ::1] K, double reg,
+                 int start, int end):
+    """
+    Compute in place the rows start:end of the Gibbs kernel K=exp(-M/reg)
+
+    K can be M itself to overwrite the cost matrix.
+    """
+    cdef int nt = M.shape[1]
+    cdef int i, j
+
+    with nogil:
+        for i in range(start, end):
+            for j in range(nt):
+                K[i, j] = exp(-M[i, j] / reg)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def sinkhorn_pass(double[:, ::1] K, double[::1] a, double[::1] u,
+                  double[::1] v, double[::1] KtransposeU, int start,
+                  int end):
+    """
+    Fused update of the rows start:end of the Sinkhorn iterations
+
+    For each row i the scaling u[i]=a[i]/(Kv)[i] is updated and the row
+    contribution K[i,:]*u[i] is added to KtransposeU, so that K is read only
+    once. Returns 1 if a non finite or zero value was found, 0 otherwise.
+    """
+    cdef int nt = K.shape[1]
+    cdef int i, j
+    cdef int bad = 0
+    cdef double s, ui
+
+    with nogil:
+        for i in range(start, end):
+            s = 0
+            for j in range(nt):
+                s += K[i, j] * v[j]
+            ui = a[i] / s
+            if s == 0 or not isfinite(ui):
+                bad = 1
+                break
+            u[i] = ui
+            for j in range(nt):
+                KtransposeU[j] += K[i, j] * ui
+
+    return bad
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def sinkhorn_loss(double[:, ::1] K, double[:, ::1] M, double[::1] u,
+                  double[::1] v, int start, int end):
+    """
+    Return the partial loss sum(u[i]*K[i,j]*v[j]*M[i,j]) on the rows start:end
+    """
+    cdef int nt = K.shape[1]
+    cdef int i, j
+    cdef double s, loss = 0
+
+    with nogil:
+        for i in range(start, end):
+            s = 0
+            for j in range(nt):
+                s += K[i, j] * M[i, j] * v[j]
+            loss += u[i] * s
+
+    return loss
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def scale_kernel(double[:, ::1] K, double[::1] u, double[::1] v,
+                 int start, int end):
+    """
+    Compute in place the rows start:end of the OT matrix u[i]*K[i,j]*v[j]
+    """
+    cdef int nt = K.shape[1]
+    cdef int i, j
+
+    with nogil:
+        for i in range(start, end):
+            for j in range(nt):
+                K[i, j] = u[i] * K[i, j] * v[j]
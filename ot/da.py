@@ -116,10 +116,15 @@ def sinkhorn_lpl1_mm(a, labels_a, b, M, reg, eta=0.1, numItermax=10,
 
     W = np.zeros(M.shape)
 
+    # dual potentials of the previous Sinkhorn problem
+    warmstart = None
+
     for cpt in range(numItermax):
         Mreg = M + eta * W
-        transp = sinkhorn(a, b, Mreg, reg, numItermax=numInnerItermax,
-                          stopThr=stopInnerThr)
+        transp, logt = sinkhorn(a, b, Mreg, reg, numItermax=numInnerItermax,
+                                stopThr=stopInnerThr, warmstart=warmstart,
+                                log=True)
+        warmstart = logt['warmstart']
         # the transport has been computed. Check if classes are really
         # separated
         W = np.ones(M.shape)
@@ -13,7 +13,8 @@ import numpy as np
 
 # import compiled emd
 from .emd_wrap import emd_c, check_result
-from ..utils import parmap
+from ..utils import parmap, dist
+from ..bregman import sinkhorn
 
 
 def emd(a, b, M, numItermax=100000, log=False):
@@ -108,7 +109,7 @@ def emd(a, b, M, numItermax=100000, log=False):
 
 
 def emd2(a, b, M, processes=multiprocessing.cpu_count(),
-         numItermax=100000, log=False, return_matrix=False):
+         numItermax=100000, log=False, return_matrix=False, grad=False):
     """Solves the Earth Movers distance problem and returns the loss
 
     .. math::
@@ -140,14 +141,20 @@ def emd2(a, b, M, processes=multiprocessing.cpu_count(),
         variables. Otherwise returns only the optimal transportation cost.
     return_matrix: boolean, optional (default=False)
         If True, returns the optimal transportation matrix in the log.
+    grad: boolean, optional (default=False)
+        If True, returns in the log the gradients of the loss with respect to
+        a, b and M (keys 'grad_a', 'grad_b' and 'grad_M'). They are given by
+        the solution of the problem: the dual potentials u and v centered
+        (gradients on the simplex) and the OT matrix, so no additional
+        computation is needed.
 
     Returns
     -------
     gamma: (ns x nt) ndarray
         Optimal transportation matrix for the given parameters
     log: dict
-        If input log is true, a dictionary containing the cost and dual
-        variables and exit status
+        If input log (or return_matrix or grad) is true, a dictionary
+        containing the cost and dual variables and exit status
 
 
     Examples
@@ -187,13 +194,17 @@ def emd2(a, b, M, processes=multiprocessing.cpu_count(),
     if len(b) == 0:
         b = np.ones((M.shape[1],), dtype=np.float64) / M.shape[1]
 
-    if log or return_matrix:
+    if log or return_matrix or grad:
         def f(b):
             G, cost, u, v, resultCode = emd_c(a, b, M, numItermax)
             result_code_string = check_result(resultCode)
             log = {}
             if return_matrix:
                 log['G'] = G
+            if grad:
+                log['grad_a'] = u - np.mean(u)
+                log['grad_b'] = v - np.mean(v)
+                log['grad_M'] = G
             log['u'] = u
             log['v'] = v
             log['warning'] = result_code_string
@@ -211,3 +222,154 @@ def emd2(a, b, M, processes=multiprocessing.cpu_count(),
 
     res = parmap(f, [b[:, i] for i in range(nb)], processes)
     return res
+
+
+def free_support_barycenter(measures_locations, measures_weights, X_init,
+                            b=None, weights=None, numItermax=100,
+                            stopThr=1e-7, reg=None,
+                            processes=multiprocessing.cpu_count(),
+                            verbose=False, log=False):
+    """Solves the free support (locations of the barycenters are optimized, not the weights) Wasserstein barycenter problem
+
+    The function solves the following optimization problem:
+
+    .. math::
+        X = arg\min_X \sum_{i=1}^N w_i W_2^2(b, X, a_i, X_i)
+
+    where :
+
+    - :math:`w \in \mathbb{(0, 1)}^{N}` are the barycenter weights and sum to one
+    - the :math:`a_i \in \mathbb{R}^{k_i}` are the empirical measures weights and sum to one for each :math:`i`
+    - the :math:`X_i \in \mathbb{R}^{k_i, d}` are the empirical measures atoms locations
+    - :math:`b \in \mathbb{R}^{k}` is the desired weights vector of the barycenter
+    - :math:`X \in \mathbb{R}^{k, d}` are the locations of the barycenter
+
+    The algorithm alternates between the computation of the OT matrices
+    :math:`\gamma_i` from the current barycenter to each measure (with
+    ot.emd, or ot.sinkhorn if reg is given), computed in parallel across the
+    measures, and the update of the locations of the barycenter to the
+    barycentric projections :math:`X=\sum_i w_i diag(1/b)\gamma_i X_i` as
+    proposed in [24]_ (Algorithm 2). Only the (k,k_i) cost and OT matrices
+    are computed, so that no grid on the space is needed.
+
+    Parameters
+    ----------
+    measures_locations : list of (k_i,d) np.ndarray
+        The discrete support of a measure supported on k_i locations of a
+        d-dimensional space (k_i can be different for each element of the
+        list)
+    measures_weights : list of (k_i,) np.ndarray
+        Numpy arrays where each numpy array has k_i non-negatives values
+        summing to one representing the weights of each discrete input
+        measure (uniform weights if empty list)
+    X_init : (k,d) np.ndarray
+        Initialization of the support locations (on k atoms) of the barycenter
+    b : (k,) np.ndarray, optional
+        Initialization of the weights of the barycenter (uniform by default,
+        the weights are not optimized)
+    weights : (N,) np.ndarray, optional
+        Initialization of the coefficients of the barycenter (uniform by
+        default)
+    numItermax : int, optional
+        Max number of iterations
+    stopThr : float, optional
+        Stop threshol on the squared displacement of the locations (>0)
+    reg : float, optional
+        If given, regularization term of the entropic OT matrices computed
+        with ot.sinkhorn (ot.emd is used otherwise)
+    processes : int, optional
+        Number of processes used to compute the OT matrices (default is the
+        number of cpu)
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+
+    Returns
+    -------
+    X : (k,d) np.ndarray
+        Support locations (on k atoms) of the barycenter
+    log : dict
+        log dictionary return only if log==True in parameters
+
+    Examples
+    --------
+
+    >>> import ot
+    >>> Xs = [np.array([[0.], [1.]]), np.array([[2.], [3.]])]
+    >>> X_init = np.array([[0.], [1.]])
+    >>> X = ot.lp.free_support_barycenter(Xs, [[], []], X_init, processes=1)
+    >>> X.ravel().tolist()
+    [1.0, 2.0]
+
+    References
+    ----------
+
+    .. [24] Cuturi, Marco, and Arnaud Doucet. "Fast computation of Wasserstein barycenters." International Conference on Machine Learning. 2014.
+
+    See Also
+    --------
+    ot.bregman.barycenter : Wasserstein barycenter on a fixed support
+    ot.lp.emd : Unregularized OT
+
+    """
+
+    X = np.array(X_init, dtype=np.float64)
+    k = X.shape[0]
+
+    measures_locations = [np.asarray(Xi, dtype=np.float64)
+                          for Xi in measures_locations]
+    measures_weights = [np.ones(len(Xi)) / len(Xi) if len(ai) == 0 else
+                        np.asarray(ai, dtype=np.float64)
+                        for Xi, ai in zip(measures_locations, measures_weights)]
+
+    N = len(measures_locations)
+
+    if b is None:
+        b = np.ones((k,)) / k
+    if weights is None:
+        weights = np.ones((N,)) / N
+
+    if log:
+        log = {'err': []}
+
+    def f(i):
+        # barycentric projection of the measure i on the current locations
+        Xi, ai = measures_locations[i], measures_weights[i]
+        M_i = dist(X, Xi)
+        if reg is None:
+            T_i = emd(b, ai, M_i)
+        else:
+            T_i = sinkhorn(b, ai, M_i, reg)
+        return np.dot(T_i, Xi)
+
+    cpt = 0
+    err = stopThr + 1
+    while (err > stopThr and cpt < numItermax):
+
+        if processes > 1:
+            projections = parmap(f, range(N), processes)
+        else:
+            projections = [f(i) for i in range(N)]
+
+        X_new = sum(w_i * T_iXi for w_i, T_iXi in zip(weights, projections))
+        X_new /= b.reshape((-1, 1))
+
+        err = np.sum((X_new - X)**2)
+        X = X_new
+
+        if log:
+            log['err'].append(err)
+
+        if verbose:
+            if cpt % 200 == 0:
+                print(
+                    '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
+            print('{:5d}|{:8e}|'.format(cpt, err))
+        cpt = cpt + 1
+
+    if log:
+        log['niter'] = cpt
+        return X, log
+    else:
+        return X
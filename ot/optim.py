@@ -205,7 +205,8 @@ def cg(a, b, M, reg, f, df, G0=None, numItermax=200,
 
 
 def gcg(a, b, M, reg1, reg2, f, df, G0=None, numItermax=10,
-        numInnerItermax=200, stopThr=1e-9, verbose=False, log=False):
+        numInnerItermax=200, stopThr=1e-9, warmstart=True, verbose=False,
+        log=False):
     """
     Solve the general regularized OT problem with the generalized conditional gradient
 
@@ -249,6 +250,11 @@ def gcg(a, b, M, reg1, reg2, f, df, G0=None, numItermax=10,
         Max number of iterations of Sinkhorn
     stopThr : float, optional
         Stop threshol on error (>0)
+    warmstart : bool, optional
+        If True, the Sinkhorn problems are warm started from the dual
+        potentials of the previous iteration, and the iterations stop when the
+        Sinkhorn solution is not a descent direction (optimal up to the
+        precision of the warm started solutions)
     verbose : bool, optional
         Print information along iterations
     log : bool, optional
@@ -293,6 +299,9 @@ def gcg(a, b, M, reg1, reg2, f, df, G0=None, numItermax=10,
 
     it = 0
 
+    # dual potentials of the previous Sinkhorn problem
+    potentials = None
+
     if verbose:
         print('{:5s}|{:12s}|{:8s}'.format(
             'It.', 'Loss', 'Delta loss') + '\n' + '-' * 32)
@@ -306,14 +315,28 @@ def gcg(a, b, M, reg1, reg2, f, df, G0=None, numItermax=10,
         # problem linearization
         Mi = M + reg2 * df(G)
 
-        # solve linear program with Sinkhorn
+        # solve linear program with Sinkhorn warm started from the previous
+        # iteration since Mi changes little between iterations
         # Gc = sinkhorn_stabilized(a,b, Mi, reg1, numItermax = numInnerItermax)
-        Gc = sinkhorn(a, b, Mi, reg1, numItermax=numInnerItermax)
+        Gc, logc = sinkhorn(a, b, Mi, reg1, numItermax=numInnerItermax,
+                            warmstart=potentials, log=True)
 
         deltaG = Gc - G
 
         # line search
         dcost = Mi + reg1 * (1 + np.log(G))  # ??
+        if warmstart:
+            if potentials is not None and np.sum(deltaG * dcost) >= 0:
+                # the warm started solution is not precise enough to give a
+                # descent direction, solve the problem again from scratch
+                Gc, logc = sinkhorn(a, b, Mi, reg1, numItermax=numInnerItermax,
+                                    log=True)
+                deltaG = Gc - G
+            if np.sum(deltaG * dcost) >= 0:
+                # not a descent direction, G is optimal up to the precision
+                # of the Sinkhorn solutions
+                break
+            potentials = logc['warmstart']
         alpha, fc, f_val = line_search_armijo(cost, G, deltaG, dcost, f_val)
 
         G = G + alpha * deltaG
@@ -0,0 +1,640 @@
+# -*- coding: utf-8 -*-
+"""
+Regularized Unbalanced OT
+"""
+
+# License: MIT License
+
+import numpy as np
+
+
+def sinkhorn_unbalanced(a, b, M, reg, reg_m, method='sinkhorn', numItermax=1000,
+                        stopThr=1e-9, verbose=False, log=False, **kwargs):
+    u"""
+    Solve the entropic regularization unbalanced optimal transport problem and return the OT matrix
+
+    The function solves the following optimization problem:
+
+    .. math::
+        \gamma = arg\min_\gamma <\gamma,M>_F + reg\cdot\Omega(\gamma) + reg_m KL(\gamma 1, a) + reg_m KL(\gamma^T 1, b)
+
+        s.t.
+             \gamma\geq 0
+    where :
+
+    - M is the (ns,nt) metric cost matrix
+    - :math:`\Omega` is the entropic regularization term :math:`\Omega(\gamma)=\sum_{i,j} \gamma_{i,j}\log(\gamma_{i,j})`
+    - a and b are source and target weights (not necessarily with the same total mass)
+    - KL is the generalized Kullback-Leibler divergence :math:`KL(x, y)=\sum_i x_i\log(x_i/y_i) - x_i + y_i`
+
+    The algorithm used for solving the problem is the generalized
+    Sinkhorn-Knopp matrix scaling algorithm as proposed in [10]_
+
+
+    Parameters
+    ----------
+    a : np.ndarray (ns,)
+        samples weights in the source domain
+    b : np.ndarray (nt,) or np.ndarray (nt,nbb)
+        samples in the target domain, compute sinkhorn with multiple targets
+        and fixed M if b is a matrix (return OT loss + dual variables in log)
+    M : np.ndarray (ns,nt)
+        loss matrix
+    reg : float
+        Entropy regularization term >0
+    reg_m : float
+        Marginal relaxation term >0
+    method : str
+        method used for the solver either 'sinkhorn' or
+        'sinkhorn_stabilized', see those function for specific parameters
+    numItermax : int, optional
+        Max number of iterations
+    stopThr : float, optional
+        Stop threshol on error (>0)
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+
+
+    Returns
+    -------
+    gamma : (ns x nt) ndarray
+        Optimal transportation matrix for the given parameters
+    log : dict
+        log dictionary return only if log==True in parameters
+
+    Examples
+    --------
+
+    >>> import ot
+    >>> a=[.5,.5]
+    >>> b=[.5,.5]
+    >>> M=[[0.,1.],[1.,0.]]
+    >>> ot.sinkhorn_unbalanced(a,b,M,1,1)
+    array([[ 0.51122814,  0.18807032],
+           [ 0.18807032,  0.51122814]])
+
+
+    References
+    ----------
+
+    .. [10] Chizat, L., Peyré, G., Schmitzer, B., & Vialard, F. X. (2016). Scaling algorithms for unbalanced transport problems. arXiv preprint arXiv:1607.05816.
+
+
+    See Also
+    --------
+    ot.unbalanced.sinkhorn_knopp_unbalanced : Unbalanced Sinkhorn [10]
+    ot.unbalanced.sinkhorn_stabilized_unbalanced : Log stabilized unbalanced Sinkhorn [9][10]
+    ot.bregman.sinkhorn : Entropic regularized OT (balanced)
+
+    """
+
+    if method.lower() == 'sinkhorn':
+        def sink():
+            return sinkhorn_knopp_unbalanced(a, b, M, reg, reg_m,
+                                             numItermax=numItermax,
+                                             stopThr=stopThr, verbose=verbose,
+                                             log=log, **kwargs)
+    elif method.lower() == 'sinkhorn_stabilized':
+        def sink():
+            return sinkhorn_stabilized_unbalanced(a, b, M, reg, reg_m,
+                                                  numItermax=numItermax,
+                                                  stopThr=stopThr,
+                                                  verbose=verbose,
+                                                  log=log, **kwargs)
+    else:
+        print('Warning : unknown method using classic unbalanced Sinkhorn')
+
+        def sink():
+            return sinkhorn_knopp_unbalanced(a, b, M, reg, reg_m,
+                                             numItermax=numItermax,
+                                             stopThr=stopThr, verbose=verbose,
+                                             log=log, **kwargs)
+
+    return sink()
+
+
+def sinkhorn_unbalanced2(a, b, M, reg, reg_m, method='sinkhorn',
+                         numItermax=1000, stopThr=1e-9, verbose=False,
+                         log=False, **kwargs):
+    u"""
+    Solve the entropic regularization unbalanced optimal transport problem and return the loss
+
+    The function solves the following optimization problem:
+
+    .. math::
+        W = \min_\gamma <\gamma,M>_F + reg\cdot\Omega(\gamma) + reg_m KL(\gamma 1, a) + reg_m KL(\gamma^T 1, b)
+
+        s.t.
+             \gamma\geq 0
+    where :
+
+    - M is the (ns,nt) metric cost matrix
+    - :math:`\Omega` is the entropic regularization term :math:`\Omega(\gamma)=\sum_{i,j} \gamma_{i,j}\log(\gamma_{i,j})`
+    - a and b are source and target weights (not necessarily with the same total mass)
+    - KL is the generalized Kullback-Leibler divergence :math:`KL(x, y)=\sum_i x_i\log(x_i/y_i) - x_i + y_i`
+
+    The algorithm used for solving the problem is the generalized
+    Sinkhorn-Knopp matrix scaling algorithm as proposed in [10]_. As in
+    ot.sinkhorn2 the returned loss is the transport cost
+    :math:`<\gamma,M>_F` of the optimal matrix.
+
+
+    Parameters
+    ----------
+    a : np.ndarray (ns,)
+        samples weights in the source domain
+    b : np.ndarray (nt,) or np.ndarray (nt,nbb)
+        samples in the target domain, compute sinkhorn with multiple targets
+        and fixed M if b is a matrix (return OT loss + dual variables in log)
+    M : np.ndarray (ns,nt)
+        loss matrix
+    reg : float
+        Entropy regularization term >0
+    reg_m : float
+        Marginal relaxation term >0
+    method : str
+        method used for the solver either 'sinkhorn' or
+        'sinkhorn_stabilized', see those function for specific parameters
+    numItermax : int, optional
+        Max number of iterations
+    stopThr : float, optional
+        Stop threshol on error (>0)
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+
+
+    Returns
+    -------
+    W : (nbb) ndarray
+        Optimal transportation loss for the given parameters
+    log : dict
+        log dictionary return only if log==True in parameters
+
+    Examples
+    --------
+
+    >>> import ot
+    >>> a=[.5,.5]
+    >>> b=[.5,.5]
+    >>> M=[[0.,1.],[1.,0.]]
+    >>> ot.unbalanced.sinkhorn_unbalanced2(a,b,M,1,1)
+    array([ 0.37614065])
+
+
+    References
+    ----------
+
+    .. [10] Chizat, L., Peyré, G., Schmitzer, B., & Vialard, F. X. (2016). Scaling algorithms for unbalanced transport problems. arXiv preprint arXiv:1607.05816.
+
+
+    See Also
+    --------
+    ot.unbalanced.sinkhorn_knopp_unbalanced : Unbalanced Sinkhorn [10]
+    ot.unbalanced.sinkhorn_stabilized_unbalanced : Log stabilized unbalanced Sinkhorn [9][10]
+    ot.bregman.sinkhorn2 : Entropic regularized OT loss (balanced)
+
+    """
+
+    b = np.asarray(b, dtype=np.float64)
+    if len(b.shape) < 2:
+        b = b.reshape((-1, 1))
+
+    return sinkhorn_unbalanced(a, b, M, reg, reg_m, method=method,
+                               numItermax=numItermax, stopThr=stopThr,
+                               verbose=verbose, log=log, **kwargs)
+
+
+def sinkhorn_knopp_unbalanced(a, b, M, reg, reg_m, numItermax=1000,
+                              stopThr=1e-9, warmstart=None, verbose=False,
+                              log=False, **kwargs):
+    """
+    Solve the entropic regularization unbalanced optimal transport problem
+
+    The function solves the following optimization problem:
+
+    .. math::
+        \gamma = arg\min_\gamma <\gamma,M>_F + reg\cdot\Omega(\gamma) + reg_m KL(\gamma 1, a) + reg_m KL(\gamma^T 1, b)
+
+        s.t.
+             \gamma\geq 0
+    where :
+
+    - M is the (ns,nt) metric cost matrix
+    - :math:`\Omega` is the entropic regularization term :math:`\Omega(\gamma)=\sum_{i,j} \gamma_{i,j}\log(\gamma_{i,j})`
+    - a and b are source and target weights (not necessarily with the same total mass)
+    - KL is the generalized Kullback-Leibler divergence :math:`KL(x, y)=\sum_i x_i\log(x_i/y_i) - x_i + y_i`
+
+    The algorithm used for solving the problem is the generalized
+    Sinkhorn-Knopp matrix scaling algorithm as proposed in [10]_: the
+    scalings of :math:`\gamma=diag(u)Kdiag(v)` are updated with
+    :math:`u=(a/Kv)^{reg_m/(reg_m+reg)}` and
+    :math:`v=(b/K^Tu)^{reg_m/(reg_m+reg)}`.
+
+
+    Parameters
+    ----------
+    a : np.ndarray (ns,)
+        samples weights in the source domain
+    b : np.ndarray (nt,) or np.ndarray (nt,nbb)
+        samples in the target domain, compute sinkhorn with multiple targets
+        and fixed M if b is a matrix (return OT loss + dual variables in log)
+    M : np.ndarray (ns,nt)
+        loss matrix
+    reg : float
+        Entropy regularization term >0
+    reg_m : float
+        Marginal relaxation term >0
+    numItermax : int, optional
+        Max number of iterations
+    stopThr : float, optional
+        Stop threshol on the relative change of the scalings (>0)
+    warmstart : tuple of vectors, optional
+        if given then starting values (alpha, beta) for the dual potentials,
+        the scalings are initialized to :math:`u=\exp(\\alpha/reg)` and
+        :math:`v=\exp(\\beta/reg)` (see log['warmstart'])
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+
+
+    Returns
+    -------
+    gamma : (ns x nt) ndarray
+        Optimal transportation matrix for the given parameters
+    log : dict
+        log dictionary return only if log==True in parameters
+
+    Examples
+    --------
+
+    >>> import ot
+    >>> a=[.5,.5]
+    >>> b=[.5,.5]
+    >>> M=[[0.,1.],[1.,0.]]
+    >>> ot.unbalanced.sinkhorn_knopp_unbalanced(a,b,M,1,1)
+    array([[ 0.51122814,  0.18807032],
+           [ 0.18807032,  0.51122814]])
+
+
+    References
+    ----------
+
+    .. [10] Chizat, L., Peyré, G., Schmitzer, B., & Vialard, F. X. (2016). Scaling algorithms for unbalanced transport problems. arXiv preprint arXiv:1607.05816.
+
+
+    See Also
+    --------
+    ot.unbalanced.sinkhorn_stabilized_unbalanced : Log stabilized unbalanced Sinkhorn [9][10]
+    ot.bregman.sinkhorn_knopp : Classic Sinkhorn [2]
+
+    """
+
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    M = np.asarray(M, dtype=np.float64)
+
+    Nini, Nfin = M.shape
+
+    if len(a) == 0:
+        a = np.ones((Nini,), dtype=np.float64) / Nini
+    if len(b) == 0:
+        b = np.ones((Nfin,), dtype=np.float64) / Nfin
+
+    # number of problems to solve at once
+    if len(b.shape) > 1:
+        nbb = b.shape[1]
+        a = a.reshape((-1, 1))
+    else:
+        nbb = 0
+
+    if log:
+        log = {'err': []}
+
+    if warmstart is not None:
+        u = np.exp(np.asarray(warmstart[0], dtype=np.float64) / reg)
+        v = np.exp(np.asarray(warmstart[1], dtype=np.float64) / reg)
+        if nbb:
+            u = u.reshape((Nini, -1)) * np.ones((1, nbb))
+            v = v.reshape((Nfin, -1)) * np.ones((1, nbb))
+    elif nbb:
+        u = np.ones((Nini, nbb))
+        v = np.ones((Nfin, nbb))
+    else:
+        u = np.ones(Nini)
+        v = np.ones(Nfin)
+
+    K = np.exp(-M / reg)
+
+    fi = reg_m / (reg_m + reg)
+
+    cpt = 0
+    err = 1
+    while (err > stopThr and cpt < numItermax):
+        uprev = u
+        vprev = v
+
+        Kv = np.dot(K, v)
+        u = (a / Kv)**fi
+        KtransposeU = np.dot(K.T, u)
+        v = (b / KtransposeU)**fi
+
+        # a zero in K^Tu gives an infinite or nan value in v
+        if not np.isfinite(np.sum(u) + np.sum(v)):
+            # we have reached the machine precision
+            # come back to previous solution and quit loop
+            print('Warning: numerical errors at iteration', cpt)
+            u = uprev
+            v = vprev
+            break
+        if cpt % 10 == 0:
+            # we can speed up the process by checking for the error only all
+            # the 10th iterations
+            err = np.sum((u - uprev)**2) / np.sum((u)**2) + \
+                np.sum((v - vprev)**2) / np.sum((v)**2)
+            if log:
+                log['err'].append(err)
+
+            if verbose:
+                if cpt % 200 == 0:
+                    print(
+                        '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
+                print('{:5d}|{:8e}|'.format(cpt, err))
+        cpt = cpt + 1
+
+    if log:
+        log['u'] = u
+        log['v'] = v
+        log['warmstart'] = (reg * np.log(u), reg * np.log(v))
+        log['niter'] = cpt
+
+    if nbb:  # return only loss
+        # all the losses at once without computing the OT matrices
+        res = np.sum(u * np.dot(K * M, v), 0)
+        if log:
+            return res, log
+        else:
+            return res
+
+    else:  # return OT matrix
+
+        if log:
+            return u.reshape((-1, 1)) * K * v.reshape((1, -1)), log
+        else:
+            return u.reshape((-1, 1)) * K * v.reshape((1, -1))
+
+
+def sinkhorn_stabilized_unbalanced(a, b, M, reg, reg_m, numItermax=1000,
+                                   tau=1e5, stopThr=1e-9, warmstart=None,
+                                   verbose=False, log=False, memory=2**28,
+                                   **kwargs):
+    """
+    Solve the entropic regularization unbalanced optimal transport problem with log stabilization
+
+    The function solves the following optimization problem:
+
+    .. math::
+        \gamma = arg\min_\gamma <\gamma,M>_F + reg\cdot\Omega(\gamma) + reg_m KL(\gamma 1, a) + reg_m KL(\gamma^T 1, b)
+
+        s.t.
+             \gamma\geq 0
+    where :
+
+    - M is the (ns,nt) metric cost matrix
+    - :math:`\Omega` is the entropic regularization term :math:`\Omega(\gamma)=\sum_{i,j} \gamma_{i,j}\log(\gamma_{i,j})`
+    - a and b are source and target weights (not necessarily with the same total mass)
+    - KL is the generalized Kullback-Leibler divergence :math:`KL(x, y)=\sum_i x_i\log(x_i/y_i) - x_i + y_i`
+
+    The algorithm used for solving the problem is the generalized
+    Sinkhorn-Knopp matrix scaling algorithm as proposed in [10]_ with the
+    log stabilization of [9]_: the scalings larger than tau are absorbed in
+    the dual potentials stored in the kernel
+    :math:`K=\exp((\\alpha+\\beta^T-M)/reg)`. With multiple targets one
+    kernel per target is stored (nbb,ns,nt) and the iterations are batched
+    matrix products. The kernels (c,ns,nt) of at most c targets fit in
+    memory, larger numbers of targets are solved by chunks of c targets.
+
+
+    Parameters
+    ----------
+    a : np.ndarray (ns,)
+        samples weights in the source domain
+    b : np.ndarray (nt,) or np.ndarray (nt,nbb)
+        samples in the target domain, compute sinkhorn with multiple targets
+        and fixed M if b is a matrix (return OT loss + dual variables in log)
+    M : np.ndarray (ns,nt)
+        loss matrix
+    reg : float
+        Entropy regularization term >0
+    reg_m : float
+        Marginal relaxation term >0
+    numItermax : int, optional
+        Max number of iterations
+    tau : float
+        thershold for max value in u or v for log scaling
+    stopThr : float, optional
+        Stop threshol on the relative change of the scalings (>0)
+    warmstart : tuple of vectors, optional
+        if given then starting values (alpha, beta) for the dual potentials,
+        of shape (ns,nbb) and (nt,nbb) for one value per target if b is a
+        matrix (see log['warmstart'])
+    verbose : bool, optional
+        Print information along iterations
+    log : bool, optional
+        record log if True
+    memory : int, optional
+        Memory in bytes available for the kernels of multiple targets, the
+        targets are solved by chunks of memory//(8*ns*nt) targets
+
+
+    Returns
+    -------
+    gamma : (ns x nt) ndarray
+        Optimal transportation matrix for the given parameters
+    log : dict
+        log dictionary return only if log==True in parameters
+
+    Examples
+    --------
+
+    >>> import ot
+    >>> a=[.5,.5]
+    >>> b=[.5,.5]
+    >>> M=[[0.,1.],[1.,0.]]
+    >>> ot.unbalanced.sinkhorn_stabilized_unbalanced(a,b,M,1,1)
+    array([[ 0.51122814,  0.18807032],
+           [ 0.18807032,  0.51122814]])
+
+
+    References
+    ----------
+
+    .. [9] Schmitzer, B. (2016). Stabilized Sparse Scaling Algorithms for Entropy Regularized Transport Problems. arXiv preprint arXiv:1610.06519.
+
+    .. [10] Chizat, L., Peyré, G., Schmitzer, B., & Vialard, F. X. (2016). Scaling algorithms for unbalanced transport problems. arXiv preprint arXiv:1607.05816.
+
+
+    See Also
+    --------
+    ot.unbalanced.sinkhorn_knopp_unbalanced : Unbalanced Sinkhorn [10]
+    ot.bregman.sinkhorn_stabilized : Stabilized sinkhorn [9][10]
+
+    """
+
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    M = np.asarray(M, dtype=np.float64)
+
+    na, nb = M.shape
+
+    if len(a) == 0:
+        a = np.ones((na,), dtype=np.float64) / na
+    if len(b) == 0:
+        b = np.ones((nb,), dtype=np.float64) / nb
+
+    # test if multiple target
+    if len(b.shape) > 1:
+        nbb = b.shape[1]
+    else:
+        nbb = 0
+
+    # number of targets whose kernels fit in memory
+    nchunk = max(1, int(memory // (8 * M.size)))
+    if nbb > nchunk:
+        # solve the targets by chunks
+        alpha = beta = None
+        if warmstart is not None:
+            alpha = np.asarray(warmstart[0], dtype=np.float64).reshape(
+                (na, -1)) * np.ones((1, nbb))
+            beta = np.asarray(warmstart[1], dtype=np.float64).reshape(
+                (nb, -1)) * np.ones((1, nbb))
+        res = []
+        logs = []
+        for i in range(0, nbb, nchunk):
+            idx = slice(i, i + nchunk)
+            res_i, log_i = sinkhorn_stabilized_unbalanced(
+                a, b[:, idx], M, reg, reg_m, numItermax=numItermax, tau=tau,
+                stopThr=stopThr, verbose=verbose, log=True, memory=memory,
+                warmstart=None if alpha is None else (alpha[:, idx],
+                                                      beta[:, idx]))
+            res.append(res_i)
+            logs.append(log_i)
+        res = np.concatenate(res)
+        if log:
+            log = {'err': [log_i['err'] for log_i in logs],
+                   'niter': [log_i['niter'] for log_i in logs]}
+            for key in ['alpha', 'beta']:
+                log[key] = np.concatenate([log_i[key] for log_i in logs], 1)
+            log['warmstart'] = (log['alpha'], log['beta'])
+            return res, log
+        else:
+            return res
+
+    # the 1D problem is solved as a problem with one target
+    B = b.reshape((nb, -1))
+    nprob = B.shape[1]
+    A = a.reshape((na, 1))
+
+    if log:
+        log = {'err': []}
+
+    # potentials of each problem
+    if warmstart is None:
+        alpha, beta = np.zeros((na, nprob)), np.zeros((nb, nprob))
+    else:
+        alpha = np.asarray(warmstart[0], dtype=np.float64).reshape(
+            (na, -1)) * np.ones((1, nprob))
+        beta = np.asarray(warmstart[1], dtype=np.float64).reshape(
+            (nb, -1)) * np.ones((1, nprob))
+
+    u, v = np.ones((na, nprob)), np.ones((nb, nprob))
+
+    def get_K(alpha, beta):
+        """log space computation of the (nprob,na,nb) kernels"""
+        return np.exp(-(M[None, :, :] - alpha.T[:, :, None] -
+                        beta.T[:, None, :]) / reg)
+
+    def dot(K, v):
+        """products K_k v_k for all problems"""
+        return np.matmul(K, v.T[:, :, None])[:, :, 0].T
+
+    K = get_K(alpha, beta)
+    Kt = K.transpose((0, 2, 1))
+
+    fi = reg_m / (reg_m + reg)
+
+    cpt = 0
+    err = 1
+    while (err > stopThr and cpt < numItermax):
+        uprev = u
+        vprev = v
+
+        # scaling of the absorbed problem (see [10] algo 2)
+        Kv = dot(K, v)
+        u = (A / Kv)**fi * np.exp(-alpha * (1 - fi) / reg)
+        KtransposeU = dot(Kt, u)
+        v = (B / KtransposeU)**fi * np.exp(-beta * (1 - fi) / reg)
+
+        # a zero in K^Tu gives an infinite or nan value in v
+        if not np.isfinite(np.sum(u) + np.sum(v)):
+            # we have reached the machine precision
+            # come back to previous solution and quit loop
+            print('Warning: numerical errors at iteration', cpt)
+            u = uprev
+            v = vprev
+            break
+
+        if cpt % 10 == 0:
+            # we can speed up the process by checking for the error only all
+            # the 10th iterations
+            err = np.sum((u - uprev)**2) / np.sum((u)**2) + \
+                np.sum((v - vprev)**2) / np.sum((v)**2)
+            if log:
+                log['err'].append(err)
+
+            if verbose:
+                if cpt % 200 == 0:
+                    print(
+                        '{:5s}|{:12s}'.format('It.', 'Err') + '\n' + '-' * 19)
+                print('{:5d}|{:8e}|'.format(cpt, err))
+
+        # remove numerical problems and store them in K
+        if np.abs(u).max() > tau or np.abs(v).max() > tau:
+            alpha = alpha + reg * np.log(u)
+            beta = beta + reg * np.log(v)
+            u, v = np.ones((na, nprob)), np.ones((nb, nprob))
+            K = get_K(alpha, beta)
+            Kt = K.transpose((0, 2, 1))
+
+        cpt = cpt + 1
+
+    alpha = alpha + reg * np.log(u)
+    beta = beta + reg * np.log(v)
+
+    if not nbb:
+        alpha, beta = alpha[:, 0], beta[:, 0]
+
+    if log:
+        log['alpha'] = alpha
+        log['beta'] = beta
+        log['warmstart'] = (alpha, beta)
+        log['niter'] = cpt
+
+    if nbb:  # return only loss
+        # without the (nbb,ns,nt) product of the kernels with M
+        res = np.einsum('ik,kij,ij,jk->k', u, K, M, v)
+        if log:
+            return res, log
+        else:
+            return res
+
+    else:  # return OT matrix
+        G = get_K(alpha.reshape((-1, 1)), beta.reshape((-1, 1)))[0]
+        if log:
+            return G, log
+        else:
+            return G
@@ -34,12 +34,16 @@ setup(name='POT',
       author_email='remi.flamary@gmail.com, ncourty@gmail.com',
       url='https://github.com/rflamary/POT',
       packages=find_packages(),
-      ext_modules = cythonize(Extension(
+      ext_modules = cythonize([Extension(
                 "ot.lp.emd_wrap",                                # the extension name
                  sources=["ot/lp/emd_wrap.pyx", "ot/lp/EMD_wrapper.cpp"], # the Cython source and
                                                         # additional C++ source files
                  language="c++",                        # generate and compile C++ code,
-                 include_dirs=[numpy.get_include(),os.path.join(ROOT,'ot/lp')])),
+                 include_dirs=[numpy.get_include(),os.path.join(ROOT,'ot/lp')]),
+                Extension(
+                "ot.bregman_wrap",                               # fused Sinkhorn kernels
+                 sources=["ot/bregman_wrap.pyx"],
+                 include_dirs=[numpy.get_include()])]),
       platforms=['linux','macosx','windows'],
       download_url='https://github.com/rflamary/POT/archive/{}.tar.gz'.format(__version__),
       license = 'MIT',
@@ -0,0 +1,50 @@
+"""Tests for module autodiff on differentiable OT losses """
+
+# License: MIT License
+
+import numpy as np
+import ot
+import pytest
+
+try:  # test if autograd is installed
+    import ot.autodiff
+    import autograd
+    import autograd.numpy as anp
+    nogo = False
+except ImportError:
+    nogo = True
+
+
+@pytest.mark.skipif(nogo, reason="Missing modules (autograd)")
+def test_autodiff():
+    n = 20
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n, 2)
+    y = rng.randn(n + 5, 2)
+    a = ot.unif(n)
+    b = ot.unif(n + 5)
+
+    def dist(x, y):
+        return anp.sum((x[:, None, :] - y[None, :, :])**2, 2)
+
+    # gradient wrt the positions of the samples
+    for loss in [lambda x: ot.autodiff.emd2(a, b, dist(x, y)),
+                 lambda x: ot.autodiff.sinkhorn2(a, b, dist(x, y), 1,
+                                                 stopThr=1e-12)]:
+        gx = autograd.grad(loss)(x)
+
+        eps = 1e-6
+        dx = rng.randn(n, 2)
+        dW = (loss(x + eps * dx) - loss(x - eps * dx)) / (2 * eps)
+        np.testing.assert_allclose(dW, np.sum(gx * dx), rtol=1e-4)
+
+    # gradient wrt the weights
+    ga = autograd.grad(lambda a: ot.autodiff.emd2(a, b, ot.dist(x, y)))(a)
+    W, log = ot.emd2(a, b, ot.dist(x, y), grad=True)
+    np.testing.assert_allclose(ga, log['grad_a'])
+
+    gb = autograd.grad(lambda b: ot.autodiff.sinkhorn2(a, b, ot.dist(x, y),
+                                                       1))(b)
+    W, log = ot.sinkhorn2(a, b, ot.dist(x, y), 1, grad=True)
+    np.testing.assert_allclose(gb, log['grad_b'])
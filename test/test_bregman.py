@@ -4,7 +4,10 @@
 #
 # License: MIT License
 
+import warnings
+
 import numpy as np
+import scipy.sparse as sp
 import ot
 
 
@@ -56,6 +59,65 @@ def test_sinkhorn_empty():
     np.testing.assert_allclose(u, G.sum(0), atol=1e-05)
 
 
+def test_greenkhorn():
+    # test greenkhorn
+    n = 100
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n, 2)
+    u = ot.utils.unif(n)
+
+    M = ot.dist(x, x)
+
+    G, log = ot.sinkhorn(u, u, M, 1, method='greenkhorn', numItermax=10000,
+                         stopThr=1e-12, log=True, verbose=True)
+    G0 = ot.sinkhorn(u, u, M, 1, stopThr=1e-10)
+
+    # check constratints and value
+    np.testing.assert_allclose(u, G.sum(1), atol=1e-05)
+    np.testing.assert_allclose(u, G.sum(0), atol=1e-05)
+    np.testing.assert_allclose(G0, G, atol=1e-05)
+    assert log['err'][-1] <= 1e-12
+
+    # default budget of the dispatcher counts sweeps of greedy updates
+    G, log = ot.sinkhorn(u, u, M, 1, method='greenkhorn', log=True)
+    assert log['niter'] > 1000
+    assert log['err'][-1] <= 1e-9
+
+    # loss with multiple targets
+    loss = ot.sinkhorn2(u, u, M, 1, method='greenkhorn', numItermax=10000,
+                        stopThr=1e-12)
+    np.testing.assert_allclose(loss, np.sum(G0 * M), atol=1e-05)
+
+
+def test_sinkhorn_batch():
+    # test sinkhorn on a stack of problems
+    n_batch, n, m = 10, 20, 30
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n_batch, n, 2)
+    y = rng.randn(n_batch, m, 2)
+    M = np.stack([ot.dist(x[k], y[k]) for k in range(n_batch)])
+
+    a = ot.unif(n)
+    b = rng.rand(n_batch, m)
+    b /= b.sum(1, keepdims=True)
+
+    G, log = ot.sinkhorn(a, b, M, 1, stopThr=1e-12, log=True, verbose=True)
+    loss = ot.sinkhorn2(a, b, M, 1, stopThr=1e-12)
+
+    assert G.shape == (n_batch, n, m)
+    assert loss.shape == (n_batch,)
+    for k in range(n_batch):
+        Gk = ot.sinkhorn(a, b[k], M[k], 1, stopThr=1e-12)
+        np.testing.assert_allclose(Gk, G[k], atol=1e-06)
+        np.testing.assert_allclose(np.sum(Gk * M[k]), loss[k], atol=1e-06)
+
+    # check constratints
+    np.testing.assert_allclose(b, G.sum(1), atol=1e-05)
+    np.testing.assert_allclose(np.tile(a, (n_batch, 1)), G.sum(2), atol=1e-05)
+
+
 def test_sinkhorn_variants():
     # test sinkhorn
     n = 100
@@ -78,6 +140,544 @@ def test_sinkhorn_variants():
     np.testing.assert_allclose(G0, Gerr)
 
 
+def test_sinkhorn_acceleration():
+    # test accelerated sinkhorn for small regularization
+    n_bins = 100
+    a = ot.datasets.get_1D_gauss(n_bins, m=20, s=5)
+    b = ot.datasets.get_1D_gauss(n_bins, m=60, s=10)
+
+    M = ot.utils.dist0(n_bins)
+    M /= M.max()
+
+    G0, log0 = ot.sinkhorn(a, b, M, 2e-3, numItermax=10000, stopThr=1e-12,
+                           log=True)
+
+    for acceleration in ['overrelaxation', 'anderson']:
+        G, log = ot.sinkhorn(a, b, M, 2e-3, numItermax=10000, stopThr=1e-12,
+                             acceleration=acceleration, log=True)
+
+        np.testing.assert_allclose(G0, G, atol=1e-06)
+        np.testing.assert_allclose(b, G.sum(0), atol=1e-06)
+        assert log['niter'] < log0['niter']
+        assert log['naccel'] > 0
+
+    # multiple targets
+    bb = np.vstack((b, a)).T
+    loss0 = ot.sinkhorn2(a, bb, M, 1e-2, stopThr=1e-12)
+    loss = ot.sinkhorn2(a, bb, M, 1e-2, stopThr=1e-12,
+                        acceleration='anderson')
+    np.testing.assert_allclose(loss0, loss, rtol=1e-6)
+
+    # targets of different difficulty, each with its own mixing weights
+    bb = np.vstack((b, a, ot.datasets.get_1D_gauss(n_bins, m=40, s=3))).T
+    loss0, log0 = ot.sinkhorn2(a, bb, M, 5e-3, numItermax=20000,
+                               stopThr=1e-14, log=True)
+    loss, log = ot.sinkhorn2(a, bb, M, 5e-3, numItermax=20000, stopThr=1e-14,
+                             acceleration='anderson', log=True)
+    np.testing.assert_allclose(loss0, loss, rtol=1e-8)
+    assert log['niter'] < log0['niter']
+
+
+def test_sinkhorn_newton():
+    # test sinkhorn newton for high accuracy
+    n = 100
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n, 2)
+    y = rng.randn(n + 50, 2)
+    u = ot.utils.unif(n)
+    b = rng.rand(n + 50)
+    b /= b.sum()
+
+    M = ot.dist(x, y)
+    M /= M.max()
+
+    G0 = ot.sinkhorn(u, b, M, 1e-2, numItermax=10000, stopThr=1e-20)
+    G, log = ot.sinkhorn(u, b, M, 1e-2, method='sinkhorn_newton',
+                         stopThr=1e-20, log=True, verbose=True)
+
+    np.testing.assert_allclose(G0, G, atol=1e-09)
+    np.testing.assert_allclose(u, G.sum(1), atol=1e-10)
+    np.testing.assert_allclose(b, G.sum(0), atol=1e-10)
+    assert log['niter'] < 10
+
+    # multiple targets
+    bb = np.vstack((b, ot.unif(n + 50))).T
+    loss0 = ot.sinkhorn2(u, bb, M, 1e-2, numItermax=10000, stopThr=1e-20)
+    loss = ot.sinkhorn2(u, bb, M, 1e-2, method='sinkhorn_newton',
+                        stopThr=1e-20)
+    np.testing.assert_allclose(loss0, loss)
+
+
+def test_sinkhorn_lbfgs():
+    # test dual and semi-dual solvers with non uniform weights
+    n = 100
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n, 2)
+    y = rng.randn(n + 50, 2)
+    a = rng.rand(n)**4
+    a /= a.sum()
+    b = rng.rand(n + 50)**4
+    b /= b.sum()
+
+    M = ot.dist(x, y)
+    M /= M.max()
+
+    G0 = ot.sinkhorn(a, b, M, 1e-2, numItermax=10000, stopThr=1e-16)
+
+    for method in ['lbfgs_dual', 'lbfgs_semidual']:
+        G, log = ot.sinkhorn(a, b, M, 1e-2, method=method, stopThr=1e-11,
+                             log=True)
+
+        np.testing.assert_allclose(G0, G, atol=1e-06)
+        np.testing.assert_allclose(a, G.sum(1), atol=1e-05)
+        np.testing.assert_allclose(b, G.sum(0), atol=1e-05)
+        np.testing.assert_allclose(G, log['u'][:, None] * np.exp(-M / 1e-2) *
+                                   log['v'][None, :])
+
+    # multiple targets
+    bb = np.vstack((b, ot.unif(n + 50))).T
+    loss0 = ot.sinkhorn2(a, bb, M, 1e-2, numItermax=10000, stopThr=1e-16)
+    loss = ot.sinkhorn2(a, bb, M, 1e-2, method='lbfgs_semidual',
+                        stopThr=1e-11)
+    np.testing.assert_allclose(loss0, loss, rtol=1e-5)
+
+
+def test_sinkhorn_parallel():
+    # test compiled sinkhorn
+    n = 100
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n, 2)
+    y = rng.randn(n + 50, 2)
+    u = ot.utils.unif(n)
+
+    M = ot.dist(x, y)
+
+    G0 = ot.sinkhorn(u, [], M, 1, stopThr=1e-14)
+    G, log = ot.sinkhorn(u, [], M, 1, method='sinkhorn_parallel',
+                         stopThr=1e-14, n_threads=3, log=True, verbose=True)
+
+    np.testing.assert_allclose(G0, G, atol=1e-08)
+    np.testing.assert_allclose(u, G.sum(1), atol=1e-07)
+    assert 0 < log['niter'] < 1000
+
+    # multiple targets
+    b = rng.rand(n + 50, 2)
+    b /= b.sum(0, keepdims=True)
+    loss0 = ot.sinkhorn2(u, b, M, 1, stopThr=1e-14)
+    loss, log = ot.sinkhorn2(u, b, M, 1, method='sinkhorn_parallel',
+                             stopThr=1e-14, log=True)
+    np.testing.assert_allclose(loss0, loss, rtol=1e-6)
+    assert len(log['niter']) == 2
+
+
+def test_sinkhorn_sparse_weights():
+    # test the removal of the bins without mass
+    n = 50
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n, 2)
+    y = rng.randn(n, 2)
+    M = ot.dist(x, y)
+    M /= M.max()
+
+    a = rng.rand(n) * (rng.rand(n) < 0.3)
+    a /= a.sum()
+    b = rng.rand(n) * (rng.rand(n) < 0.3)
+    b /= b.sum()
+    ia, ib = a > 0, b > 0
+
+    G0 = ot.bregman.sinkhorn_knopp(a[ia], b[ib], M[ia, :][:, ib], 5e-2,
+                                   stopThr=1e-12)
+
+    for method in ['sinkhorn', 'sinkhorn_stabilized', 'greenkhorn',
+                   'lbfgs_dual']:
+        G, log = ot.sinkhorn(a, b, M, 5e-2, method=method, stopThr=1e-12,
+                             numItermax=10000, log=True)
+        assert G.shape == (n, n)
+        np.testing.assert_allclose(G0, G[ia, :][:, ib], atol=1e-6)
+        np.testing.assert_allclose(0, G[~ia].sum())
+        np.testing.assert_allclose(0, G[:, ~ib].sum())
+        assert log['warmstart'][0].shape == (n,)
+
+        # resume from the potentials of the full problem
+        G2 = ot.sinkhorn(a, b, M, 5e-2, method=method, stopThr=1e-12,
+                         numItermax=10000, warmstart=log['warmstart'])
+        np.testing.assert_allclose(G, G2, atol=1e-6)
+
+    # the solvers called directly also solve on the support of the weights
+    for solver in [ot.bregman.sinkhorn_knopp, ot.bregman.sinkhorn_stabilized,
+                   ot.bregman.greenkhorn]:
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            G = solver(a, b, M, 5e-2, stopThr=1e-12, numItermax=10000)
+        assert len(w) == 0
+        np.testing.assert_allclose(G0, G[ia, :][:, ib], atol=1e-6)
+
+    # truncated sparse kernel
+    for method in ['sinkhorn_stabilized', 'sinkhorn_epsilon_scaling']:
+        G = ot.sinkhorn(a, b, M, 5e-2, method=method, stopThr=1e-12,
+                        sparse_thr=1e-20)
+        assert sp.issparse(G) and G.shape == (n, n)
+        np.testing.assert_allclose(G0, G.toarray()[ia, :][:, ib], atol=1e-6)
+        np.testing.assert_allclose(0, G.toarray()[~ia].sum())
+
+    # losses and finite gradients
+    W, log = ot.sinkhorn2(a, b, M, 5e-2, stopThr=1e-12, grad=True)
+    np.testing.assert_allclose(W, np.sum(G0 * M[ia, :][:, ib]), rtol=1e-6)
+    np.testing.assert_allclose(log['reg_loss'], np.sum(G0 * M[ia, :][:, ib]) +
+                               5e-2 * np.sum(G0 * np.log(G0)))
+    assert np.all(np.isfinite(log['grad_a']))
+    assert np.all(np.isfinite(log['grad_b']))
+
+    W = ot.sinkhorn2(a, np.vstack((b, b)).T, M, 5e-2, stopThr=1e-12)
+    np.testing.assert_allclose(W, np.sum(G0 * M[ia, :][:, ib]) * np.ones(2),
+                               rtol=1e-6)
+
+
+def test_sinkhorn_stopping():
+    # test the stopping criteria of sinkhorn_knopp
+    n = 100
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n, 2)
+    y = rng.randn(n, 2) + 1
+    u = ot.utils.unif(n)
+
+    M = ot.dist(x, y)
+    M /= M.max()
+
+    G0 = ot.sinkhorn(u, u, M, 1e-2, stopThr=1e-14, numItermax=10000)
+
+    for stopping in ['marginal', 'potentials', 'gap', 'unknown']:
+        G, log = ot.sinkhorn(u, u, M, 1e-2, stopThr=1e-10, stopping=stopping,
+                             numItermax=10000, print_period=5, log=True)
+        np.testing.assert_allclose(G0, G, atol=1e-6)
+        assert log['niter'] % 5 == 1
+        assert log['err'][-1] <= 1e-10
+
+    assert log['stopping'] == 'marginal'
+
+    # the gap gives an accuracy on the dual objective
+    G, log = ot.sinkhorn(u, u, M, 1e-2, stopThr=1e-8, stopping='gap',
+                         log=True)
+    f, g = log['warmstart']
+    dual = np.sum(f * u) + np.sum(g * u) - 1e-2 * np.sum(G)
+    f, g = ot.sinkhorn(u, u, M, 1e-2, stopThr=1e-14, numItermax=10000,
+                       log=True)[1]['warmstart']
+    dual0 = np.sum(f * u) + np.sum(g * u) - 1e-2 * np.sum(G0)
+    assert abs(dual0 - dual) < 1e-7
+
+
+def test_sinkhorn_warmstart():
+    # test that all the variants restart from the potentials of a close problem
+    n = 100
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n, 2)
+    y = rng.randn(n + 50, 2)
+    a = ot.unif(n)
+    b = ot.unif(n + 50)
+
+    M = ot.dist(x, y)
+    M /= M.max()
+    M2 = M + 1e-2 * rng.rand(n, n + 50)
+
+    G0, log0 = ot.sinkhorn(a, b, M2, 1e-2, stopThr=1e-14, log=True)
+    warmstart = ot.sinkhorn(a, b, M, 1e-2, stopThr=1e-14,
+                            log=True)[1]['warmstart']
+
+    G, log = ot.sinkhorn(a, b, M2, 1e-2, stopThr=1e-14, warmstart=warmstart,
+                         log=True)
+    np.testing.assert_allclose(G0, G, atol=1e-08)
+    assert log['niter'] < log0['niter']
+
+    for method in ['greenkhorn', 'sinkhorn_parallel', 'sinkhorn_newton',
+                   'lbfgs_dual', 'lbfgs_semidual', 'sinkhorn_stabilized']:
+        G, log = ot.sinkhorn(a, b, M2, 1e-2, method=method, stopThr=1e-12,
+                             numItermax=100000, warmstart=warmstart,
+                             log=True)
+        np.testing.assert_allclose(G0, G, atol=1e-06)
+        np.testing.assert_allclose(G, np.exp((log['warmstart'][0][:, None] +
+                                              log['warmstart'][1][None, :] -
+                                              M2) / 1e-2), atol=1e-08)
+
+    # multiple targets with shared potentials
+    bb = np.vstack((b, b)).T
+    loss0 = ot.sinkhorn2(a, bb, M2, 1e-2, stopThr=1e-14)
+    loss = ot.sinkhorn2(a, bb, M2, 1e-2, stopThr=1e-14, warmstart=warmstart)
+    np.testing.assert_allclose(loss0, loss)
+
+
+def test_sinkhorn_path():
+    # test that the path gives the same solutions as independent solvers
+    n = 100
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n, 2)
+    y = rng.randn(n + 50, 2)
+    a = ot.unif(n)
+    b = ot.unif(n + 50)
+
+    M = ot.dist(x, y)
+    M /= M.max()
+
+    regs = [1e-2, 1e-1, 1e-3, 1]
+
+    path = list(ot.bregman.sinkhorn_path(a, b, M, regs, stopThr=1e-12,
+                                         numItermax=10000, log=True))
+    np.testing.assert_allclose([p[0] for p in path], sorted(regs)[::-1])
+
+    for reg, G, log in path:
+        G0 = ot.sinkhorn(a, b, M, reg, method='sinkhorn_stabilized',
+                         stopThr=1e-12, numItermax=10000)
+        np.testing.assert_allclose(G0, G, atol=1e-05)
+
+    # multiple targets
+    bb = np.vstack((b, ot.unif(n + 50))).T
+    for reg, loss in ot.bregman.sinkhorn_path(a, bb, M, regs[:2],
+                                              method='sinkhorn', stopThr=1e-14):
+        np.testing.assert_allclose(ot.sinkhorn2(a, bb, M, reg, stopThr=1e-14),
+                                   loss, rtol=1e-6)
+
+
+def test_sinkhorn2_multiple_targets():
+    # test the losses computed at once against the per target OT matrices
+    n = 100
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n, 2)
+    a = ot.unif(n)
+    bb = rng.dirichlet(np.ones(n), 3).T
+
+    M = ot.dist(x, x)
+    M /= M.max()
+
+    for method in ['sinkhorn', 'sinkhorn_stabilized']:
+        loss = ot.sinkhorn2(a, bb, M, 1e-1, method=method, stopThr=1e-14)
+        loss0 = [np.sum(ot.sinkhorn(a, b, M, 1e-1, method=method,
+                                    stopThr=1e-14) * M) for b in bb.T]
+        np.testing.assert_allclose(loss0, loss, rtol=1e-6)
+
+    loss = ot.sinkhorn2(a, bb, M, 1e-1, method='sinkhorn_stabilized',
+                        stopThr=1e-14, sparse_thr=1e-20)
+    np.testing.assert_allclose(loss0, loss, rtol=1e-6)
+
+    # batch of problems
+    MM = np.stack((M, M**2, np.sqrt(M)))
+    loss = ot.sinkhorn2(a, a, MM, 1e-1, stopThr=1e-14)
+    loss0 = [ot.sinkhorn2(a, a, Mi, 1e-1, stopThr=1e-14) for Mi in MM]
+    np.testing.assert_allclose(np.ravel(loss0), loss)
+
+
+def test_sinkhorn_stabilized_multiple_targets():
+    # test the stabilized solvers on several targets at once for small reg
+    n = 100
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n, 2)
+    a = ot.unif(n)
+    bb = rng.dirichlet(np.ones(n), 3).T
+
+    M = ot.dist(x, x)
+    M /= M.max()
+
+    for method in ['sinkhorn_stabilized', 'sinkhorn_epsilon_scaling']:
+        loss, log = ot.sinkhorn2(a, bb, M, 1e-3, method=method,
+                                 numItermax=10000, stopThr=1e-12, log=True)
+        loss0 = [ot.sinkhorn2(a, b, M, 1e-3, method=method, numItermax=10000,
+                              stopThr=1e-12)[0] for b in bb.T]
+        np.testing.assert_allclose(loss0, loss, rtol=1e-3)
+
+        # one potential per target
+        alpha, beta = log['warmstart']
+        assert alpha.shape == (n, 3) and beta.shape == (n, 3)
+        G = np.exp((alpha[:, None, :] + beta[None, :, :] - M[:, :, None]) /
+                   1e-3)
+        np.testing.assert_allclose(bb, G.sum(0), atol=1e-6)
+        np.testing.assert_allclose(np.sum(G * M[:, :, None], (0, 1)), loss)
+
+    # warm start from the potentials of the targets
+    loss, log = ot.sinkhorn2(a, bb, M, 1e-3, method='sinkhorn_stabilized',
+                             warmstart=log['warmstart'], stopThr=1e-12,
+                             log=True)
+    np.testing.assert_allclose(loss0, loss, rtol=1e-3)
+    assert len(log['err']) == 1
+
+    # kernels of two targets in memory, solved by chunks
+    loss, log = ot.sinkhorn2(a, bb, M, 1e-3, method='sinkhorn_stabilized',
+                             numItermax=10000, stopThr=1e-12,
+                             memory=2 * 8 * n * n, log=True)
+    np.testing.assert_allclose(loss0, loss, rtol=1e-3)
+    assert len(log['err']) == 2
+    assert log['warmstart'][0].shape == (n, 3)
+
+    # targets with distant supports
+    M = ot.utils.dist0(n)
+    M /= M.max()
+    a = ot.datasets.get_1D_gauss(n, m=50, s=10)
+    bb = np.vstack((ot.datasets.get_1D_gauss(n, m=10, s=3),
+                    ot.datasets.get_1D_gauss(n, m=90, s=3))).T
+    loss = ot.sinkhorn2(a, bb, M, 1e-3, method='sinkhorn_stabilized',
+                        numItermax=10000, stopThr=1e-10)
+    loss0 = [ot.sinkhorn2(a, b, M, 1e-3, method='sinkhorn_stabilized',
+                          numItermax=10000, stopThr=1e-10)[0] for b in bb.T]
+    np.testing.assert_allclose(loss0, loss, rtol=1e-5)
+
+
+def test_sinkhorn_divergence():
+    # test the shared computation against independent sinkhorn2
+    n = 100
+    rng = np.random.RandomState(0)
+
+    Xs = rng.randn(n, 2)
+    Xt = rng.randn(n + 50, 2) + 1
+    a = ot.unif(n)
+    b = rng.rand(n + 50)
+    b /= b.sum()
+
+    S, log = ot.bregman.sinkhorn_divergence(Xs, Xt, a, b, 1e-1,
+                                            stopThr=1e-14, log=True)
+
+    def loss(X, Y, p, q):
+        return ot.sinkhorn2(p, q, ot.dist(X, Y), 1e-1, stopThr=1e-14)[0]
+
+    loss0 = [loss(Xs, Xt, a, b), loss(Xs, Xs, a, a), loss(Xt, Xt, b, b)]
+    np.testing.assert_allclose(loss0, log['loss'], rtol=1e-5)
+    np.testing.assert_allclose(loss0[0] - (loss0[1] + loss0[2]) / 2, S,
+                               rtol=1e-5)
+
+    # symmetric OT matrices of the self terms
+    Gs = log['us'][:, None] * np.exp(-ot.dist(Xs, Xs) / 1e-1) * log['us']
+    np.testing.assert_allclose(a, Gs.sum(0), atol=1e-7)
+
+    # null divergence between identical distributions
+    S = ot.bregman.sinkhorn_divergence(Xs, Xs, a, a, 1e-1, stopThr=1e-14)
+    np.testing.assert_allclose(S, 0, atol=1e-6)
+
+
+def test_sinkhorn_sparse_kernel():
+    # test truncated sparse kernel in stabilized sinkhorn
+    n = 100
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n, 2)
+    u = ot.utils.unif(n)
+
+    M = ot.dist(x, x)
+    M /= M.max()
+
+    for method in ['sinkhorn_stabilized', 'sinkhorn_epsilon_scaling']:
+        G = ot.sinkhorn(u, u, M, 1e-2, method=method, stopThr=1e-10)
+        Gs = ot.sinkhorn(u, u, M, 1e-2, method=method, stopThr=1e-10,
+                         sparse_thr=1e-20)
+
+        assert sp.issparse(Gs)
+        Gs = Gs.toarray()
+        np.testing.assert_allclose(G, Gs, atol=1e-08)
+        np.testing.assert_allclose(u, Gs.sum(0), atol=1e-05)
+
+    # multiple targets
+    b = np.vstack((u, u)).T
+    loss = ot.sinkhorn2(u, b, M, 1e-1, method='sinkhorn_stabilized')
+    loss_s = ot.sinkhorn2(u, b, M, 1e-1, method='sinkhorn_stabilized',
+                          sparse_thr=1e-20)
+    np.testing.assert_allclose(loss, loss_s)
+
+
+def test_sinkhorn_nystrom():
+
+    n = 100
+    rng = np.random.RandomState(0)
+
+    Xs = rng.randn(n, 2)
+    Xt = rng.randn(n + 50, 2) + 1
+    M = ot.dist(Xs, Xt)
+
+    reg = 5
+
+    G = ot.sinkhorn([], [], M, reg, stopThr=1e-12)
+
+    Gs, Gt, log = ot.bregman.sinkhorn_nystrom([], [], Xs, Xt, reg, rank=10,
+                                              stopThr=1e-12, random_state=0,
+                                              log=True)
+    G_nystrom = Gs.dot(Gt.T)
+
+    assert log['rank'] > 10  # adaptive rank
+    np.testing.assert_allclose(G, G_nystrom, atol=1e-6)
+    np.testing.assert_allclose(
+        np.ones(n + 50) / (n + 50), G_nystrom.sum(0), atol=1e-9)
+
+    # same landmarks for the same random_state
+    Gs2, Gt2 = ot.bregman.sinkhorn_nystrom([], [], Xs, Xt, reg, rank=10,
+                                           stopThr=1e-12, random_state=0)
+    np.testing.assert_allclose(Gs, Gs2)
+
+    # rank bounded by maxRank
+    Gs, Gt, log = ot.bregman.sinkhorn_nystrom([], [], Xs, Xt, reg, rank=10,
+                                              maxRank=20, random_state=0,
+                                              log=True)
+    assert log['rank'] <= 20
+
+
+def test_sinkhorn_lazy():
+
+    n = 100
+    rng = np.random.RandomState(0)
+
+    Xs = rng.randn(n, 2)
+    Xt = rng.randn(n + 50, 2) + 1
+
+    reg = 1
+
+    for metric in ['sqeuclidean', 'euclidean']:
+        M = ot.dist(Xs, Xt, metric=metric)
+        G = ot.sinkhorn([], [], M, reg, stopThr=1e-14)
+
+        # small memory budget to use several blocks and threads
+        alpha, beta, get_G, log = ot.bregman.sinkhorn_lazy(
+            [], [], Xs, Xt, reg, metric=metric, stopThr=1e-14, memory=2**14,
+            n_threads=2, log=True)
+
+        np.testing.assert_allclose(G, get_G(np.arange(n)), atol=1e-7)
+        np.testing.assert_allclose(
+            G[:10], np.exp((alpha[:10, None] + beta[None, :] - M[:10]) / reg),
+            atol=1e-7)
+
+
+def test_sinkhorn_memmap(tmpdir):
+
+    n = 100
+    rng = np.random.RandomState(0)
+
+    M = rng.rand(n, n + 50)
+    fname = str(tmpdir.join('M.npy'))
+    np.save(fname, M)
+
+    a = ot.unif(n)
+    b = ot.unif(n + 50)
+
+    G = ot.sinkhorn(a, b, M, 1e-1, stopThr=1e-15)
+
+    # small memory budget to read M by several blocks
+    G_m = ot.sinkhorn(a, b, fname, 1e-1, stopThr=1e-15, memory=2**14,
+                      out=str(tmpdir.join('G.npy')))
+
+    assert isinstance(G_m, np.memmap)
+    np.testing.assert_allclose(G, G_m, atol=1e-9)
+    np.testing.assert_allclose(G, np.load(str(tmpdir.join('G.npy'))),
+                               atol=1e-9)
+
+    # multiple targets
+    bb = np.vstack((b, rng.dirichlet(np.ones(n + 50)))).T
+    loss = ot.sinkhorn2(a, bb, M, 1e-1, stopThr=1e-12)
+    loss_m = ot.sinkhorn2(a, bb, np.load(fname, mmap_mode='r'), 1e-1,
+                          stopThr=1e-12, memory=2**14)
+    np.testing.assert_allclose(loss, loss_m, rtol=1e-6)
+
+
 def test_bary():
 
     n_bins = 100  # nb bins
@@ -105,6 +705,191 @@ def test_bary():
     ot.bregman.barycenter(A, M, reg, log=True, verbose=True)
 
 
+def test_bary_sparse():
+
+    n_bins = 100  # nb bins
+    rng = np.random.RandomState(0)
+
+    # sparse histograms
+    A = rng.rand(n_bins, 3) * (rng.rand(n_bins, 1) < 0.2)
+    A /= A.sum(0)
+
+    # loss matrix + normalization
+    M = ot.utils.dist0(n_bins)
+    M /= M.max()
+
+    # the removed bins are equivalent to bins with a negligible mass
+    A2 = A + 1e-300
+    for method in ['sinkhorn', 'sinkhorn_stabilized']:
+        bary = ot.bregman.barycenter(A, M, 1e-2, method=method,
+                                     stopThr=1e-10)
+        bary2 = ot.bregman.barycenter(A2, M, 1e-2, method=method,
+                                      stopThr=1e-10)
+        np.testing.assert_allclose(bary, bary2, atol=1e-12)
+
+        # the barycenter has mass out of the support of the histograms
+        assert np.all(bary > 0)
+
+
+def test_bary_warmstart():
+
+    n_bins = 100  # nb bins
+
+    # Gaussian distributions
+    a1 = ot.datasets.get_1D_gauss(n_bins, m=20, s=5)  # m= mean, s= std
+    a2 = ot.datasets.get_1D_gauss(n_bins, m=60, s=8)
+
+    A = np.vstack((a1, a2)).T
+
+    # slightly moved distributions
+    A2 = A.copy()
+    A2[:, 0] = ot.datasets.get_1D_gauss(n_bins, m=21, s=5)
+
+    # loss matrix + normalization
+    M = ot.utils.dist0(n_bins)
+    M /= M.max()
+
+    for method in ['sinkhorn', 'sinkhorn_stabilized']:
+        bary0, log0 = ot.bregman.barycenter(A, M, 1e-2, method=method,
+                                            stopThr=1e-8, log=True)
+        bary, log = ot.bregman.barycenter(A2, M, 1e-2, method=method,
+                                          stopThr=1e-8, log=True)
+        bary_ws, log_ws = ot.bregman.barycenter(
+            A2, M, 1e-2, method=method, stopThr=1e-8, log=True,
+            warmstart=log0['warmstart'])
+
+        np.testing.assert_allclose(bary, bary_ws, atol=1e-9)
+        assert log_ws['niter'] < log['niter']
+
+    # the potentials are shared between the methods
+    bary_ws, log_ws = ot.bregman.barycenter(
+        A, M, 1e-2, method='sinkhorn', stopThr=1e-8, log=True,
+        warmstart=log0['warmstart'])
+    np.testing.assert_allclose(bary0, bary_ws, atol=1e-9)
+    assert log_ws['niter'] == 1
+
+
+def test_bary_groups():
+
+    n_bins = 50  # nb bins
+    rng = np.random.RandomState(0)
+
+    # 5 groups of 3 distributions
+    A = rng.rand(5, n_bins, 3)
+    A /= A.sum(1, keepdims=True)
+    weights = rng.rand(5, 3)
+    weights /= weights.sum(1, keepdims=True)
+
+    # loss matrix + normalization
+    M = ot.utils.dist0(n_bins)
+    M /= M.max()
+
+    reg = 1e-2
+    bary, log = ot.bregman.barycenter(A, M, reg, weights, log=True)
+
+    assert bary.shape == (5, n_bins)
+    assert log['niter'].shape == (5,)
+    for k in range(5):
+        np.testing.assert_allclose(
+            ot.bregman.barycenter(A[k], M, reg, weights[k]), bary[k])
+
+    # shared weights
+    bary = ot.bregman.barycenter(A, M, reg, weights[0])
+    np.testing.assert_allclose(
+        ot.bregman.barycenter(A[3], M, reg, weights[0]), bary[3])
+
+
+def test_bary_stabilized():
+
+    n_bins = 100  # nb bins
+
+    # Gaussian distributions
+    a1 = ot.datasets.get_1D_gauss(n_bins, m=20, s=5)  # m= mean, s= std
+    a2 = ot.datasets.get_1D_gauss(n_bins, m=60, s=8)
+
+    A = np.vstack((a1, a2)).T
+
+    # loss matrix + normalization
+    M = ot.utils.dist0(n_bins)
+    M /= M.max()
+
+    bary0 = ot.bregman.barycenter(A, M, 1e-2, stopThr=1e-10)
+    bary = ot.bregman.barycenter(A, M, 1e-2, method='sinkhorn_stabilized',
+                                 stopThr=1e-10)
+    np.testing.assert_allclose(bary0, bary, atol=1e-10)
+
+    # small reg where the kernel underflows
+    bary, log = ot.bregman.barycenter(A, M, 1e-4, numItermax=10000,
+                                      method='sinkhorn_stabilized',
+                                      stopThr=1e-10, log=True)
+    np.testing.assert_allclose(1, np.sum(bary))
+    assert np.argmax(bary) == 40
+    assert log['niter'] < 10000
+
+    # epsilon scaling
+    bary_e, log_e = ot.bregman.barycenter(A, M, 1e-4, numItermax=10000,
+                                          method='sinkhorn_stabilized',
+                                          epsilon0=1e-1, stopThr=1e-10,
+                                          log=True)
+    np.testing.assert_allclose(bary, bary_e, atol=1e-8)
+    assert log_e['niter'] < log['niter']
+
+    # no iteration
+    bary = ot.bregman.barycenter(A, M, 1e-2, method='sinkhorn_stabilized',
+                                 numItermax=0)
+    assert bary.shape == (n_bins,)
+
+    # no potential on the bins without mass
+    A[:10] = 0
+    bary, log = ot.bregman.barycenter(A, M, 1e-2, method='sinkhorn_stabilized',
+                                      log=True)
+    assert np.all(log['beta'][:10] == -np.inf)
+    assert np.all(np.isfinite(log['beta'][10:]))
+
+
+def test_convolutional():
+
+    n = 12  # side of the grid
+    rng = np.random.RandomState(0)
+
+    A = rng.rand(2, n, n)
+    A /= A.sum(axis=(1, 2), keepdims=True)
+
+    # squared euclidean cost between the points of the grid in [0,1]^2
+    t = np.linspace(0, 1, n)
+    xx, yy = np.meshgrid(t, t, indexing='ij')
+    x = np.vstack((xx.ravel(), yy.ravel())).T
+    M = ot.dist(x, x)
+
+    reg = 5e-2
+
+    loss = ot.sinkhorn2(A[0].ravel(), A[1].ravel(), M, reg, stopThr=1e-12)
+    loss_conv = ot.bregman.convolutional_sinkhorn2(A[0], A[1], reg,
+                                                   stopThr=1e-12)
+    np.testing.assert_allclose(loss, loss_conv, rtol=1e-5)
+
+    bary = ot.bregman.barycenter(A.reshape((2, -1)).T, M, reg,
+                                 stopThr=1e-12)
+    bary_conv, log = ot.bregman.convolutional_barycenter(A, reg,
+                                                         stopThr=1e-12,
+                                                         log=True,
+                                                         verbose=True)
+
+    np.testing.assert_allclose(1, np.sum(bary_conv))
+    np.testing.assert_allclose(bary, bary_conv.ravel(), atol=1e-7)
+
+    # warm start on slightly moved histograms
+    A2 = A * (1 + 1e-2 * rng.rand(2, n, n))
+    A2 /= A2.sum(axis=(1, 2), keepdims=True)
+    bary2, log2 = ot.bregman.convolutional_barycenter(A2, reg, stopThr=1e-12,
+                                                      log=True)
+    bary_ws, log_ws = ot.bregman.convolutional_barycenter(
+        A2, reg, stopThr=1e-12, log=True, warmstart=log['warmstart'])
+    assert log['warmstart'][0].shape == A.shape
+    np.testing.assert_allclose(bary2, bary_ws, atol=1e-9)
+    assert log_ws['niter'] < log2['niter']
+
+
 def test_unmix():
 
     n_bins = 50  # nb bins
@@ -135,3 +920,104 @@ def test_unmix():
 
     ot.bregman.unmix(a, D, M, M0, h0, reg,
                      1, alpha=0.01, log=True, verbose=True)
+
+
+def test_unmix_batch():
+
+    n_bins = 50  # nb bins
+
+    # Gaussian distributions
+    a1 = ot.datasets.get_1D_gauss(n_bins, m=20, s=10)  # m= mean, s= std
+    a2 = ot.datasets.get_1D_gauss(n_bins, m=40, s=10)
+    a = ot.datasets.get_1D_gauss(n_bins, m=30, s=10)
+
+    D = np.vstack((a1, a2)).T
+    A = np.vstack((a, a1, a2, 0.3 * a1 + 0.7 * a2)).T
+
+    # loss matrix + normalization
+    M = ot.utils.dist0(n_bins)
+    M /= M.max()
+
+    M0 = ot.utils.dist0(2)
+    M0 /= M0.max()
+    h0 = ot.unif(2)
+
+    reg = 1e-3
+    H = np.array([ot.bregman.unmix(A[:, i], D, M, M0, h0, reg, 1, alpha=0.01,
+                                   stopThr=1e-9)
+                  for i in range(A.shape[1])]).T
+
+    # one observation per chunk
+    Hb, log = ot.bregman.unmix_batch(A, D, M, M0, h0, reg, 1, alpha=0.01,
+                                     stopThr=1e-9, memory=1, n_threads=2,
+                                     log=True)
+
+    np.testing.assert_allclose(H, Hb, rtol=1e-6)
+    assert len(log['err']) == A.shape[1]
+
+    Hb = ot.bregman.unmix_batch(A, D, M, M0, np.tile(h0[:, None], (1, 4)),
+                                reg, 1, alpha=0.01, stopThr=1e-9,
+                                verbose=True)
+    np.testing.assert_allclose(H, Hb, rtol=1e-5)
+
+
+def test_sinkhorn2_grad():
+    n = 20
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n, 2)
+    y = rng.randn(n + 5, 2)
+    a = ot.unif(n)
+    b = rng.rand(n + 5)
+    b /= b.sum()
+
+    M = ot.dist(x, y)
+    M /= M.max()
+    reg = 1e-1
+
+    def reg_loss(a, b, M):
+        G = ot.sinkhorn(a, b, M, reg, stopThr=1e-14, numItermax=10000)
+        return np.sum(G * M) + reg * np.sum(G * np.log(G))
+
+    eps = 1e-6
+    da = rng.randn(n)
+    da -= da.mean()
+    db = rng.randn(n + 5)
+    db -= db.mean()
+    dM = rng.randn(n, n + 5)
+
+    for method in ['sinkhorn', 'sinkhorn_stabilized', 'greenkhorn']:
+        W, log = ot.sinkhorn2(a, b, M, reg, method=method, stopThr=1e-12,
+                              numItermax=10000, grad=True)
+
+        G = ot.sinkhorn(a, b, M, reg, method=method, stopThr=1e-12,
+                        numItermax=10000)
+        np.testing.assert_allclose(G, log['grad_M'], atol=1e-8)
+
+        # the transport loss is returned, the function that is
+        # differentiated is in the log
+        np.testing.assert_allclose(W, np.sum(G * M), rtol=1e-6)
+        np.testing.assert_allclose(log['reg_loss'], reg_loss(a, b, M),
+                                   rtol=1e-6)
+
+        dW = (reg_loss(a + eps * da, b, M) -
+              reg_loss(a - eps * da, b, M)) / (2 * eps)
+        np.testing.assert_allclose(dW, np.dot(log['grad_a'], da), rtol=1e-4)
+        dW = (reg_loss(a, b + eps * db, M) -
+              reg_loss(a, b - eps * db, M)) / (2 * eps)
+        np.testing.assert_allclose(dW, np.dot(log['grad_b'], db), rtol=1e-4)
+        dW = (reg_loss(a, b, M + eps * dM) -
+              reg_loss(a, b, M - eps * dM)) / (2 * eps)
+        np.testing.assert_allclose(dW, np.sum(log['grad_M'] * dM), rtol=1e-4)
+
+    # multiple targets and stack of problems
+    W, log = ot.sinkhorn2(a, np.vstack((b, b)).T, M, reg, grad=True)
+    assert log['grad_M'].shape == (2, n, n + 5)
+    assert log['grad_b'].shape == (n + 5, 2)
+
+    W, log = ot.sinkhorn2(a, b, np.stack((M, 2 * M)), reg, grad=True)
+    assert log['grad_M'].shape == (2, n, n + 5)
+    assert log['grad_a'].shape == (2, n)
+    np.testing.assert_allclose(W[0], np.sum(log['grad_M'][0] * M), rtol=1e-6)
+    np.testing.assert_allclose(log['reg_loss'][0], reg_loss(a, b, M),
+                               rtol=1e-6)
@@ -65,3 +65,33 @@ def test_generalized_conditional_gradient():
 
     np.testing.assert_allclose(a, G.sum(1), atol=1e-05)
     np.testing.assert_allclose(b, G.sum(0), atol=1e-05)
+
+
+def test_generalized_conditional_gradient_warmstart():
+    # test that warm starting the Sinkhorn problems does not change the
+    # solution of gcg
+    n_bins = 100  # nb bins
+    x = np.arange(n_bins, dtype=np.float64)
+
+    a = ot.datasets.get_1D_gauss(n_bins, m=20, s=5)  # m= mean, s= std
+    b = ot.datasets.get_1D_gauss(n_bins, m=60, s=10)
+
+    M = ot.dist(x.reshape((n_bins, 1)), x.reshape((n_bins, 1)))
+    M /= M.max()
+
+    def f(G):
+        return 0.5 * np.sum(G**2)
+
+    def df(G):
+        return G
+
+    reg1 = 1e-2
+    reg2 = 1e-1
+
+    G, log = ot.optim.gcg(a, b, M, reg1, reg2, f, df, stopThr=1e-12,
+                          log=True)
+    G0, log0 = ot.optim.gcg(a, b, M, reg1, reg2, f, df, stopThr=1e-12,
+                            warmstart=False, log=True)
+
+    np.testing.assert_allclose(log0['loss'][-1], log['loss'][-1], rtol=1e-9)
+    np.testing.assert_allclose(G0, G, atol=1e-6)
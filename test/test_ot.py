@@ -21,6 +21,9 @@ def test_doctest():
     # test bregman solver
     doctest.testmod(ot.bregman, verbose=True)
 
+    # test unbalanced solver
+    doctest.testmod(ot.unbalanced, verbose=True)
+
 
 def test_emd_emd2():
     # test emd and emd2 for simple identity
@@ -206,3 +209,57 @@ def check_duality_gap(a, b, M, G, u, v, cost):
     # Check that reduced cost is zero on transport arcs
     np.testing.assert_array_almost_equal((M - u.reshape(-1, 1) - v.reshape(1, -1))[ind1, ind2],
                                          np.zeros(ind1.size))
+
+
+def test_free_support_barycenter():
+    # barycenter of translated point clouds is the mean translation
+    n = 50
+    rng = np.random.RandomState(0)
+
+    X = rng.randn(n, 2)
+    shifts = [np.array([1., 0.]), np.array([0., 2.]), np.array([-2., 1.])]
+    measures_locations = [X + c for c in shifts]
+    measures_weights = [ot.unif(n)] * 3
+
+    X_init = rng.randn(n, 2)
+
+    bary, log = ot.lp.free_support_barycenter(measures_locations,
+                                              measures_weights, X_init,
+                                              log=True)
+
+    bary0 = X + np.mean(shifts, 0)
+    np.testing.assert_allclose(
+        0, ot.emd2(ot.unif(n), ot.unif(n), ot.dist(bary, bary0)), atol=1e-10)
+    assert log['err'][-1] <= 1e-7
+
+    # entropic OT matrices
+    bary_s = ot.lp.free_support_barycenter(measures_locations,
+                                           measures_weights, X_init,
+                                           reg=1, processes=1)
+    np.testing.assert_allclose(bary_s.mean(0), bary0.mean(0), atol=1e-4)
+
+
+def test_emd2_grad():
+    n = 20
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n, 2)
+    y = rng.randn(n + 5, 2)
+    a = rng.rand(n)
+    a /= a.sum()
+    b = ot.unif(n + 5)
+
+    M = ot.dist(x, y)
+
+    W, log = ot.emd2(a, b, M, grad=True)
+    G = ot.emd(a, b, M)
+
+    np.testing.assert_allclose(G, log['grad_M'])
+    np.testing.assert_allclose(0, np.sum(log['grad_a']), atol=1e-10)
+
+    # directional derivatives
+    eps = 1e-7
+    da = rng.randn(n)
+    da -= da.mean()
+    dW = (ot.emd2(a + eps * da, b, M) - ot.emd2(a - eps * da, b, M)) / (2 * eps)
+    np.testing.assert_allclose(dW, np.dot(log['grad_a'], da), rtol=1e-5)
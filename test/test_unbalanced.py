@@ -0,0 +1,128 @@
+"""Tests for module unbalanced on regularized unbalanced OT"""
+
+# License: MIT License
+
+import numpy as np
+import ot
+
+
+def test_sinkhorn_unbalanced():
+    # test the fixed point of the scaling algorithm
+    n = 100
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n, 2)
+    a = ot.utils.unif(n)
+
+    # target with a different total mass
+    b = 2 * ot.utils.unif(n)
+
+    M = ot.dist(x, x)
+    reg, reg_m = 1., 1.
+
+    G, log = ot.unbalanced.sinkhorn_unbalanced(a, b, M, reg, reg_m,
+                                               stopThr=1e-12, log=True)
+
+    K = np.exp(-M / reg)
+    fi = reg_m / (reg_m + reg)
+    u, v = log['u'], log['v']
+    np.testing.assert_allclose(u, (a / K.dot(v))**fi, rtol=1e-5)
+    np.testing.assert_allclose(v, (b / K.T.dot(u))**fi, rtol=1e-5)
+    np.testing.assert_allclose(G, u[:, None] * K * v[None, :])
+
+    # stabilized version
+    G2 = ot.unbalanced.sinkhorn_unbalanced(a, b, M, reg, reg_m,
+                                           method='sinkhorn_stabilized',
+                                           stopThr=1e-12)
+    np.testing.assert_allclose(G, G2, atol=1e-10)
+
+    # unknown method
+    G3 = ot.unbalanced.sinkhorn_unbalanced(a, b, M, reg, reg_m,
+                                           method='unknown', stopThr=1e-12,
+                                           verbose=True)
+    np.testing.assert_allclose(G, G3)
+
+
+def test_sinkhorn_unbalanced_balanced_limit():
+    # large reg_m gives the balanced solution
+    n = 50
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n, 2)
+    a = ot.utils.unif(n)
+
+    M = ot.dist(x, x)
+    M /= M.max()
+
+    G0 = ot.sinkhorn(a, a, M, 1e-1, stopThr=1e-12)
+    G = ot.sinkhorn_unbalanced(a, a, M, 1e-1, 1e6, stopThr=1e-14,
+                               numItermax=100000)
+    np.testing.assert_allclose(G0, G, atol=1e-6)
+
+
+def test_sinkhorn_unbalanced_stabilized():
+    # small reg where the classic scalings overflow
+    n = 50
+    rng = np.random.RandomState(0)
+
+    xs = rng.randn(n, 2)
+    xt = rng.randn(n, 2) + 1
+    a = ot.utils.unif(n)
+    b = 3 * ot.utils.unif(n)
+
+    M = ot.dist(xs, xt)
+    M /= M.max()
+    reg, reg_m = 2e-3, 1.
+
+    G, log = ot.unbalanced.sinkhorn_stabilized_unbalanced(
+        a, b, M, reg, reg_m, stopThr=1e-10, numItermax=10000, log=True)
+
+    assert np.all(np.isfinite(G))
+
+    # fixed point on the dual potentials in log domain
+    fi = reg_m / (reg_m + reg)
+    alpha, beta = log['alpha'], log['beta']
+    lse = np.log(np.sum(np.exp((alpha[:, None] + beta[None, :] - M) / reg),
+                        0)) - beta / reg
+    np.testing.assert_allclose(beta, fi * reg * (np.log(b) - lse), atol=1e-6)
+
+    # warmstart from the solution
+    G2, log2 = ot.unbalanced.sinkhorn_stabilized_unbalanced(
+        a, b, M, reg, reg_m, stopThr=1e-10, log=True,
+        warmstart=log['warmstart'])
+    np.testing.assert_allclose(G, G2, atol=1e-8)
+    assert log2['niter'] < 10
+
+
+def test_sinkhorn_unbalanced_multiple_targets():
+    # test the batched multiple targets mode
+    n = 50
+    nbb = 4
+    rng = np.random.RandomState(0)
+
+    x = rng.randn(n, 2)
+    a = ot.utils.unif(n)
+    b = rng.rand(n, nbb)
+
+    M = ot.dist(x, x)
+
+    for method in ['sinkhorn', 'sinkhorn_stabilized']:
+        loss = ot.unbalanced.sinkhorn_unbalanced2(a, b, M, 1, 1,
+                                                  method=method, stopThr=1e-12)
+        loss0 = [np.sum(M * ot.unbalanced.sinkhorn_unbalanced(
+            a, b[:, i], M, 1, 1, method=method, stopThr=1e-12))
+            for i in range(nbb)]
+        np.testing.assert_allclose(loss0, loss, rtol=1e-6)
+
+    # kernels of two targets in memory, solved by chunks
+    loss2, log = ot.unbalanced.sinkhorn_unbalanced2(
+        a, b, M, 1, 1, method='sinkhorn_stabilized', stopThr=1e-12,
+        memory=2 * 8 * n * n, log=True)
+    np.testing.assert_allclose(loss, loss2)
+    assert log['alpha'].shape == (n, nbb)
+    assert len(log['niter']) == 2
+
+    # loss with one target
+    loss, log = ot.unbalanced.sinkhorn_unbalanced2(a, b[:, 0], M, 1, 1,
+                                                   log=True)
+    assert loss.shape == (1,)